@@ -0,0 +1,92 @@
+"""
+Benchmark of the extraction of the body of the pages of the Siemens
+printouts, without their running header and footer.
+
+For each printout of the corpus, the body rectangle is learned from the
+first page (`body_clip`), and every other page is extracted (text only)
+both in full and within that rectangle. The time saved per page, and
+the number of lines that are not extracted, are reported. The lines of
+the body must be the same.
+
+Usage
+-----
+python benchmarks/bench_clip.py [REPEAT] [PDF ...]
+"""
+import sys
+import glob
+import time
+from pathlib import Path
+from importlib import import_module
+
+import pymupdf
+
+from protocol2bids.vendors.siemens.utils import body_clip, TEXT_FLAGS
+
+ROOT = Path(__file__).parent.parent
+
+
+def guess_version(doc):
+    text = doc[0].get_text()
+    if text.startswith('Table of contents'):
+        return 've'
+    for version, tag in (('va', 'syngo MR A'), ('va', 'syngo MR 20'),
+                         ('vb', 'syngo MR B'), ('vd', 'syngo MR D')):
+        if tag in text:
+            return version
+    return None
+
+
+def extract(page, repeat, clip=None):
+    """Best time and lines of the text extraction of a page"""
+    best = float('inf')
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        pagedict = page.get_textpage(clip=clip, flags=TEXT_FLAGS) \
+            .extractDICT()
+        best = min(best, time.perf_counter() - tic)
+    lines = [
+        ''.join([span['text'] for span in line['spans']])
+        for block in pagedict['blocks'] for line in block['lines']
+    ]
+    return best, lines
+
+
+def main(repeat, paths):
+    total = {}
+    for path in paths:
+        doc = pymupdf.open(path)
+        version = guess_version(doc)
+        if version is None or len(doc) < 2:
+            continue
+        mod = import_module(f'protocol2bids.vendors.siemens.{version}')
+        clip = body_clip(doc[0], mod._MARGINS, mod._FURNITURE)
+        if clip is None:
+            print(f'{path}: no header or footer')
+            continue
+        times = total.setdefault(version, [0, 0.0, 0.0, 0])
+        for page in list(doc)[1:]:
+            t_full, full = extract(page, repeat)
+            t_clip, clipped = extract(page, repeat, clip)
+            body = [text for text in full if not mod._MARGINS(text)]
+            if body != [text for text in clipped if not mod._MARGINS(text)]:
+                print(f'{path}: page {page.number} body differs')
+            for i, value in enumerate((1, t_full, t_clip,
+                                       len(full) - len(clipped))):
+                times[i] += value
+
+    print(f'{"":>4} {"pages":>6} {"full [us]":>10} {"clip [us]":>10} '
+          f'{"saved":>6} {"lines":>6}  (per page)')
+    for version, (pages, t_full, t_clip, lines) in total.items():
+        print(f'{version:>4} {pages:6d} {t_full / pages * 1e6:10.1f} '
+              f'{t_clip / pages * 1e6:10.1f} '
+              f'{1 - t_clip / t_full:6.1%} {lines / pages:6.1f}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = int(args.pop(0)) if args and args[0].isdigit() else 5
+    if not args:
+        args = sorted(
+            glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'), recursive=True)
+        )
+    main(repeat, args)
@@ -0,0 +1,60 @@
+"""
+Time the conversion of printouts to sidecars, from the PDF and from a
+dump of the parsed protocol tree (`protocol2bids dump`).
+
+The second column is what it costs to re-run the keymaps
+(`siemens_to_bids`) after a change, once the corpus has been dumped.
+
+Usage
+-----
+python benchmarks/bench_dump.py [PDF ...]
+
+Without arguments, all printouts in `datasets/pdf` are used.
+"""
+import sys
+import glob
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+from protocol2bids import cli
+
+ROOT = Path(__file__).parent.parent
+
+
+def timeit(func, *args, **kwargs):
+    tic = time.perf_counter()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        return float('nan')
+    return time.perf_counter() - tic
+
+
+def main(paths):
+    logging.disable(logging.CRITICAL)
+    tmp = Path(tempfile.mkdtemp())
+    total_pdf = total_dump = 0
+    print(f'{"pdf [ms]":>9} {"dump [ms]":>9}  path')
+    for i, path in enumerate(paths):
+        dump = tmp / f'{i}.json'
+        try:
+            cli.dump(path, dump)
+        except Exception:
+            continue
+        t_pdf = timeit(cli.protocol2bids, path, tmp / 'pdf.json')
+        t_dump = timeit(cli.protocol2bids, dump, tmp / 'dump.json',
+                        from_dump=True)
+        total_pdf += t_pdf
+        total_dump += t_dump
+        print(f'{t_pdf*1e3:9.1f} {t_dump*1e3:9.1f}  {path}')
+    print(f'{total_pdf*1e3:9.1f} {total_dump*1e3:9.1f}  total')
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:]
+    if not paths:
+        paths = sorted(glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'),
+                                 recursive=True))
+    main(paths)
@@ -0,0 +1,139 @@
+"""
+Benchmark of the page geometry of the Siemens parsers.
+
+The text dictionaries of each printout of the corpus are extracted
+once, and then turned into rows of lines and column edges with:
+
+* "loop": the previous implementation, which grouped the lines of
+  each block into rows in a Python loop (`abs(y0 - y) < 1`), and took
+  the column edges of the first page only (running `min` over boxes);
+* "array": `iter_page_layouts` (`page_lines` and `page_alignment` on
+  every page) and `line_rows`.
+
+Both must find the same rows. Pages whose column edges differ from
+those of the first page are counted.
+
+Usage
+-----
+python benchmarks/bench_geometry.py [REPEAT] [PDF ...]
+"""
+import sys
+import glob
+import time
+from pathlib import Path
+from importlib import import_module
+
+import pymupdf
+
+from protocol2bids.vendors.siemens.utils import (
+    page_dict, line_rows, iter_page_layouts,
+)
+
+ROOT = Path(__file__).parent.parent
+
+
+def guess_version(doc):
+    text = doc[0].get_text()
+    if text.startswith('Table of contents'):
+        return 've'
+    for version, tag in (('va', 'syngo MR A'), ('va', 'syngo MR 20'),
+                         ('vb', 'syngo MR B'), ('vd', 'syngo MR D')):
+        if tag in text:
+            return version
+    return None
+
+
+def loop_rows(pagedict):
+    """Previous (loop) grouping of the lines of each block into rows"""
+    rows = []
+    for block in pagedict['blocks']:
+        y = None
+        for line in block.get('lines', ()):
+            text = ''.join([span['text'] for span in line['spans']])
+            if y is not None and abs(line['bbox'][1] - y) < 1:
+                rows[-1].append(text)
+            else:
+                rows.append([text])
+            y = line['bbox'][1]
+    return rows
+
+
+def loop_alignment(pagedict, pagewidth, title, skip):
+    """Previous (loop) column edges, VB flavour"""
+    lines = [
+        (''.join([span['text'] for span in line['spans']]), line['bbox'])
+        for block in pagedict['blocks'] for line in block.get('lines', ())
+    ]
+    top = max((
+        box[3] for text, box in lines if text.startswith(title)
+    ), default=float('-inf'))
+    colx = {'L': float('inf'), 'R': float('inf')}
+    for text, box in lines:
+        if box[1] < top or skip(text):
+            continue
+        column = 'L' if box[0] < pagewidth / 2 else 'R'
+        colx[column] = min(colx[column], box[0])
+    return colx
+
+
+def array_rows(pagedicts, pagewidth, title, skip):
+    """Rows and column edges of each page, from its geometry"""
+    for texts, lines, colx in iter_page_layouts(
+        pagedicts, pagewidth, title, skip
+    ):
+        starts = line_rows(lines).tolist()
+        rows = [
+            texts[start:stop]
+            for start, stop in zip(starts, starts[1:] + [len(texts)])
+        ]
+        yield rows, colx
+
+
+def main(repeat, paths):
+    print(f'{"":>4} {"pages":>6} {"loop [us]":>10} {"array [us]":>11} '
+          f'{"changed":>8}  (per page)')
+    total = {}
+    for path in paths:
+        doc = pymupdf.open(path)
+        version = guess_version(doc)
+        if version is None:
+            continue
+        mod = import_module(f'protocol2bids.vendors.siemens.{version}')
+        pagedicts = [page_dict(page) for page in doc]
+        # VD printouts have a single column
+        pagewidth = float('inf') if version == 'vd' else doc[0].bound()[2]
+        args = (pagewidth, mod._TITLE, mod._FURNITURE)
+
+        tic = time.perf_counter()
+        for _ in range(repeat):
+            loop_alignment(pagedicts[0], *args)
+            old = [loop_rows(pagedict) for pagedict in pagedicts]
+        t_loop = (time.perf_counter() - tic) / repeat
+
+        tic = time.perf_counter()
+        for _ in range(repeat):
+            new = list(array_rows(pagedicts, *args))
+        t_array = (time.perf_counter() - tic) / repeat
+
+        if old != [rows for rows, _ in new]:
+            print(f'{path}: rows differ')
+        changed = sum(colx != new[0][1] for _, colx in new)
+
+        times = total.setdefault(version, [0, 0.0, 0.0, 0])
+        for i, value in enumerate((len(doc), t_loop, t_array, changed)):
+            times[i] += value
+
+    for version, (pages, t_loop, t_array, changed) in total.items():
+        print(f'{version:>4} {pages:6d} {t_loop / pages * 1e6:10.1f} '
+              f'{t_array / pages * 1e6:11.1f} {changed:8d}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = int(args.pop(0)) if args and args[0].isdigit() else 5
+    if not args:
+        args = sorted(
+            glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'), recursive=True)
+            + glob.glob(str(ROOT / 'examples/pdf/**/*.pdf'), recursive=True)
+        )
+    main(repeat, args)
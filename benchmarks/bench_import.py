@@ -0,0 +1,67 @@
+"""
+Measure the import time of the command line entry point.
+
+`python -X importtime` is run in a fresh interpreter, for both
+`import protocol2bids.cli` and `protocol2bids --help`, and the slowest
+modules (cumulative time) are listed. Neither should import the PDF or
+NIfTI backends, which are only needed once a file is actually converted.
+
+Exits with status 1 if a heavy module is imported, or if the total
+import time exceeds `MAX_MS` (default: 400 ms, the import takes about
+300 ms on a slow machine).
+
+Usage
+-----
+python benchmarks/bench_import.py [MAX_MS]
+"""
+import re
+import sys
+import subprocess
+
+HEAVY = ('pymupdf', 'fitz', 'nibabel', 'numpy')
+TOP = 10
+MAX_MS = 400
+
+COMMANDS = {
+    'import': 'import protocol2bids.cli',
+    '--help': (
+        'import sys; sys.argv = ["protocol2bids", "--help"]; '
+        'from protocol2bids.cli import app; app()'
+    ),
+}
+
+
+def importtime(code):
+    """Return {module: cumulative time [us]} for a snippet of code"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r'import time:\s*(\d+) \|\s*(\d+) \|(\s*)(\S+)', line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def main(max_ms=MAX_MS):
+    failed = False
+    for name, code in COMMANDS.items():
+        times = importtime(code)
+        total = times.get('protocol2bids.cli', 0) / 1e3
+        heavy = {module.split('.')[0] for module in times} & set(HEAVY)
+        print(f'{name}: {total:.1f} ms')
+        for module, us in sorted(times.items(), key=lambda x: -x[1])[:TOP]:
+            print(f'  {us/1e3:8.1f} ms  {module}')
+        if heavy:
+            print(f'  heavy modules imported: {", ".join(sorted(heavy))}')
+            failed = True
+        if total > max_ms:
+            print(f'  over budget ({total:.1f} > {max_ms} ms)')
+            failed = True
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main(float(sys.argv[1]) if sys.argv[1:] else MAX_MS))
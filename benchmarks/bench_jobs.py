@@ -0,0 +1,77 @@
+"""
+Benchmark serial versus process-parallel text extraction on the
+Siemens printouts of the `datasets/pdf` corpus.
+
+For each printout, the page layouts fed to the parser's lexer (lines
+and column edges, see `iter_page_layouts`) are extracted serially and
+with `jobs` worker processes, timed, and checked to be identical.
+
+Usage
+-----
+python benchmarks/bench_jobs.py [JOBS] [PDF ...]
+"""
+import os
+import sys
+import glob
+import time
+import pymupdf
+from pathlib import Path
+from importlib import import_module
+
+ROOT = Path(__file__).parent.parent
+
+
+def guess_version(doc):
+    text = doc[0].get_text()
+    if text.startswith('Table of contents'):
+        return 've'
+    for version, tag in (('va', 'syngo MR A'), ('va', 'syngo MR 20'),
+                         ('vb', 'syngo MR B'), ('vd', 'syngo MR D')):
+        if tag in text:
+            return version
+    return None
+
+
+def layouts(module, doc, jobs=None):
+    """Lines and column edges of each page, as plain Python objects"""
+    if not hasattr(module, '_iter_layouts'):
+        # VD groups the lines of each page into rows
+        return list(module._iter_blocks(doc, jobs=jobs))
+    return [
+        (texts, lines.tolist(), colx)
+        for texts, lines, colx in module._iter_layouts(doc, jobs=jobs)
+    ]
+
+
+def main(jobs, paths):
+    print(f'{"pages":>5} {"serial [s]":>10} {"jobs [s]":>10} {"same":>5}  path')
+    total_serial = total_jobs = 0
+    for path in paths:
+        doc = pymupdf.open(path)
+        version = guess_version(doc)
+        if version is None:
+            continue
+        module = import_module(f'protocol2bids.vendors.siemens.{version}')
+
+        tic = time.perf_counter()
+        serial = layouts(module, doc)
+        t_serial = time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        parallel = layouts(module, doc, jobs)
+        t_jobs = time.perf_counter() - tic
+
+        total_serial += t_serial
+        total_jobs += t_jobs
+        same = 'yes' if serial == parallel else 'NO'
+        print(f'{len(doc):5d} {t_serial:10.3f} {t_jobs:10.3f} {same:>5}  '
+              f'{path}')
+    print(f'{"":5} {total_serial:10.3f} {total_jobs:10.3f}        total')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    jobs = int(args.pop(0)) if args else os.cpu_count()
+    paths = args or sorted(glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'),
+                                     recursive=True))
+    main(jobs, paths)
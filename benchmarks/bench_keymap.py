@@ -0,0 +1,72 @@
+"""
+Throughput of the keymaps (`siemens_to_bids`), in sidecars per second.
+
+The printouts are dumped once (`protocol2bids dump`), and the sidecars
+are then generated from the dumps only, so that PDF parsing is not
+timed. No NIfTI file is used.
+
+Usage
+-----
+python benchmarks/bench_keymap.py [REPEAT] [PDF|DUMP ...]
+
+Without arguments, all printouts in `datasets/pdf` are used, and the
+sidecars are generated 10 times.
+"""
+import sys
+import glob
+import json
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+from protocol2bids import cli
+from protocol2bids.register import REGISTER
+from protocol2bids.utils.dump import read_dump
+
+ROOT = Path(__file__).parent.parent
+
+
+def load_dumps(paths):
+    tmp = Path(tempfile.mkdtemp())
+    dumps = []
+    for i, path in enumerate(paths):
+        if Path(path).suffix.lower() == '.pdf':
+            dump = tmp / f'{i}.json'
+            try:
+                cli.dump(path, dump)
+            except Exception:
+                continue
+            path = dump
+        dumps.append(read_dump(path))
+    return dumps
+
+
+def main(repeat, paths):
+    logging.disable(logging.CRITICAL)
+    dumps = load_dumps(paths)
+    # sidecars are generated from fresh copies of the parsed content
+    copies = [
+        (REGISTER[parser], [json.dumps(content)] * repeat)
+        for parser, content in dumps
+    ]
+    count = 0
+    elapsed = 0
+    for module, contents in copies:
+        for content in contents:
+            content = json.loads(content)
+            tic = time.perf_counter()
+            for _ in module.iter_content_sidecars(content):
+                count += 1
+            elapsed += time.perf_counter() - tic
+    print(f'{len(dumps)} printouts, {count} sidecars in {elapsed:.3f} s')
+    print(f'{count / elapsed:.1f} sidecars/s')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = int(args.pop(0)) if args and args[0].isdigit() else 10
+    if not args:
+        args = sorted(glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'),
+                                recursive=True))
+    main(repeat, args)
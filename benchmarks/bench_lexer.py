@@ -0,0 +1,187 @@
+"""
+Benchmark of the span lexer shared by the VA/VB/VE Siemens parsers.
+
+The lines of each page of the corpus are extracted once (with the
+column edges of the page), and then classified with:
+
+* "inline": the checks that each parser used to run on every span
+  (separator sets, page number regex, indentation thresholds);
+* "lexer": `Lexer.lex`, with the patterns of the parser (one call per
+  page, indentations computed for the whole page at once).
+
+Both must agree on every line. The time of a full parse (pages already
+extracted) is also reported, for the printouts that can be parsed.
+
+Usage
+-----
+python benchmarks/bench_lexer.py [REPEAT] [PDF ...]
+"""
+import re
+import sys
+import glob
+import time
+import logging
+from pathlib import Path
+from importlib import import_module
+
+import pymupdf
+
+from protocol2bids.vendors.siemens.utils import (
+    TITLE, HEADER, KEY, GROUP_KEY, VALUE, SEPARATOR, BANNER, PAGE_NO,
+    BBOX_FIELDS,
+)
+
+ROOT = Path(__file__).parent.parent
+
+
+def _indent(box, colx, pagewidth):
+    column = 'L' if box[0] < pagewidth / 2 else 'R'
+    return abs(colx[column] - box[0])
+
+
+def inline_va(text, box, colx, pagewidth):
+    """Previous (inline) checks of the VA parser"""
+    if text.startswith('SIEMENS MAGNETOM'):
+        return BANNER
+    if set(text) in ({'-'}, {'-', ' '}):
+        return SEPARATOR
+    if text.endswith(('/-', '/+')):
+        return PAGE_NO
+    if text.startswith('\\\\'):
+        return TITLE
+    indent = _indent(box, colx, pagewidth)
+    if indent < 1:
+        return HEADER
+    if indent < 50:
+        return GROUP_KEY if text.startswith(' ') else KEY
+    return VALUE
+
+
+def inline_vb(text, box, colx, pagewidth):
+    """Previous (inline) checks of the VB parser"""
+    if text.startswith('\\\\'):
+        return TITLE
+    if set(text) in ({'-'}, {'-', ' '}, {'!'}):
+        return SEPARATOR
+    if text.startswith('SIEMENS MAGNETOM'):
+        return BANNER
+    if re.fullmatch(r'\d+/(-|\+)', text):
+        return PAGE_NO
+    indent = _indent(box, colx, pagewidth)
+    if indent < 1:
+        return HEADER
+    if indent < 15:
+        return GROUP_KEY if text.startswith(' ') else KEY
+    return VALUE
+
+
+def inline_ve(text, box, colx, pagewidth):
+    """Previous (inline) checks of the VE parser"""
+    if set(text) in ({'-'}, {'-', ' '}):
+        return SEPARATOR
+    if text.startswith('SIEMENS MAGNETOM'):
+        return BANNER
+    if re.fullmatch(r'- \d+ -', text):
+        return PAGE_NO
+    if text.startswith('\\\\'):
+        return TITLE
+    indent = _indent(box, colx, pagewidth)
+    if indent < 1:
+        return HEADER
+    if indent < 10:
+        return KEY
+    if indent < 50:
+        return GROUP_KEY
+    return VALUE
+
+
+def version_of(doc):
+    """Version of the printout, from the text of its first page"""
+    text = doc[0].get_text()
+    if text.startswith('Table of contents'):
+        return 've'
+    if 'syngo MR A' in text or 'syngo MR 20' in text:
+        return 'va'
+    if 'syngo MR B' in text:
+        return 'vb'
+    return None
+
+
+def load(path, version):
+    """Lines of each page of a printout, and their column edges"""
+    mod = import_module(f'protocol2bids.vendors.siemens.{version}')
+    doc = pymupdf.open(path)
+    pages = list(mod._iter_layouts(doc))
+    return mod, doc, pages, doc[0].bound()[2]
+
+
+def spans_of(texts, lines):
+    """(text, box) of each line of a page, as the parsers used to read"""
+    boxes = zip(*(lines[field].tolist() for field in BBOX_FIELDS))
+    return list(zip(texts, boxes))
+
+
+def main(repeat, paths):
+    logging.disable(logging.CRITICAL)
+    inline = dict(va=inline_va, vb=inline_vb, ve=inline_ve)
+    total = {}
+    for path in paths:
+        version = version_of(pymupdf.open(path))
+        if version is None:
+            continue
+        mod, doc, pages, pagewidth = load(path, version)
+        classify = inline[version]
+        spans = [spans_of(texts, lines) for texts, lines, _ in pages]
+
+        tic = time.perf_counter()
+        for _ in range(repeat):
+            old = [
+                classify(t, b, colx, pagewidth)
+                for page, (*_, colx) in zip(spans, pages) for t, b in page
+            ]
+        t_inline = (time.perf_counter() - tic) / repeat
+
+        tic = time.perf_counter()
+        for _ in range(repeat):
+            new = [
+                k for texts, lines, colx in pages
+                for *_, k in mod._LEXER.lex(texts, lines, colx, pagewidth)
+            ]
+        t_lexer = (time.perf_counter() - tic) / repeat
+
+        diff = sum(a != b for a, b in zip(old, new))
+        if diff:
+            print(f'{path}: {diff} lines classified differently')
+
+        tic = time.perf_counter()
+        try:
+            for _ in range(repeat):
+                mod._parse_printout_content(doc)
+        except Exception as e:
+            print(f'{path}: {type(e).__name__} (not parsed)')
+            continue
+        t_parse = (time.perf_counter() - tic) / repeat
+
+        times = total.setdefault(version, [0, 0, 0.0, 0.0, 0.0])
+        for i, value in enumerate((1, len(old), t_inline, t_lexer,
+                                   t_parse)):
+            times[i] += value
+
+    print(f'{"":>4} {"files":>6} {"lines":>7} {"inline [us]":>12} '
+          f'{"lexer [us]":>11} {"parse [us]":>11}  (per line)')
+    for version, (files, count, t_inline, t_lexer, t_parse) in total.items():
+        print(f'{version:>4} {files:6d} {count:7d} '
+              f'{t_inline / count * 1e6:12.3f} '
+              f'{t_lexer / count * 1e6:11.3f} '
+              f'{t_parse / count * 1e6:11.3f}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = int(args.pop(0)) if args and args[0].isdigit() else 5
+    if not args:
+        args = sorted(
+            glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'), recursive=True)
+            + glob.glob(str(ROOT / 'examples/pdf/**/*.pdf'), recursive=True)
+        )
+    main(repeat, args)
@@ -0,0 +1,123 @@
+"""
+Compare two ways of looking up the protocol paths used by the keymaps:
+
+* "nested": walk the nested protocol for each path, and catch the
+  exception raised when a path is missing, trying each alias of the
+  path in turn (what the keymaps used to do);
+* "indexed": index each protocol once into a flat {path: value} mapping
+  with canonical paths (`_index_protocol` and `_resolve_aliases`,
+  index time included), and look paths up in it.
+
+Protocols are read from dumps of the printouts (`protocol2bids dump`).
+
+Usage
+-----
+python benchmarks/bench_lookup.py [REPEAT] [PDF|DUMP ...]
+
+Without arguments, all printouts in `datasets/pdf` are used, and the
+lookups are repeated 10 times.
+"""
+import sys
+import glob
+import time
+import logging
+import tempfile
+from pathlib import Path
+
+from protocol2bids import cli
+from protocol2bids.register import REGISTER
+from protocol2bids.utils.dump import read_dump
+from protocol2bids.vendors.siemens import common
+
+ROOT = Path(__file__).parent.parent
+
+
+def load_protocols(paths):
+    """Parsed protocols, as they are passed to `siemens_to_bids`"""
+    tmp = Path(tempfile.mkdtemp())
+    prots = []
+    to_bids = common.siemens_to_bids
+    common.siemens_to_bids = lambda prot, **kw: prots.append(prot) or {}
+    try:
+        for i, path in enumerate(paths):
+            if Path(path).suffix.lower() == '.pdf':
+                dump = tmp / f'{i}.json'
+                try:
+                    cli.dump(path, dump)
+                except Exception:
+                    continue
+                path = dump
+            parser, content = read_dump(path)
+            list(REGISTER[parser].iter_content_sidecars(content))
+    finally:
+        common.siemens_to_bids = to_bids
+    return prots
+
+
+def keymap_paths():
+    """All protocol paths used by the keymaps"""
+    paths = []
+    for keymap in (common.KEYMAP_BASIC, common.KEYMAP_CLASSIC,
+                   *common.KEYMAP_SPECIAL.values()):
+        for mappers in keymap.values():
+            if not isinstance(mappers, list):
+                mappers = [mappers]
+            for mapper in mappers:
+                if not isinstance(mapper, dict):
+                    mapper = {"args": [mapper]}
+                for items in mapper.get("args", []):
+                    if not isinstance(items, tuple):
+                        items = (items,)
+                    paths += [x for x in items if "//" in x]
+    return paths
+
+
+def nested(prots, paths):
+    misses = 0
+    for prot in prots:
+        for path in paths:
+            for alias in common.ALIASES.get(path, (path,)):
+                try:
+                    value = prot
+                    for level in alias.split("//"):
+                        value = value[level]
+                    break
+                except Exception:
+                    continue
+            else:
+                misses += 1
+    return misses
+
+
+def indexed(prots, paths):
+    misses = 0
+    missing = common._MISSING
+    for prot in prots:
+        index = common._resolve_aliases(common._index_protocol(prot))
+        for path in paths:
+            if index.get(path, missing) is missing:
+                misses += 1
+    return misses
+
+
+def main(repeat, paths):
+    logging.disable(logging.CRITICAL)
+    prots = load_protocols(paths)
+    lookups = keymap_paths()
+    print(f'{len(prots)} protocols, {len(lookups)} paths per protocol')
+    for func in (nested, indexed):
+        tic = time.perf_counter()
+        for _ in range(repeat):
+            misses = func(prots, lookups)
+        elapsed = (time.perf_counter() - tic) / repeat
+        print(f'{func.__name__:>8}: {elapsed*1e3:8.2f} ms '
+              f'({misses} missing paths)')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = int(args.pop(0)) if args and args[0].isdigit() else 10
+    if not args:
+        args = sorted(glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'),
+                                recursive=True))
+    main(repeat, args)
@@ -0,0 +1,80 @@
+"""
+Time the matching of protocols with NIfTI files (`--match-nii`).
+
+A session is made of the protocols of the datasets (read from dumps
+written by `protocol2bids dump`, as `{DUMPS}/{dataset}/{site}/{name}.json`)
+and of their NIfTI files (`datasets/nii/{dataset}/{site}/{name}.nii`),
+repeated until there are at least `COUNT` of them, with the files
+shuffled. A protocol is counted as correctly matched if its file has
+the same shape and voxel size as its true file (repeated or similar
+protocols cannot be told apart).
+
+Usage
+-----
+python benchmarks/bench_match.py DUMPS [COUNT ...]
+
+COUNT defaults to 40, 200 and 500.
+"""
+import sys
+import time
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from protocol2bids.register import REGISTER
+from protocol2bids.utils.dump import read_dump
+from protocol2bids.utils.nii2axes import nii_header
+from protocol2bids.vendors.siemens import common
+
+ROOT = Path(__file__).parent.parent
+
+
+def load_session(dumps):
+    """Parsed protocols (as passed to `siemens_to_bids`) and NIfTI files"""
+    prots, niis = [], []
+    to_bids = common.siemens_to_bids
+    common.siemens_to_bids = lambda prot, **kw: prots.append(prot) or {}
+    try:
+        for dump in sorted(Path(dumps).glob('*/*/*.json')):
+            nii = ROOT / 'datasets/nii' / dump.relative_to(dumps)
+            nii = nii.with_suffix('.nii')
+            parser, content = read_dump(dump)
+            if not nii.exists() or not parser.startswith('siemens'):
+                continue
+            list(REGISTER[parser].iter_content_sidecars(content))
+            niis += [str(nii)] * (len(prots) - len(niis))
+    finally:
+        common.siemens_to_bids = to_bids
+    return prots, niis
+
+
+def geometry(path):
+    affine, shape = nii_header(path)
+    return shape[:3], tuple(np.round(np.sqrt((affine**2).sum(0))[:3], 3))
+
+
+def main(dumps, counts):
+    logging.disable(logging.CRITICAL)
+    prots, niis = load_session(dumps)
+    rng = np.random.default_rng(0)
+    for count in counts:
+        repeat = count // len(prots) + 1
+        session = (prots * repeat)[:count]
+        truth = (niis * repeat)[:count]
+        order = rng.permutation(len(truth))
+        pool = [dict(file=truth[i]) for i in order]
+        tic = time.perf_counter()
+        match = common._match_nii(session, pool)
+        elapsed = time.perf_counter() - tic
+        correct = sum(
+            geometry(true) == geometry(info['file'])
+            for true, info in zip(truth, match)
+        )
+        print(f'{count:4d} protocols: {elapsed*1e3:8.1f} ms, '
+              f'{correct}/{count} correctly matched')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(args[0], [int(x) for x in args[1:]] or [40, 200, 500])
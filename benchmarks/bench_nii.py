@@ -0,0 +1,81 @@
+"""
+Compare ways of reading the affine and shape of NIfTI files:
+
+* "nibabel": `nibabel.load` (what `nii2shape` used to do);
+* "header": `nii_header`, which only reads the header (cold cache);
+* "cached": `nii_header` again, once the headers are cached;
+* "threads": `nii_headers`, cold cache, in a pool of threads.
+
+Each file is also gzipped (with some padding standing in for the data)
+to time `.nii.gz` files.
+
+Usage
+-----
+python benchmarks/bench_nii.py [REPEAT] [NII ...]
+
+Without arguments, all files in `datasets/nii` are used, and each
+method is run 10 times.
+"""
+import sys
+import glob
+import gzip
+import time
+import tempfile
+from pathlib import Path
+
+import nibabel as nib
+
+from protocol2bids.utils import nii2axes
+
+ROOT = Path(__file__).parent.parent
+PADDING = 1 << 20
+
+
+def gzip_copies(paths):
+    tmp = Path(tempfile.mkdtemp())
+    copies = []
+    for i, path in enumerate(paths):
+        copy = tmp / f'{i}.nii.gz'
+        with open(path, 'rb') as f, gzip.open(copy, 'wb') as g:
+            g.write(f.read() + bytes(PADDING))
+        copies.append(str(copy))
+    return copies
+
+
+def nibabel(paths):
+    return [(f.affine, f.shape[:3]) for f in map(nib.load, paths)]
+
+
+def header(paths):
+    nii2axes._nii_header.cache_clear()
+    return list(map(nii2axes.nii_header, paths))
+
+
+def cached(paths):
+    return list(map(nii2axes.nii_header, paths))
+
+
+def threads(paths):
+    nii2axes._nii_header.cache_clear()
+    return nii2axes.nii_headers(paths)
+
+
+def main(repeat, paths):
+    for kind, files in (('.nii', paths), ('.nii.gz', gzip_copies(paths))):
+        print(f'{len(files)} {kind} files')
+        for func in (nibabel, header, cached, threads):
+            tic = time.perf_counter()
+            for _ in range(repeat):
+                func(files)
+            elapsed = (time.perf_counter() - tic) / repeat
+            print(f'{func.__name__:>8}: {elapsed*1e3:8.2f} ms '
+                  f'({len(files) / elapsed:9.1f} files/s)')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    repeat = int(args.pop(0)) if args and args[0].isdigit() else 10
+    if not args:
+        args = sorted(glob.glob(str(ROOT / 'datasets/nii/**/*.nii'),
+                                recursive=True))
+    main(repeat, args)
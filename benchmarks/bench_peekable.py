@@ -0,0 +1,63 @@
+"""
+Scaling benchmark of the `peekable` lookahead buffer used by the
+Siemens parsers.
+
+Each token is peeked at once and then consumed, which is the access
+pattern of `_parse_printout_content`. The previous implementation,
+which wrapped the iterator in a new `itertools.chain` on every peek,
+is included for reference. It is quadratic and builds a chain whose
+depth grows with the number of tokens, so it is only run on the
+smaller sizes.
+
+Usage
+-----
+python benchmarks/bench_peekable.py
+"""
+import itertools
+import time
+
+from protocol2bids.vendors.siemens.utils import peekable
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+MAX_SIZE_CHAIN = 10_000
+
+
+class chain_peekable:
+    """Previous (chain-nesting) implementation"""
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+
+    def peek(self):
+        value = next(self._iterator)
+        self._iterator = itertools.chain([value], self._iterator)
+        return value
+
+    def next(self):
+        return next(self._iterator)
+
+
+def consume(klass, n):
+    tokens = klass(iter(range(n)))
+    tic = time.perf_counter()
+    while True:
+        try:
+            tokens.peek()
+        except StopIteration:
+            break
+        tokens.next()
+    return time.perf_counter() - tic
+
+
+def main():
+    print(f'{"blocks":>9} {"chain [s]":>10} {"deque [s]":>10}')
+    for n in SIZES:
+        t_chain = float('nan')
+        if n <= MAX_SIZE_CHAIN:
+            t_chain = consume(chain_peekable, n)
+        t_deque = consume(peekable, n)
+        print(f'{n:9d} {t_chain:10.4f} {t_deque:10.4f}')
+
+
+if __name__ == '__main__':
+    main()
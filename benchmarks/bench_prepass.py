@@ -0,0 +1,108 @@
+"""
+Per-page benchmark of the alignment and model detection pre-passes of
+the VA/VB/VD parsers.
+
+The previous implementation, which searched the whole page with
+`get_textbox` once per glyph trace, is included for reference. It is
+timed on the same pages as the current one (`page_lines` and
+`page_alignment` on the text dictionary of the page, and the span-based
+`_parse_model`), and the results of both are reported side by side.
+
+Usage
+-----
+python benchmarks/bench_prepass.py [PDF ...]
+"""
+import re
+import sys
+import glob
+import time
+import pymupdf
+from pathlib import Path
+from importlib import import_module
+
+from protocol2bids.vendors.siemens.utils import (
+    page_dict, page_lines, page_alignment,
+)
+
+ROOT = Path(__file__).parent.parent
+
+
+def trace_find_alignment(page):
+    """Previous (get_texttrace + get_textbox) implementation, VB flavour"""
+    traces = page.get_texttrace()[1:][6:][:-2]
+    colx = {'L': float('inf'), 'R': float('inf')}
+    for trace in traces[:-1]:
+        box = trace['bbox']
+        text = page.get_textbox(box)
+        if text.startswith('-') and text.endswith('-'):
+            continue
+        if box[0] < page.bound()[2] / 2:
+            colx['L'] = min(colx['L'], box[0])
+        else:
+            colx['R'] = min(colx['R'], box[0])
+    return colx
+
+
+def trace_parse_model(page):
+    """Previous (get_texttrace + get_textbox) implementation"""
+    text = page.get_textbox(page.get_texttrace()[0]['bbox'])
+    match = re.fullmatch(r'SIEMENS MAGNETOM (?P<model>\w+) (?P<version>.+)',
+                         text)
+    if match:
+        return match.group('model'), match.group('version')
+    return None, None
+
+
+def find_alignment(module, page):
+    """Current implementation: column edges from the page geometry"""
+    texts, lines = page_lines(page_dict(page))
+    # VD printouts have a single column
+    pagewidth = float('inf') if module.__name__.endswith('.vd') \
+        else page.bound()[2]
+    colx, _ = page_alignment(
+        texts, lines, pagewidth, module._TITLE, module._FURNITURE
+    )
+    return colx
+
+
+def guess_version(doc):
+    text = doc[0].get_text()
+    for version, tag in (('va', 'syngo MR A'), ('vb', 'syngo MR B'),
+                         ('vd', 'syngo MR D')):
+        if tag in text:
+            return version
+    return None
+
+
+def timeit(func, *args):
+    tic = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - tic
+
+
+def main(paths):
+    print(f'{"page":>4} {"trace [ms]":>11} {"spans [ms]":>11}  path')
+    total_trace = total_spans = 0
+    for path in paths:
+        doc = pymupdf.open(path)
+        version = guess_version(doc)
+        if version is None:
+            continue
+        module = import_module(f'protocol2bids.vendors.siemens.{version}')
+        for page in doc:
+            t_trace = (timeit(trace_find_alignment, page) +
+                       timeit(trace_parse_model, page))
+            t_spans = (timeit(find_alignment, module, page) +
+                       timeit(module._parse_model, page))
+            total_trace += t_trace
+            total_spans += t_spans
+            print(f'{page.number:4d} {t_trace*1e3:11.1f} {t_spans*1e3:11.1f}'
+                  f'  {path}')
+    print(f'{"":4} {total_trace*1e3:11.1f} {total_spans*1e3:11.1f}  total')
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or sorted(
+        glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'), recursive=True)
+    )
+    main(paths)
@@ -0,0 +1,88 @@
+"""
+Count how many times each page is extracted during a conversion.
+
+Every call to `Page.get_textpage` (which `get_text`, `extractDICT`, etc.
+go through) is counted, per page. "uncached" disables the page cache
+(`_MAX_DOCUMENTS = 0`), so that every pass of the parsers (and every
+sniffer) extracts pages again. "cached" is the normal behaviour.
+
+Usage
+-----
+python benchmarks/count_extractions.py [PDF ...]
+
+Without arguments, all printouts in `datasets/pdf` are used.
+"""
+import sys
+import glob
+import logging
+import tempfile
+import pymupdf
+from collections import Counter
+from pathlib import Path
+
+from protocol2bids import cli
+from protocol2bids.vendors.siemens import utils
+
+ROOT = Path(__file__).parent.parent
+
+
+class CountExtractions:
+    """Context manager that counts calls to `Page.get_textpage`, per page"""
+
+    def __init__(self, cache=True):
+        self.cache = cache
+
+    def __enter__(self):
+        self.count = Counter()
+        self._get_textpage = pymupdf.Page.get_textpage
+        self._max_documents = utils._MAX_DOCUMENTS
+
+        def counted_get_textpage(page, *args, **kwargs):
+            self.count[page.number] += 1
+            return self._get_textpage(page, *args, **kwargs)
+
+        pymupdf.Page.get_textpage = counted_get_textpage
+        if not self.cache:
+            utils._MAX_DOCUMENTS = 0
+        return self
+
+    def __exit__(self, *args):
+        pymupdf.Page.get_textpage = self._get_textpage
+        utils._MAX_DOCUMENTS = self._max_documents
+
+
+def convert(path, out):
+    try:
+        cli.protocol2bids(path, out)
+    except Exception:
+        pass
+
+
+def main(paths):
+    logging.disable(logging.CRITICAL)
+    tmp = tempfile.mkdtemp()
+    total_before = total_after = 0
+    print(f'{"uncached":>8} {"cached":>6} {"pages":>5}  path')
+    for path in paths:
+        with CountExtractions(cache=False) as before:
+            convert(path, Path(tmp) / 'sidecar.json')
+        with CountExtractions(cache=True) as after:
+            convert(path, Path(tmp) / 'sidecar.json')
+        total_before += sum(before.count.values())
+        total_after += sum(after.count.values())
+        print(f'{sum(before.count.values()):8d} '
+              f'{sum(after.count.values()):6d} '
+              f'{len(after.count):5d}  {path}')
+        worst = max(after.count.values(), default=0)
+        if worst > 1:
+            pages = [n for n, c in sorted(after.count.items()) if c == worst]
+            print(f'{"":22}pages {pages} extracted {worst} times')
+    print(f'{total_before:8d} {total_after:6d} {"":5}  total')
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:]
+    if not paths:
+        paths = sorted(glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'),
+                                 recursive=True))
+    main(paths)
@@ -0,0 +1,89 @@
+"""
+Count how many times each input PDF is opened during a conversion.
+
+"before" mimics the historical behaviour, where every sniffer and parser
+received a path and opened the file itself. "after" goes through the
+command line entry point, which opens the document once and shares it.
+
+Usage
+-----
+python benchmarks/count_opens.py [PDF ...]
+
+Without arguments, all printouts in `datasets/pdf` are used.
+"""
+import sys
+import glob
+import logging
+import tempfile
+import pymupdf
+from pathlib import Path
+
+from protocol2bids import cli
+from protocol2bids.register import REGISTER
+
+ROOT = Path(__file__).parent.parent
+
+
+class CountOpens:
+    """Context manager that counts calls to `pymupdf.open`"""
+
+    def __enter__(self):
+        self.count = 0
+        self._open = pymupdf.open
+
+        def counted_open(*args, **kwargs):
+            self.count += 1
+            return self._open(*args, **kwargs)
+
+        pymupdf.open = counted_open
+        return self
+
+    def __exit__(self, *args):
+        pymupdf.open = self._open
+
+
+def convert_by_path(path):
+    # Same sniff-then-fallback logic as the command line, but every
+    # sniffer and parser receives the path.
+    for module in REGISTER.values():
+        if module.sniff(path):
+            try:
+                return module.parse(path)
+            except Exception:
+                return
+    for module in REGISTER.values():
+        try:
+            return module.parse(path)
+        except Exception:
+            continue
+
+
+def convert_by_doc(path, out):
+    try:
+        cli.protocol2bids(path, out)
+    except Exception:
+        pass
+
+
+def main(paths):
+    logging.disable(logging.CRITICAL)
+    tmp = tempfile.mkdtemp()
+    total_before = total_after = 0
+    print(f'{"before":>6} {"after":>6}  path')
+    for path in paths:
+        with CountOpens() as before:
+            convert_by_path(path)
+        with CountOpens() as after:
+            convert_by_doc(path, Path(tmp) / 'sidecar.json')
+        total_before += before.count
+        total_after += after.count
+        print(f'{before.count:6d} {after.count:6d}  {path}')
+    print(f'{total_before:6d} {total_after:6d}  total')
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:]
+    if not paths:
+        paths = sorted(glob.glob(str(ROOT / 'datasets/pdf/**/*.pdf'),
+                                 recursive=True))
+    main(paths)
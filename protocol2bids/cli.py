@@ -1,14 +1,20 @@
 import cyclopts
 import json
-from typing import Iterable, Literal
+import time
+from typing import Iterable, Iterator, Literal
+from itertools import chain
+from functools import partial
+from datetime import datetime
 from pathlib import Path
 from os import PathLike
 from ast import literal_eval
-from logging import getLogger, basicConfig, INFO
+from logging import getLogger, basicConfig, disable, INFO, NOTSET
 
 from .register import REGISTER
-from .utils.nii2axes import nii2shape
+from .utils.cache import ParseCache, parser_version
+from .utils.dump import dump_format, read_dump, write_dump
 from .utils.prettify import JSONs
+from .utils.tree import TreeState, iter_tree, nii_signature
 
 
 LOGGER = getLogger(__name__)
@@ -23,6 +29,167 @@ Hint = Literal[
 ]
 
 
+def _iter_sidecars(module, doc, opt, store=None) -> Iterator[tuple[str, dict]]:
+    """
+    Start parsing a document and return an iterator over its sidecars.
+
+    The first sidecar is parsed eagerly, so that a parser that cannot
+    read the document fails here rather than halfway through writing.
+
+    If `store` is provided, the document is parsed in full and its raw
+    content is passed to `store` (to be cached) once it is known to
+    convert.
+    """
+    if store is not None and hasattr(module, 'iter_content_sidecars'):
+        content = module._parse_printout_content(
+            doc,
+            skip_pages=opt['skip_pages'],
+            jobs=opt['jobs'],
+            protocols=opt['protocols'],
+        )
+        sidecars = iter(module.iter_content_sidecars(content, opt['nii']))
+    elif hasattr(module, 'iter_sidecars'):
+        sidecars = iter(module.iter_sidecars(doc, **opt))
+    else:
+        sidecars = iter(module.parse(doc, **opt).items())
+    first = next(sidecars, None)
+    if first is None:
+        raise ValueError('No protocol found in printout')
+    if store is not None and hasattr(module, 'iter_content_sidecars'):
+        store(content)
+    return chain([first], sidecars)
+
+
+def _hinted_parsers(hints: Iterable[str] | None) -> list[str]:
+    """
+    Parsers to try, in order: the ones that match the hints if any,
+    else all registered parsers.
+    """
+    if not hints:
+        return list(REGISTER)
+    return [
+        path
+        for hint in hints
+        for path in reversed(sorted(REGISTER))
+        if path.startswith(hint)
+    ]
+
+
+def _stream_sidecars(
+    inp, hints, opt, cache=None, on_content=None
+) -> tuple[str, Iterator[tuple[str, dict]]]:
+    """
+    Find a parser that can read the input and return its name and an
+    iterator over its sidecars (see `protocol2bids` for the parameters).
+
+    If `on_content` is provided, it is called with the name of the
+    parser and the raw content of the printout, and the parser must
+    be able to return its raw content.
+    """
+    stream = None
+    tried = set()
+
+    # Reuse a previous parse. Keys are built from the module paths, so
+    # that parsers are only imported once they are used. Parsers that
+    # cannot return their raw content never store anything.
+    keys = {}
+    if cache is not None:
+        keyopt = dict(skip_pages=opt['skip_pages'], protocols=opt['protocols'])
+        keys = {
+            path: cache.key(inp, path, REGISTER.module_path(path), **keyopt)
+            for path in REGISTER
+        }
+        for path in _hinted_parsers(hints):
+            content = cache.get(keys[path])
+            if content is not None:
+                LOGGER.info(f'cache: {path}')
+                if on_content is not None:
+                    on_content(path, content)
+                module = REGISTER[path]
+                return path, module.iter_content_sidecars(content, opt['nii'])
+
+    def _store(path, content):
+        if path in keys:
+            cache.put(keys[path], content)
+        if on_content is not None:
+            on_content(path, content)
+
+    store = {}
+    if cache is not None or on_content is not None:
+        store = {path: partial(_store, path) for path in REGISTER}
+
+    def _skip(module):
+        # Parsers that cannot return their raw content are of no use
+        return (
+            on_content is not None and
+            not hasattr(module, 'iter_content_sidecars')
+        )
+
+    # Open the document once and share it across all sniffers/parsers
+    doc = inp
+    if Path(inp).suffix.lower() == '.pdf':
+        from .utils.pdf import open_pdf
+        doc = open_pdf(inp)
+
+    # Use hints
+    for hint in (hints or []):
+        for path in reversed(sorted(REGISTER)):
+            if not path.startswith(hint) or path in tried:
+                continue
+            tried.add(path)
+            module = REGISTER[path]
+            if _skip(module):
+                continue
+            try:
+                LOGGER.info(f'parse: {path}')
+                stream = _iter_sidecars(module, doc, opt, store.get(path))
+                break
+            except Exception as e:
+                LOGGER.warning(f'Failed to parse with parser {path}: {e}')
+                raise e
+
+    # Use sniff
+    if stream is None:
+        for path in REGISTER:
+            if path in tried:
+                continue
+            module = REGISTER[path]
+            if _skip(module):
+                tried.add(path)
+                continue
+            LOGGER.info(f'sniff: {path}')
+            sniff = getattr(module, 'sniff')
+            if sniff(doc):
+                tried.add(path)
+                try:
+                    LOGGER.info(f'parse: {path}')
+                    stream = _iter_sidecars(module, doc, opt, store.get(path))
+                    break
+                except Exception as e:
+                    LOGGER.warning(f'Failed to parse with parser {path}: {e}')
+                    raise e
+
+    # Try all remaining
+    if stream is None:
+        for path in REGISTER:
+            if path in tried:
+                continue
+            tried.add(path)
+            module = REGISTER[path]
+            if _skip(module):
+                continue
+            try:
+                LOGGER.info(f'parse: {path}')
+                stream = _iter_sidecars(module, doc, opt, store.get(path))
+                break
+            except Exception as e:
+                LOGGER.warning(f'Failed to parse with parser {path}: {e}')
+
+    if stream is None:
+        raise RuntimeError(f'No parser could read {inp}')
+    return path, stream
+
+
 @app.default
 def protocol2bids(
     inp: str | PathLike,
@@ -33,6 +200,11 @@ def protocol2bids(
     defaults: str | dict | None = None,
     assigns: str | dict | None = None,
     skip_pages: Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: Iterable[str] | None = None,
+    cache: bool = False,
+    from_dump: bool = False,
+    match_nii: bool = False,
 ):
     """
     protocol2bids : Convert protocol printouts to BIDS sidecars
@@ -43,7 +215,8 @@ def protocol2bids(
     inp
         Path to input protocol file
     out
-        Path to output JSON file
+        Path to output JSON file (default: next to the input, with a
+        `.json` suffix, or `.sidecars.json` with `--from-dump`)
     hints
         Protocol hints (ex: "siemens.vb")
     nii
@@ -54,6 +227,19 @@ def protocol2bids(
         Dictionary of BIDS metadata to assign
     skip_pages
         List of pages to ignore in the protocol
+    jobs
+        Number of processes used to extract text from the pages
+    protocols
+        Glob pattern(s) of the protocol paths to convert (ex: "*bold*")
+    cache
+        Reuse parsed printouts from the on-disk cache (and store new ones)
+    from_dump
+        The input is a dump written by `protocol2bids dump`
+        (parsing options are those of the dump)
+    match_nii
+        Find the nifti file of each protocol by comparing their voxel
+        size, matrix and number of slices (instead of pairing them in
+        order)
 
     Returns
     -------
@@ -61,96 +247,458 @@ def protocol2bids(
         JSON sidecars
     """
     basicConfig(format="%(message)s", level=INFO)
+    _, sidecars = _convert(
+        inp, out, hints=hints, nii=nii, defaults=defaults, assigns=assigns,
+        skip_pages=skip_pages, jobs=jobs, protocols=protocols, cache=cache,
+        from_dump=from_dump, match_nii=match_nii,
+    )
+    return sidecars
 
-    sidecars = None
-    tried = set()
 
+def _convert(
+    inp, out, *, hints=None, nii=None, defaults=None, assigns=None,
+    skip_pages=None, jobs=None, protocols=None, cache=False, from_dump=False,
+    match_nii=False,
+) -> tuple[str, JSONs]:
+    """
+    Convert a printout (see `protocol2bids` for the parameters), and
+    return the name of the parser that read it along with the sidecars.
+    """
     volinfo = []
     if nii is not None:
+        from .utils.nii2axes import nii_headers
+        nii = list(nii)
+        headers = iter(nii_headers(filter(None, nii)))
         for path in nii:
             if not path:
                 volinfo.append({})
             else:
-                affine, shape = nii2shape(path)
-                volinfo.append(dict(affine=affine, shape=shape))
-
-    opt = dict(nii=volinfo, skip_pages=skip_pages)
-
-    # Use hints
-    for hint in (hints or []):
-        for path in reversed(sorted(REGISTER)):
-            if not path.startswith(hint):
-                continue
-            tried.add(path)
-            parse = getattr(REGISTER[path], 'parse')
-            try:
-                LOGGER.info(f'parse: {path}')
-                sidecars = parse(inp, **opt)
-                break
-            except Exception as e:
-                LOGGER.warning(f'Failed to parse with parser {path}: {e}')
-                raise e
+                affine, shape = next(headers)
+                volinfo.append(dict(affine=affine, shape=shape[:3]))
+        if match_nii:
+            from .utils.niimatch import NiiPool
+            volinfo = NiiPool(filter(None, volinfo))
 
-    # Use sniff
-    if sidecars is None:
-        for path, module in REGISTER.items():
-            if path in tried:
-                continue
-            LOGGER.info(f'sniff: {path}')
-            sniff = getattr(module, 'sniff')
-            parse = getattr(module, 'parse')
-            if sniff(inp):
-                tried.add(path)
-                try:
-                    LOGGER.info(f'parse: {path}')
-                    sidecars = parse(inp, **opt)
-                    break
-                except Exception as e:
-                    LOGGER.warning(f'Failed to parse with parser {path}: {e}')
-                    raise e
+    opt = dict(
+        nii=volinfo, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    )
 
-    # Try all remaining
-    if sidecars is None:
-        for path, module in REGISTER.items():
-            if path in tried:
-                continue
-            tried.add(path)
-            parse = getattr(module, 'parse')
-            try:
-                LOGGER.info(f'parse: {path}')
-                sidecars = parse(inp, **opt)
-                break
-            except Exception as e:
-                LOGGER.warning(f'Failed to parse with parser {path}: {e}')
+    if from_dump:
+        parser, content = read_dump(inp)
+        LOGGER.info(f'dump: {parser}')
+        stream = REGISTER[parser].iter_content_sidecars(content, volinfo)
+    else:
+        parser, stream = _stream_sidecars(
+            inp, hints, opt, ParseCache() if cache else None
+        )
 
-    # Set defaults
+    # Default values
     if defaults:
         if isinstance(defaults, str):
             defaults = literal_eval(defaults)
         if not isinstance(defaults, dict):
             raise TypeError('--defaults must be a dictionary')
-        sidecars = {**defaults, **sidecars}
 
-    # Set forced values
+    # Forced values
     if assigns:
         if isinstance(assigns, str):
             assigns = literal_eval(assigns)
-        if not isinstance(defaults, dict):
+        if not isinstance(assigns, dict):
             raise TypeError('--assigns must be a dictionary')
-        sidecars.update(assigns)
 
-    # Write JSON file
+    # Write JSON files as soon as each sidecar is available
     if out is None:
-        out = Path(inp).with_suffix('.json')
+        # A dump is itself a JSON file: do not overwrite it
+        suffix = '.sidecars.json' if from_dump else '.json'
+        out = Path(inp).with_suffix(suffix)
     out = Path(out)
     if not out.suffix:
         out = out / 'protocol.json'
     out.parent.mkdir(parents=True, exist_ok=True)
-    for i, sidecar in enumerate(sidecars.values()):
+    sidecars = {}
+    for key, sidecar in stream:
+        sidecar = {**(defaults or {}), **sidecar, **(assigns or {})}
+        # Protocols that share a path overwrite each other (and their file)
+        new = key not in sidecars
+        i = len(sidecars) if new else list(sidecars).index(key)
+        sidecars[key] = sidecar
         opath = out
+        if new and i == 1:
+            # More than one sidecar: number the first one as well
+            out.replace(out.with_stem(out.stem + '1'))
         if len(sidecars) > 1:
             opath = out.with_stem(out.stem + f'{i+1}')
         with opath.open('w') as f:
             json.dump(sidecar, f, indent=4)
 
-    return JSONs(sidecars)
+    return parser, JSONs(sidecars)
+
+
+@app.command(name="dump")
+def dump(
+    inp: str | PathLike,
+    out: str | PathLike,
+    *,
+    hints: Iterable[str] | None = None,
+    skip_pages: Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: Iterable[str] | None = None,
+    cache: bool = False,
+):
+    """
+    Write the parsed protocol tree of a printout, to convert it later
+    with `protocol2bids --from-dump`
+
+    Parameters
+    ----------
+    inp
+        Path to input protocol file
+    out
+        Path to output dump (.json, or .msgpack if msgpack is installed)
+    hints
+        Protocol hints (ex: "siemens.vb")
+    skip_pages
+        List of pages to ignore in the protocol
+    jobs
+        Number of processes used to extract text from the pages
+    protocols
+        Glob pattern(s) of the protocol paths to dump (ex: "*bold*")
+    cache
+        Reuse parsed printouts from the on-disk cache (and store new ones)
+    """
+    basicConfig(format="%(message)s", level=INFO)
+    dump_format(out)    # fail early if msgpack is missing
+    opt = dict(nii=[], skip_pages=skip_pages, jobs=jobs, protocols=protocols)
+    _stream_sidecars(
+        inp, hints, opt, ParseCache() if cache else None,
+        on_content=partial(write_dump, out),
+    )
+
+
+def _read_manifest(path: str | PathLike) -> list[dict]:
+    """
+    Read a batch manifest.
+
+    A manifest is a tab-separated file with columns `input`, `output`,
+    and optionally `nii` (comma-separated if several) and `skip_pages`
+    (comma- or space-separated). Empty lines, lines starting with `#`,
+    and a header line are ignored. Relative paths are relative to the
+    folder of the manifest.
+    """
+    path = Path(path)
+    rows = []
+    with path.open() as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.rstrip('\n').split('\t')]
+            fields += [''] * (4 - len(fields))
+            inp, out, nii, skip = fields[:4]
+            if (inp, out) == ('input', 'output'):
+                continue
+            if not inp or not out:
+                raise ValueError(f'{path}:{lineno}: missing input or output')
+            rows.append(dict(
+                inp=str(path.parent / inp),
+                out=str(path.parent / out),
+                nii=[str(path.parent / x) for x in nii.split(',') if x]
+                or None,
+                skip_pages=[int(x) for x in skip.replace(',', ' ').split()]
+                or None,
+            ))
+    return rows
+
+
+def _convert_row(row: dict, opt: dict) -> dict:
+    """
+    Convert one row of a batch manifest (runs in a worker process)
+    """
+    tic = time.perf_counter()
+    disable(INFO)
+    try:
+        parser, sidecars = _convert(**row, **opt)
+        return dict(ok=True, parser=parser, count=len(sidecars),
+                    time=time.perf_counter() - tic)
+    except Exception as e:
+        return dict(ok=False, error=f'{type(e).__name__}: {e}',
+                    time=time.perf_counter() - tic)
+    finally:
+        disable(NOTSET)
+
+
+@app.command(name="batch")
+def batch(
+    manifest: str | PathLike,
+    *,
+    workers: int | None = None,
+    hints: Iterable[str] | None = None,
+    jobs: int | None = None,
+    cache: bool = False,
+    match_nii: bool = False,
+):
+    """
+    Convert all the printouts listed in a manifest, in a single process
+    (or a pool of worker processes)
+
+    The manifest is a tab-separated file with columns `input`, `output`,
+    `nii` (optional, comma-separated) and `skip_pages` (optional).
+    Relative paths are relative to the folder of the manifest.
+
+    Parameters
+    ----------
+    manifest
+        Path to manifest (.tsv)
+    workers
+        Number of worker processes (default: convert serially)
+    hints
+        Protocol hints (ex: "siemens.vb"), used for all printouts
+    jobs
+        Number of processes used to extract text from the pages
+    cache
+        Reuse parsed printouts from the on-disk cache (and store new ones)
+    match_nii
+        Find the nifti file of each protocol from its header (instead of
+        pairing them in order)
+
+    Returns
+    -------
+    status : int
+        Number of failed rows (0 if all rows were converted)
+    """
+    rows = _read_manifest(manifest)
+    opt = dict(hints=hints, jobs=jobs, cache=cache, match_nii=match_nii)
+    tic = time.perf_counter()
+    if workers and workers > 1 and len(rows) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(min(workers, len(rows)))
+        results = pool.map(_convert_row, rows, [opt] * len(rows))
+    else:
+        pool = None
+        results = map(_convert_row, rows, [opt] * len(rows))
+    failed = []
+    try:
+        # Results come back in the order of the manifest
+        for row, result in zip(rows, results):
+            if result['ok']:
+                status = f'{result["count"]:3d} sidecar(s)'
+            else:
+                status = 'FAILED'
+                failed.append((row, result))
+            print(f'{result["time"]:7.2f}s  {status:14}  {row["inp"]}')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    elapsed = time.perf_counter() - tic
+    print(f'{len(rows) - len(failed)}/{len(rows)} printouts converted, '
+          f'{len(failed)} failed, in {elapsed:.2f}s')
+    for row, result in failed:
+        print(f'  {row["inp"]}: {result["error"]}')
+    return len(failed)
+
+
+@app.command(name="tree")
+def tree(
+    pdf_root: str | PathLike,
+    out_root: str | PathLike,
+    *,
+    nii_root: str | PathLike | None = None,
+    workers: int | None = None,
+    hints: Iterable[str] | None = None,
+    jobs: int | None = None,
+    cache: bool = False,
+    force: bool = False,
+):
+    """
+    Convert a tree of printouts, skipping those whose sidecars are
+    up to date
+
+    `{pdf_root}/{path}.pdf` is converted to `{out_root}/{path}.json`,
+    using the header of `{nii_root}/{path}.nii[.gz]` if it exists.
+    A printout that maps to several NIfTI files is listed in a
+    `protocol2bids.tsv` manifest in its folder, with columns `input`,
+    `output` and `skip_pages`: each row is converted on its own.
+    Sidecars are only recomputed if the printout, the NIfTI header or
+    the parser changed since they were written (this is tracked in a
+    state file in `out_root`).
+
+    Parameters
+    ----------
+    pdf_root
+        Root of the tree of printouts
+    out_root
+        Root of the tree of output sidecars
+    nii_root
+        Root of the tree of nifti files
+    workers
+        Number of worker processes (default: convert serially)
+    hints
+        Protocol hints (ex: "siemens.vb"), used for all printouts
+    jobs
+        Number of processes used to extract text from the pages
+    cache
+        Reuse parsed printouts from the on-disk cache (and store new ones)
+    force
+        Convert all printouts, even if they are up to date
+        (or failed before)
+
+    Returns
+    -------
+    status : int
+        Number of failed printouts (0 if all were converted)
+    """
+    tic = time.perf_counter()
+    state = TreeState(out_root)
+    versions = {
+        path: parser_version(REGISTER.module_path(path)) for path in REGISTER
+    }
+
+    todo = []
+    names = set()
+    uptodate = skipped = 0
+    for name, pdf, out, nii, skip_pages in iter_tree(
+        pdf_root, out_root, nii_root
+    ):
+        names.add(name)
+        sig = dict(pdf=state.pdf_signature(name, pdf), nii=nii_signature(nii),
+                   skip_pages=skip_pages)
+        if not force and state.is_up_to_date(name, **sig, versions=versions,
+                                             out=out):
+            # The file may have been touched without being modified
+            state.entries[name]['pdf'] = sig['pdf']
+            if state.entries[name]['error'] is None:
+                uptodate += 1
+            else:
+                skipped += 1
+            continue
+        row = dict(inp=str(pdf), out=str(out),
+                   nii=[str(nii)] if nii else None, skip_pages=skip_pages)
+        todo.append((name, sig, row))
+
+    # Forget printouts that were removed from the tree
+    for name in set(state.entries) - names:
+        del state.entries[name]
+
+    opt = dict(hints=hints, jobs=jobs, cache=cache)
+    rows = [row for *_, row in todo]
+    if workers and workers > 1 and len(rows) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(min(workers, len(rows)))
+        results = pool.map(_convert_row, rows, [opt] * len(rows))
+    else:
+        pool = None
+        results = map(_convert_row, rows, [opt] * len(rows))
+    failed = []
+    try:
+        for (name, sig, row), result in zip(todo, results):
+            if result['ok']:
+                status = f'{result["count"]:3d} sidecar(s)'
+                state.update(name, **sig, versions=versions,
+                             parser=result['parser'], count=result['count'])
+            else:
+                status = 'FAILED'
+                state.update(name, **sig, versions=versions,
+                             error=result['error'])
+                failed.append((row, result))
+            print(f'{result["time"]:7.2f}s  {status:14}  {row["inp"]}')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        state.save()
+    elapsed = time.perf_counter() - tic
+    print(f'{len(todo) - len(failed)} printouts converted, '
+          f'{uptodate} up to date, {len(failed)} failed, in {elapsed:.2f}s')
+    if skipped:
+        print(f'{skipped} printouts that failed before were not tried again '
+              f'(use --force to retry)')
+    for row, result in failed:
+        print(f'  {row["inp"]}: {result["error"]}')
+    return len(failed)
+
+
+cache_app = cyclopts.App(
+    name="cache", help="Manage the on-disk cache of parsed printouts"
+)
+app.command(cache_app)
+
+
+def _human_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    return f'{size:.1f} {unit}' if unit != 'B' else f'{size:.0f} B'
+
+
+@cache_app.command(name="stats")
+def cache_stats():
+    """
+    Print the location, number of entries and size of the cache
+    """
+    stats = ParseCache().stats()
+    print(f'location     {stats["root"]}')
+    print(f'entries      {stats["entries"]}')
+    print(f'size         {_human_size(stats["size"])} '
+          f'(max {_human_size(stats["max_size"])})')
+    print(f'hashed files {stats["hashed_files"]}')
+    if stats['entries']:
+        oldest = datetime.fromtimestamp(stats['oldest'])
+        newest = datetime.fromtimestamp(stats['newest'])
+        print(f'last used    {oldest:%Y-%m-%d %H:%M} .. {newest:%Y-%m-%d %H:%M}')
+
+
+@cache_app.command(name="prune")
+def cache_prune(
+    *,
+    max_size: int | None = None,
+    clear: bool = False,
+):
+    """
+    Evict the least recently used entries
+
+    Parameters
+    ----------
+    max_size
+        Size (in bytes) that the cache must fit in (default: 1 GiB)
+    clear
+        Evict all entries
+    """
+    cache = ParseCache()
+    count, freed = cache.prune(0 if clear else max_size)
+    print(f'evicted {count} entries ({_human_size(freed)})')
+
+
+@cache_app.command(name="warm")
+def cache_warm(
+    *inp: str | PathLike,
+    hints: Iterable[str] | None = None,
+    skip_pages: Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: Iterable[str] | None = None,
+):
+    """
+    Parse printouts and store them in the cache, without converting them
+
+    Parameters
+    ----------
+    inp
+        Path(s) to input protocol file(s)
+    hints
+        Protocol hints (ex: "siemens.vb")
+    skip_pages
+        List of pages to ignore in the protocol
+    jobs
+        Number of processes used to extract text from the pages
+    protocols
+        Glob pattern(s) of the protocol paths to convert (ex: "*bold*")
+    """
+    basicConfig(format="%(message)s", level=INFO)
+    cache = ParseCache()
+    opt = dict(nii=[], skip_pages=skip_pages, jobs=jobs, protocols=protocols)
+    failed = 0
+    for path in inp:
+        try:
+            _stream_sidecars(path, hints, opt, cache)
+        except Exception as e:
+            LOGGER.warning(f'Failed to parse {path}: {e}')
+            failed += 1
+    print(f'warmed {len(inp) - failed} printouts ({failed} failed)')
@@ -1,12 +1,81 @@
+from collections.abc import Mapping
 from importlib import import_module
+from types import ModuleType
 
 V = 'protocol2bids.vendors'
 
-REGISTER = {}
+# Entry point group through which third-party packages register parsers:
+#
+#   [options.entry_points]
+#   protocol2bids.parsers =
+#       acme.v1 = acme_protocol2bids.v1
+ENTRY_POINT_GROUP = 'protocol2bids.parsers'
 
 
-def register_parser(path):
-    REGISTER[path] = import_module(f'{V}.{path}')
+class LazyRegister(Mapping):
+    """
+    Mapping from parser name (ex: "siemens.vb") to parser module.
+
+    Only the path of each module is stored; a module is imported the
+    first time it is accessed. Parsers declared by other packages
+    (through entry points) are discovered the first time the register
+    is used, after the built-in ones.
+    """
+
+    def __init__(self):
+        self._paths: dict[str, str] = {}
+        self._modules: dict[str, ModuleType] = {}
+        self._plugins_loaded = False
+
+    def register(self, path: str, module: str | None = None) -> None:
+        self._paths[path] = module or f'{V}.{path}'
+        self._modules.pop(path, None)
+
+    def _load_plugins(self) -> None:
+        if self._plugins_loaded:
+            return
+        self._plugins_loaded = True
+        # importlib.metadata is slow to import, only load it when needed
+        from importlib.metadata import entry_points
+        for entry in entry_points(group=ENTRY_POINT_GROUP):
+            self._paths.setdefault(entry.name, entry.value)
+
+    def __getitem__(self, path: str) -> ModuleType:
+        self._load_plugins()
+        if path not in self._modules:
+            # Entry points may be "package.module" or "package:module"
+            module, _, attr = self._paths[path].partition(':')
+            module = import_module(module)
+            if attr:
+                module = getattr(module, attr)
+            self._modules[path] = module
+        return self._modules[path]
+
+    def __iter__(self):
+        self._load_plugins()
+        return iter(self._paths)
+
+    def __len__(self):
+        self._load_plugins()
+        return len(self._paths)
+
+    def __contains__(self, path):
+        self._load_plugins()
+        return path in self._paths
+
+    def module_path(self, path: str) -> str:
+        """
+        Dotted path of a parser module (without importing it)
+        """
+        self._load_plugins()
+        return self._paths[path]
+
+
+REGISTER = LazyRegister()
+
+
+def register_parser(path, module=None):
+    REGISTER.register(path, module)
 
 
 register_parser('siemens.va')
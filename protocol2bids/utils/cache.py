@@ -0,0 +1,249 @@
+"""
+On-disk cache of parsed printouts.
+
+Entries are content-addressed: their key is a hash of the bytes of the
+printout, of the parser that read it (name and source code), and of the
+parsing options. An entry holds the raw protocol tree returned by the
+parser's `_parse_printout_content`, so that a cache hit does not need to
+open the PDF at all.
+
+To avoid hashing the PDF again when nothing has changed, the hash of
+each file is remembered along with its (size, mtime).
+
+Entries are written to a temporary file which is then atomically moved
+into place, so that concurrent writers never leave a partial entry
+behind. Reading an entry marks it as recently used (by touching it),
+and the least recently used entries are evicted when the cache grows
+larger than its size cap.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from importlib.util import find_spec
+from os import PathLike
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+
+def _default_root() -> Path:
+    if 'PROTOCOL2BIDS_CACHE_DIR' in os.environ:
+        return Path(os.environ['PROTOCOL2BIDS_CACHE_DIR'])
+    root = os.environ.get('XDG_CACHE_HOME') or Path('~/.cache').expanduser()
+    return Path(root) / 'protocol2bids'
+
+
+DEFAULT_MAX_SIZE = 1024 ** 3    # 1 GiB
+
+
+@lru_cache
+def parser_version(module: ModuleType | str) -> str:
+    """
+    Hash of the source code of a parser (all the modules of its package),
+    so that entries are invalidated whenever the parser changes.
+    The parser can be given by its dotted path, in which case it is
+    not imported.
+    """
+    if isinstance(module, str):
+        origin = find_spec(module.partition(':')[0]).origin
+    else:
+        origin = module.__file__
+    digest = hashlib.sha256()
+    for path in sorted(Path(origin).parent.glob('*.py')):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """
+    Write a file so that readers see either nothing or the full content
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            ...
+        raise
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed printouts, with a size cap and LRU eviction.
+
+    Layout
+    ------
+    {root}/entries/{key[:2]}/{key}.json
+        Parsed content, keyed by (file hash, parser, options)
+    {root}/files/{hash(abspath)[:2]}/{hash(abspath)}.json
+        (path, size, mtime, hash) of files that were already hashed
+    """
+
+    def __init__(
+        self,
+        root: str | PathLike | None = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        """
+        Parameters
+        ----------
+        root : str | PathLike, optional
+            Cache directory. Default: `$PROTOCOL2BIDS_CACHE_DIR`, else
+            `$XDG_CACHE_HOME/protocol2bids`, else
+            `~/.cache/protocol2bids`.
+        max_size : int
+            Maximum size of the cache, in bytes.
+        """
+        self.root = Path(root) if root else _default_root()
+        self.max_size = max_size
+
+    def file_hash(self, path: str | PathLike) -> str:
+        """
+        Hash of the content of a file.
+
+        The file is only hashed again if its size or mtime changed
+        since the last time it was hashed.
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        name = hashlib.sha256(str(path).encode()).hexdigest()
+        record = self.root / 'files' / name[:2] / f'{name}.json'
+        try:
+            info = json.loads(record.read_bytes())
+            if (info['size'], info['mtime']) == (stat.st_size,
+                                                 stat.st_mtime_ns):
+                return info['hash']
+        except (OSError, ValueError, KeyError):
+            ...
+        digest = hashlib.sha256()
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        info = dict(path=str(path), size=stat.st_size,
+                    mtime=stat.st_mtime_ns, hash=digest.hexdigest())
+        write_atomic(record, json.dumps(info).encode())
+        return info['hash']
+
+    def key(
+        self,
+        path: str | PathLike,
+        parser: str,
+        module: ModuleType | str,
+        **options,
+    ) -> str:
+        """
+        Key of the entry that holds a printout parsed with some parser
+        and options.
+
+        Parameters
+        ----------
+        path : str | PathLike
+            Printout
+        parser : str
+            Name of the parser in the register (ex: "siemens.vb")
+        module : module | str
+            Parser module, or its dotted path (see `parser_version`)
+        **options
+            Parsing options that change the parsed content
+            (ex: `skip_pages`, `protocols`).
+        """
+        options = {
+            key: sorted(value) if isinstance(value, (list, tuple, set))
+            else value
+            for key, value in options.items()
+        }
+        ident = json.dumps(dict(
+            file=self.file_hash(path),
+            parser=parser,
+            version=parser_version(module),
+            options=options,
+        ), sort_keys=True)
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / 'entries' / key[:2] / f'{key}.json'
+
+    def get(self, key: str) -> Any | None:
+        """
+        Return the content of an entry (None if it is not in the cache)
+        """
+        entry = self._entry(key)
+        try:
+            content = json.loads(entry.read_bytes())
+            os.utime(entry)     # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return content
+
+    def put(self, key: str, content: Any) -> None:
+        """
+        Store the content of an entry, and evict old entries if needed
+        """
+        write_atomic(self._entry(key), json.dumps(content).encode())
+        self.prune()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        """
+        (last access, size, path) of all entries, oldest first
+        """
+        entries = []
+        for entry in (self.root / 'entries').glob('*/*.json'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # evicted by someone else
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        return sorted(entries)
+
+    def prune(self, max_size: int | None = None) -> tuple[int, int]:
+        """
+        Evict the least recently used entries until the cache fits
+        within `max_size` (default: the cache's size cap).
+
+        Returns
+        -------
+        count : int
+            Number of evicted entries
+        size : int
+            Number of bytes freed
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        count = freed = 0
+        for _, size, entry in entries:
+            if total - freed <= max_size:
+                break
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                continue
+            count += 1
+            freed += size
+        return count, freed
+
+    def stats(self) -> dict:
+        """
+        Location, number of entries, size and size cap of the cache
+        """
+        entries = self._entries()
+        files = list((self.root / 'files').glob('*/*.json'))
+        return dict(
+            root=str(self.root),
+            entries=len(entries),
+            size=sum(size for _, size, _ in entries),
+            max_size=self.max_size,
+            hashed_files=len(files),
+            oldest=entries[0][0] if entries else None,
+            newest=entries[-1][0] if entries else None,
+        )
@@ -0,0 +1,92 @@
+"""
+Dumps of parsed printouts.
+
+A dump holds the raw protocol tree of a printout (the output of the
+parser's `_parse_printout_content`: protocol headers and nested
+card/group/key dictionaries), along with the name of the parser that
+produced it. Sidecars can be regenerated from a dump without reading
+the PDF again, which makes it cheap to iterate on the keymaps.
+
+Dumps are written as JSON, or as msgpack if the file extension is
+`.msgpack` or `.mpk` (requires the `msgpack` package).
+"""
+import json
+from os import PathLike
+from pathlib import Path
+from typing import Any
+
+DUMP_FORMAT = 1
+MSGPACK_SUFFIXES = ('.msgpack', '.mpk')
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError(
+            'msgpack dumps require the `msgpack` package '
+            '(pip install msgpack), or use a .json extension'
+        )
+    return msgpack
+
+
+def dump_format(path: str | PathLike) -> str:
+    """
+    Format of a dump file ("json" or "msgpack"), from its extension.
+    Raises an ImportError if msgpack is needed but not installed.
+    """
+    if Path(path).suffix.lower() in MSGPACK_SUFFIXES:
+        _msgpack()
+        return 'msgpack'
+    return 'json'
+
+
+def write_dump(path: str | PathLike, parser: str, content: Any) -> None:
+    """
+    Write a dump
+
+    Parameters
+    ----------
+    path : str | PathLike
+        Output file (`.json`, `.msgpack` or `.mpk`)
+    parser : str
+        Name of the parser in the register (ex: "siemens.vb")
+    content : list | tuple
+        Output of the parser's `_parse_printout_content`
+    """
+    path = Path(path)
+    dump = dict(format=DUMP_FORMAT, parser=parser, content=content)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if dump_format(path) == 'msgpack':
+        path.write_bytes(_msgpack().packb(dump))
+    else:
+        with path.open('w') as f:
+            json.dump(dump, f, separators=(',', ':'))
+
+
+def read_dump(path: str | PathLike) -> tuple[str, Any]:
+    """
+    Read a dump
+
+    Parameters
+    ----------
+    path : str | PathLike
+        Dump file (`.json`, `.msgpack` or `.mpk`)
+
+    Returns
+    -------
+    parser : str
+        Name of the parser in the register (ex: "siemens.vb")
+    content : list
+        Output of the parser's `_parse_printout_content`
+        (tuples are read back as lists)
+    """
+    path = Path(path)
+    if dump_format(path) == 'msgpack':
+        dump = _msgpack().unpackb(path.read_bytes())
+    else:
+        with path.open() as f:
+            dump = json.load(f)
+    if not isinstance(dump, dict) or dump.get('format') != DUMP_FORMAT:
+        raise ValueError(f'Not a protocol2bids dump: {path}')
+    return dump['parser'], dump['content']
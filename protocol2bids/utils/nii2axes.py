@@ -1,17 +1,242 @@
-import nibabel as nib
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import numpy as np
 
+# Large enough for a NIfTI-1 (348 bytes) or NIfTI-2 (540 bytes) header
+_HEADER_SIZE = 540
+
+# (offset, format) of the header fields that we need
+_NIFTI1 = dict(
+    dim=(40, '8h'), pixdim=(76, '8f'), qform_code=(252, 'h'),
+    sform_code=(254, 'h'), quatern=(256, '6f'), srow=(280, '12f'),
+)
+_NIFTI2 = dict(
+    dim=(16, '8q'), pixdim=(104, '8d'), qform_code=(344, 'i'),
+    sform_code=(348, 'i'), quatern=(352, '6d'), srow=(400, '12d'),
+)
+
+# Fewer files than this are read serially
+_MIN_THREADED = 8
+
+
+def _read_header_bytes(path):
+    """
+    Read the first bytes of a NIfTI file (enough for its header).
+    Plain files are memory-mapped, and only the beginning of
+    gzipped files is decompressed.
+    """
+    with open(path, 'rb') as f:
+        if str(path).endswith('.gz'):
+            data = b''
+            stream = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            while len(data) < _HEADER_SIZE:
+                chunk = stream.unconsumed_tail or f.read(1024)
+                if not chunk:
+                    break
+                data += stream.decompress(chunk, _HEADER_SIZE - len(data))
+            return data
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[:_HEADER_SIZE]
+
+
+def _parse_header(data):
+    """
+    Compute the (affine, shape) of a NIfTI-1 or NIfTI-2 header,
+    the same way nibabel does (`get_best_affine`)
+    """
+    for layout, size in ((_NIFTI1, 348), (_NIFTI2, 540)):
+        for endian in '<>':
+            if len(data) >= size and \
+                    struct.unpack_from(endian + 'i', data)[0] == size:
+                break
+        else:
+            continue
+        break
+    else:
+        raise ValueError('Not a NIfTI-1 or NIfTI-2 header')
+
+    def get(field):
+        offset, fmt = layout[field]
+        return struct.unpack_from(endian + fmt, data, offset)
+
+    dim = get('dim')
+    ndim = min(max(dim[0], 0), 7)
+    shape = tuple(int(x) for x in dim[1:ndim+1])
+    pixdim = [abs(float(x)) for x in get('pixdim')]
+
+    affine = np.eye(4)
+    if get('sform_code')[0] != 0:
+        affine[:3, :] = np.reshape(get('srow'), (3, 4))
+    elif get('qform_code')[0] != 0:
+        b, c, d, *offset = get('quatern')
+        qfac = get('pixdim')[0]
+        qfac = qfac if qfac in (-1, 1) else 1
+        a = 1.0 - (b*b + c*c + d*d)
+        if a < 0:
+            # (b, c, d) is not a unit quaternion, unless by rounding
+            if a < -3 * np.finfo(np.float32).eps:
+                raise ValueError(f'Invalid quaternion: a**2 = {a:e}')
+            a = 0
+        a = a**0.5
+        s = 2 / (a*a + b*b + c*c + d*d)
+        rot = np.array([
+            [1 - s*(c*c + d*d), s*(b*c - a*d), s*(b*d + a*c)],
+            [s*(b*c + a*d), 1 - s*(b*b + d*d), s*(c*d - a*b)],
+            [s*(b*d - a*c), s*(c*d + a*b), 1 - s*(b*b + c*c)],
+        ])
+        affine[:3, :3] = rot * (pixdim[1:3] + [pixdim[3] * qfac])
+        affine[:3, 3] = offset
+    else:
+        # scanner-less header: voxel size, x flipped, centered
+        zooms = np.ones(3)
+        zooms[:min(ndim, 3)] = pixdim[1:min(ndim, 3)+1]
+        zooms[0] *= -1
+        full_shape = np.ones(3)
+        full_shape[:min(ndim, 3)] = shape[:3]
+        affine[:3, :3] = np.diag(zooms)
+        affine[:3, 3] = -(full_shape - 1) / 2 * zooms
+    return affine, shape
+
+
+@lru_cache(maxsize=1024)
+def _nii_header(path, size, mtime):
+    return _parse_header(_read_header_bytes(path))
+
+
+def nii_header(file):
+    """
+    Read the affine and shape of a NIfTI file from its header only
+    (the data is not read, and nibabel is not needed).
+
+    Headers are cached by (path, size, mtime), so a file is only read
+    again if it changed.
+
+    Parameters
+    ----------
+    file : path-like
+        Path to a .nii or .nii.gz file
+
+    Returns
+    -------
+    affine : (4, 4) array
+        Voxel-to-world matrix (same as nibabel's `img.affine`)
+    shape : tuple[int]
+        Volume shape
+    """
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+    affine, shape = _nii_header(path, stat.st_size, stat.st_mtime_ns)
+    return affine.copy(), shape
+
+
+def nii_headers(files, workers=None):
+    """
+    Read the (affine, shape) of many NIfTI files (see `nii_header`),
+    in a pool of threads if there are many of them.
+
+    Parameters
+    ----------
+    files : list[path-like]
+        Paths to .nii or .nii.gz files
+    workers : int, optional
+        Number of threads (default: chosen by `ThreadPoolExecutor`)
+
+    Returns
+    -------
+    headers : list[tuple[(4, 4) array, tuple[int]]]
+        Affine and shape of each file
+    """
+    files = list(files)
+    if len(files) < _MIN_THREADED or workers == 1:
+        return list(map(nii_header, files))
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(nii_header, files))
+
 
 def nii2shape(file=None, shape=None, affine=None):
     if file is not None:
-        f = nib.load(file)
+        file_affine, file_shape = nii_header(file)
         if shape is None:
-            shape = f.shape[:3]
+            shape = file_shape[:3]
         if affine is None:
-            affine = f.affine
+            affine = file_affine
     return affine, shape
 
 
+# Voxel-to-anatomical axis permutations: `_PERMUTATIONS[p][i]` is the
+# anatomical axis (0: LR, 1: PA, 2: IS) of voxel axis i
+_PERMUTATIONS = np.array([
+    [0, 1, 2], [0, 2, 1], [1, 0, 2], [1, 2, 0], [2, 0, 1], [2, 1, 0],
+])
+
+
+@lru_cache(maxsize=48)
+def _orientation2axes(perm, flips):
+    """
+    `vox2anat` and `anat2vox` of a permutation (index into
+    `_PERMUTATIONS`) and of the polarity of each voxel axis (`flips[i]`
+    is True if voxel axis i runs against its anatomical axis)
+    """
+    anatnames = ['LR', 'PA', 'IS']
+    voxnames = ['i', 'j', 'k']
+    index = _PERMUTATIONS[perm].tolist()
+    vox2anat = [
+        anatnames[anat][::-1] if flip else anatnames[anat]
+        for anat, flip in zip(index, flips)
+    ]
+    anat2vox = {}
+    for vox, name in zip(voxnames, vox2anat):
+        anat2vox[name] = vox
+        anat2vox[name[::-1]] = vox + '-'
+    return vox2anat, anat2vox
+
+
+def nii2axes_batch(affines):
+    """
+    Compute mappings between voxel (ijk) and anatomical (RAS) axes,
+    for many affines at once
+
+    Each voxel axis is matched with the anatomical axis it is most
+    aligned with, such that all axes are matched. Ties (45 deg angles)
+    are broken deterministically. The polarity of each voxel axis is the
+    sign of its direction cosine along the matched anatomical axis, and
+    the mappings are only built once per distinct orientation.
+
+    Parameters
+    ----------
+    affines : (N, 4, 4) or (N, 3, 3) array
+        Affine matrices
+
+    Returns
+    -------
+    axes : list[tuple[vox2anat, anat2vox]]
+        Mappings of each affine (see `nii2axes`)
+    """
+    affines = np.asarray(affines, dtype=float)[:, :3, :3]
+    if not len(affines):
+        return []
+    # column-normalized direction cosines (voxel size does not matter)
+    cosines = np.abs(affines)
+    cosines /= np.sqrt((cosines**2).sum(1, keepdims=True))
+    # score of each permutation (N, 6); argmax picks the first of ties
+    scores = cosines[:, _PERMUTATIONS, [0, 1, 2]].sum(-1)
+    perms = scores.argmax(-1)
+    # polarity of each voxel axis along its anatomical axis (N, 3)
+    flips = affines[
+        np.arange(len(affines))[:, None], _PERMUTATIONS[perms], [0, 1, 2]
+    ] < 0
+    axes = []
+    for perm, flip in zip(perms.tolist(), map(tuple, flips.tolist())):
+        vox2anat, anat2vox = _orientation2axes(perm, flip)
+        axes.append((list(vox2anat), dict(anat2vox)))
+    return axes
+
+
 def nii2axes(**kwargs):
     """
     Compute mappings between voxel (ijk) and anatomical (RAS) axes
@@ -41,51 +266,5 @@ def nii2axes(**kwargs):
     if affine is None or shape is None:
         return None, None, None
 
-    affine = affine[:3, :3]
-    voxel_size = (affine**2).sum(0)**0.5
-    affine = affine / voxel_size
-
-    # add noise to avoid issues if there's a 45 deg angle somewhere
-    affine = affine + (np.random.random([3, 3]) - 0.5) * 1e-5
-
-    # project onto canonical axes
-    onehot = np.round(np.square(affine)).astype(np.int32)
-    index = [
-        onehot[:, 0].tolist().index(1),
-        onehot[:, 1].tolist().index(1),
-        onehot[:, 2].tolist().index(1),
-    ]
-    sign = [
-        -1 if affine[index[0], 0] < 0 else 1,
-        -1 if affine[index[1], 1] < 0 else 1,
-        -1 if affine[index[2], 2] < 0 else 1,
-    ]
-    anatnames = ['LR', 'PA', 'IS']
-    voxnames = ['i', 'j', 'k']
-
-    vox2anat = [
-        anatnames[index[0]][::-1] if sign[0] else index[0],
-        anatnames[index[1]][::-1] if sign[1] else index[1],
-        anatnames[index[2]][::-1] if sign[2] else index[2],
-    ]
-    anat2vox = {}
-    if 'LR' in vox2anat:
-        anat2vox['LR'] = voxnames[vox2anat.index('LR')]  # + '+'
-        anat2vox['RL'] = voxnames[vox2anat.index('LR')] + '-'
-    else:
-        anat2vox['RL'] = voxnames[vox2anat.index('RL')]  # + '+'
-        anat2vox['LR'] = voxnames[vox2anat.index('RL')] + '-'
-    if 'PA' in vox2anat:
-        anat2vox['PA'] = voxnames[vox2anat.index('PA')]  # + '+'
-        anat2vox['AP'] = voxnames[vox2anat.index('PA')] + '-'
-    else:
-        anat2vox['AP'] = voxnames[vox2anat.index('AP')]  # + '+'
-        anat2vox['PA'] = voxnames[vox2anat.index('AP')] + '-'
-    if 'IS' in vox2anat:
-        anat2vox['IS'] = voxnames[vox2anat.index('IS')]  # + '+'
-        anat2vox['SI'] = voxnames[vox2anat.index('IS')] + '-'
-    else:
-        anat2vox['SI'] = voxnames[vox2anat.index('SI')]  # + '+'
-        anat2vox['IS'] = voxnames[vox2anat.index('SI')] + '-'
-
+    (vox2anat, anat2vox), = nii2axes_batch(np.asarray(affine)[None])
     return vox2anat, anat2vox, shape
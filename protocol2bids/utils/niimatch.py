@@ -0,0 +1,190 @@
+"""
+Match protocols with NIfTI files.
+
+When a printout holds many protocols, the NIfTI file of each protocol
+can be found automatically (rather than from the order of the `--nii`
+list) by comparing what the protocol says about the volume (voxel size,
+matrix, number of slices) with the header of each NIfTI file.
+
+The dissimilarity between all protocols and all files is computed as
+a cost matrix, and the protocols are paired with files such that the
+total cost is minimal (linear assignment).
+"""
+import numpy as np
+
+from .nii2axes import nii_headers
+
+# Cost of a feature that is unknown
+_MISSING_COST = np.log(2)
+
+
+class NiiPool(list):
+    """
+    NIfTI files (or `nii2axes` keywords) to be matched with the
+    protocols of a printout, rather than paired by position.
+
+    Parsers that do not know how to match files pair them by position.
+    """
+
+
+def _linear_assignment(cost):
+    """
+    Solve a (rectangular) linear assignment problem.
+
+    Shortest augmenting paths, with the inner loop over columns
+    vectorized (O(n^2 m) operations but only O(n m) Python steps).
+
+    Parameters
+    ----------
+    cost : (N, M) array
+        Finite cost of pairing each row with each column
+
+    Returns
+    -------
+    match : (N,) array[int]
+        Column paired with each row (-1 if the row is not paired,
+        which happens when N > M)
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # potentials, and row (1-based, 0: none) paired with each column;
+    # column 0 is a virtual column holding the row being inserted
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    # start from the row minima, and pair each row with its cheapest
+    # column if no other row took it (only the others need a path)
+    u[1:] = cost.min(1)
+    cols, rows = np.unique(cost.argmin(1), return_index=True)
+    row_of[cols + 1] = rows + 1
+    unpaired = np.setdiff1d(np.arange(n), rows)
+    for i in (unpaired + 1).tolist():
+        row_of[0] = i
+        col = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        # grow a tree of tight edges until it reaches a free column
+        while True:
+            used[col] = True
+            row = row_of[col]
+            free = ~used
+            reduced = cost[row - 1] - u[row] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = col
+            candidates = np.where(free, minv, np.inf)
+            candidates[0] = np.inf
+            nxt = int(candidates.argmin())
+            delta = candidates[nxt]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            col = nxt
+            if row_of[col] == 0:
+                break
+        # augment along the path
+        while col:
+            prev = way[col]
+            row_of[col] = row_of[prev]
+            col = prev
+    rows, cols = row_of[1:] - 1, np.arange(m)
+    paired = rows >= 0
+    rows, cols = rows[paired], cols[paired]
+    if transposed:
+        rows, cols = cols, rows
+        n = m
+    match = np.full(n, -1)
+    match[rows] = cols
+    return match
+
+
+def _log_distance(a, b):
+    """
+    |log(a / b)|, with `_MISSING_COST` where either is unknown (nan)
+    or not positive
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dist = np.abs(np.log(a) - np.log(b))
+    return np.where(np.isfinite(dist), dist, _MISSING_COST)
+
+
+def match_cost(voxel_sizes, matrices, affines, shapes):
+    """
+    Dissimilarity between protocols and NIfTI volumes.
+
+    Voxel axes of the NIfTI files and axes of the protocol (read,
+    phase, slice) are not paired, so voxel sizes are compared sorted,
+    and each matrix size is compared with the closest dimension of
+    the volume.
+
+    Parameters
+    ----------
+    voxel_sizes : (P, 3) array
+        Voxel size of each protocol (nan if unknown)
+    matrices : (P, K) array
+        Matrix size of each protocol along some of its axes, for
+        example (read, phase, slices) (nan if unknown)
+    affines : (F, 4, 4) array
+        Affine of each volume
+    shapes : (F, 3) array
+        Shape of each volume
+
+    Returns
+    -------
+    cost : (P, F) array
+    """
+    voxel_sizes = np.sort(np.asarray(voxel_sizes, dtype=float), -1)
+    matrices = np.asarray(matrices, dtype=float)
+    affines = np.asarray(affines, dtype=float)[:, :3, :3]
+    shapes = np.asarray(shapes, dtype=float)
+    nii_voxel_sizes = np.sort(np.sqrt((affines**2).sum(1)), -1)
+
+    # (P, F, 3): voxel sizes
+    cost = _log_distance(
+        voxel_sizes[:, None, :], nii_voxel_sizes[None, :, :]
+    ).sum(-1)
+    # (P, F, K, 3) -> (P, F): matrix sizes vs closest dimension
+    cost += _log_distance(
+        matrices[:, None, :, None], shapes[None, :, None, :]
+    ).min(-1).sum(-1)
+    return cost
+
+
+def match_nii(voxel_sizes, matrices, nii):
+    """
+    Find the NIfTI volume of each protocol.
+
+    Parameters
+    ----------
+    voxel_sizes : (P, 3) array
+        Voxel size of each protocol (nan if unknown)
+    matrices : (P, K) array
+        Matrix size of each protocol along some of its axes
+        (nan if unknown)
+    nii : list[dict]
+        `nii2axes` keywords (`file`, or `affine` and `shape`) of
+        each volume
+
+    Returns
+    -------
+    match : (P,) array[int]
+        Index of the volume of each protocol (-1 if none)
+    """
+    files = [info['file'] for info in nii if 'file' in info]
+    headers = iter(nii_headers(files))
+    affines, shapes = [], []
+    for info in nii:
+        affine, shape = next(headers) if 'file' in info else (None, None)
+        affine = info.get('affine', affine)
+        shape = info.get('shape', shape)
+        affines.append(np.eye(4) if affine is None else affine)
+        shapes.append((np.nan,) * 3 if shape is None else
+                      (tuple(shape) + (1, 1, 1))[:3])
+    if not len(voxel_sizes) or not affines:
+        return np.full(len(voxel_sizes), -1)
+    cost = match_cost(voxel_sizes, matrices, affines, shapes)
+    return _linear_assignment(cost)
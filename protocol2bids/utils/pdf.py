@@ -0,0 +1,24 @@
+import pymupdf
+from os import PathLike
+
+
+def open_pdf(path: str | PathLike | pymupdf.Document) -> pymupdf.Document:
+    """
+    Open a PDF document, unless it is already open.
+
+    Parsers and sniffers accept either a path or an open document, so
+    that a single handle can be shared across all of them.
+
+    Parameters
+    ----------
+    path : str | PathLike | pymupdf.Document
+        Path to PDF file, or open document
+
+    Returns
+    -------
+    doc : pymupdf.Document
+        Open document
+    """
+    if isinstance(path, pymupdf.Document):
+        return path
+    return pymupdf.open(str(path))
@@ -0,0 +1,242 @@
+"""
+Incremental conversion of a tree of printouts.
+
+Printouts are paired with their NIfTI files and output sidecars by
+their relative path:
+
+    {pdf_root}/{path}.pdf -> {out_root}/{path}.json
+    {nii_root}/{path}.nii[.gz]
+
+A printout that holds several protocols whose NIfTI files are stored
+separately (e.g. `all.pdf` -> `anat.nii`, `rest.nii`) is listed in a
+manifest in its folder (`protocol2bids.tsv`), with tab-separated columns
+`input`, `output` and `skip_pages` (comma- or space-separated):
+
+    all.pdf     anat.json   0 1
+    all.pdf     rest.json   2 3
+
+Each row is converted on its own, and paired with the NIfTI file of its
+output (`{nii_root}/{dir}/anat.nii[.gz]`). Printouts that are not listed
+in a manifest are paired by their own path.
+
+A small state file in the output tree remembers, for each printout,
+what its outputs were computed from: the printout (size, mtime and
+hash), the NIfTI header, and the parser (name and version). An output
+is only recomputed if one of these changed (or if it is missing).
+Printouts that could not be converted are remembered as well, and
+are only tried again if they (or any parser) changed.
+"""
+import gzip
+import hashlib
+import json
+from os import PathLike
+from pathlib import Path
+from typing import Iterator
+
+from .cache import write_atomic
+
+STATE_FILE = '.protocol2bids-state.json'
+STATE_FORMAT = 1
+MANIFEST_FILE = 'protocol2bids.tsv'
+
+
+def _read_manifest(path: Path) -> dict[Path, list[tuple[Path, list]]]:
+    """
+    Read the manifest of a folder of printouts: for each printout, the
+    (output path without extension, skip_pages) of each of its rows.
+    Empty lines, lines starting with `#`, and a header line are ignored.
+    """
+    rows = {}
+    with path.open() as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.rstrip('\n').split('\t')]
+            fields += [''] * (3 - len(fields))
+            inp, out, skip = fields[:3]
+            if (inp, out) == ('input', 'output'):
+                continue
+            if not inp or not out:
+                raise ValueError(f'{path}:{lineno}: missing input or output')
+            rows.setdefault(path.parent / inp, []).append((
+                path.parent / Path(out).with_suffix(''),
+                [int(x) for x in skip.replace(',', ' ').split()] or None,
+            ))
+    return rows
+
+
+def iter_tree(
+    pdf_root: str | PathLike,
+    out_root: str | PathLike,
+    nii_root: str | PathLike | None = None,
+) -> Iterator[tuple[str, Path, Path, Path | None, list[int] | None]]:
+    """
+    Iterate over the printouts of a tree, in a deterministic order.
+    A printout listed in a manifest is yielded once per row.
+
+    Yields
+    ------
+    name : str
+        Path of the output relative to `out_root`, without extension
+    pdf : Path
+        Printout
+    out : Path
+        Output sidecar
+    nii : Path | None
+        NIfTI file, if one exists
+    skip_pages : list[int] | None
+        Pages of the printout to ignore (from its manifest)
+    """
+    pdf_root, out_root = Path(pdf_root), Path(out_root)
+    manifests = {}
+    for manifest in sorted(pdf_root.rglob(MANIFEST_FILE)):
+        manifests.update(_read_manifest(manifest))
+    for pdf in sorted(pdf_root.rglob('*.pdf')):
+        targets = manifests.get(pdf, [(pdf.with_suffix(''), None)])
+        for target, skip_pages in targets:
+            rel = target.relative_to(pdf_root)
+            nii = None
+            if nii_root is not None:
+                for suffix in ('.nii', '.nii.gz'):
+                    candidate = (
+                        Path(nii_root) / rel.parent / (rel.name + suffix)
+                    )
+                    if candidate.exists():
+                        nii = candidate
+                        break
+            out = out_root / rel.with_suffix('.json')
+            yield rel.as_posix(), pdf, out, nii, skip_pages
+
+
+def nii_signature(path: str | PathLike | None) -> str | None:
+    """
+    Hash of the header of a NIfTI file (the data is not read)
+    """
+    if path is None:
+        return None
+    # imported here, so that numpy is only imported to convert files
+    from .nii2axes import _HEADER_SIZE
+    path = Path(path)
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rb') as f:
+        return hashlib.sha256(f.read(_HEADER_SIZE)).hexdigest()
+
+
+def outputs_exist(out: str | PathLike, count: int) -> bool:
+    """
+    Whether all the sidecars of a conversion are on disk
+    (`out`, or `out1`, `out2`, ... if there are several)
+    """
+    out = Path(out)
+    if count == 1:
+        return out.exists()
+    return all(
+        out.with_stem(out.stem + f'{i+1}').exists() for i in range(count)
+    )
+
+
+def _version(versions: dict[str, str], parser: str | None) -> str:
+    """
+    Version of a parser. A failed conversion (`parser=None`) depends on
+    the versions of all parsers, since any of them could start working.
+    """
+    if parser is None:
+        return hashlib.sha256(
+            json.dumps(versions, sort_keys=True).encode()
+        ).hexdigest()
+    return versions.get(parser)
+
+
+class TreeState:
+    """
+    What the outputs of a tree were computed from.
+
+    Each entry is indexed by the relative path of a printout and
+    contains the keys `pdf` (size, mtime, hash), `nii` (header hash),
+    `skip_pages`, `parser`, `version`, `count` (number of sidecars) and
+    `error` (if the printout could not be converted).
+    """
+
+    def __init__(self, out_root: str | PathLike):
+        self.path = Path(out_root) / STATE_FILE
+        self.entries: dict[str, dict] = {}
+        try:
+            state = json.loads(self.path.read_bytes())
+            if state.get('format') == STATE_FORMAT:
+                self.entries = state['entries']
+        except (OSError, ValueError, KeyError):
+            ...
+
+    def save(self) -> None:
+        state = dict(format=STATE_FORMAT, entries=self.entries)
+        write_atomic(self.path, json.dumps(state, indent=1).encode())
+
+    def pdf_signature(self, name: str, path: str | PathLike) -> dict:
+        """
+        (size, mtime, hash) of a printout. The file is only hashed
+        if its size or mtime differ from the ones in the state.
+        """
+        stat = Path(path).stat()
+        sig = dict(size=stat.st_size, mtime=stat.st_mtime_ns)
+        old = self.entries.get(name, {}).get('pdf', {})
+        if (old.get('size'), old.get('mtime')) == (sig['size'], sig['mtime']):
+            sig['hash'] = old['hash']
+        else:
+            sig['hash'] = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+        return sig
+
+    def is_up_to_date(
+        self,
+        name: str,
+        pdf: dict,
+        nii: str | None,
+        versions: dict[str, str],
+        out: str | PathLike,
+        skip_pages: list[int] | None = None,
+    ) -> bool:
+        """
+        Whether the outputs of a printout are up to date
+
+        Parameters
+        ----------
+        name : str
+            Relative path of the printout
+        pdf : dict
+            Current signature of the printout (`pdf_signature`)
+        nii : str | None
+            Current signature of the NIfTI header (`nii_signature`)
+        versions : dict[str, str]
+            Current version of each parser
+        out : str | PathLike
+            Output sidecar
+        skip_pages : list[int] | None
+            Pages of the printout to ignore
+        """
+        entry = self.entries.get(name)
+        return (
+            entry is not None and
+            entry['pdf']['hash'] == pdf['hash'] and
+            entry['nii'] == nii and
+            entry.get('skip_pages') == skip_pages and
+            _version(versions, entry['parser']) == entry['version'] and
+            outputs_exist(out, entry['count'])
+        )
+
+    def update(
+        self,
+        name: str,
+        pdf: dict,
+        nii: str | None,
+        versions: dict[str, str],
+        skip_pages: list[int] | None = None,
+        parser: str | None = None,
+        count: int = 0,
+        error: str | None = None,
+    ) -> None:
+        """
+        Record a conversion (`parser` and `count`), or a failure (`error`)
+        """
+        self.entries[name] = dict(
+            pdf=pdf, nii=nii, skip_pages=skip_pages, parser=parser,
+            version=_version(versions, parser), count=count, error=error,
+        )
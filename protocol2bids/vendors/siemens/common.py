@@ -1,35 +1,172 @@
 import fnmatch
+import re
+from functools import lru_cache
+from logging import getLogger
 from math import ceil
 from operator import truediv
+import numpy as np
 from protocol2bids.utils.nii2axes import nii2axes
+from protocol2bids.utils.niimatch import NiiPool, match_nii
+
+LOGGER = getLogger(__name__)
 
 
 def _error(*a, **k):
     raise RuntimeError(*a, **k)
 
 
-def _get(mapping, key, *default):
+# Returned by lookups that did not find anything
+_MISSING = object()
+
+
+# ----------------------------------------------------------------------
+#   Units
+# ----------------------------------------------------------------------
+# Units found in the printouts (ex: "2.5 ms", "50 [%]"), as
+#   {unit: (base unit, factor, divisor)}
+# so that a magnitude in `unit` is `magnitude * factor / divisor` in
+# `base unit`. "" is dimensionless.
+_UNITS = {
+    "": ("", 1, 1),
+    "%": ("", 1, 100),
+    "s": ("s", 1, 1),
+    "ms": ("s", 1e-3, 1),
+    "us": ("s", 1e-6, 1),
+    "mm": ("mm", 1, 1),
+    "deg": ("deg", 1, 1),
+    "Hz": ("Hz", 1, 1),
+    "MHz": ("Hz", 1e6, 1),
+    "Hz/Px": ("Hz/Px", 1, 1),
+    "V": ("V", 1, 1),
+    "s/mm²": ("s/mm²", 1, 1),
+}
+
+_QUANTITY = re.compile(
+    r"\s*([-+]?(?:\d+\.?\d*|\.\d+))"
+    r"(?:\s*\[?(" + "|".join(
+        re.escape(unit) for unit in sorted(_UNITS, key=len, reverse=True)
+        if unit
+    ) + r")\]?|\s+\[?([^\s\d\[\]][^\s\[\]]*)\]?)?\s*"
+)
+
+
+class Quantity(str):
+    """
+    A protocol value made of a number and a unit
+    (ex: "2.5 ms", "50 [%]", "64").
+
+    It is still the raw string (so that it can be compared with or
+    parsed as one), with its `magnitude` and `unit` parsed once.
+    """
+
+    def __new__(cls, raw, magnitude, unit):
+        self = super().__new__(cls, raw)
+        self.magnitude = magnitude
+        self.unit = unit
+        return self
+
+    def __getnewargs__(self):
+        return str(self), self.magnitude, self.unit
+
+    def to(self, unit):
+        """
+        Magnitude in another unit (ex: `Quantity("2.5 ms").to("s")`).
+
+        A value printed without a unit is taken to be in `unit` already.
+        If either unit is not in `_UNITS`, a warning is logged and the
+        magnitude is returned as is. Raises a ValueError if the units
+        are known but not compatible.
+        """
+        if unit == self.unit or not self.unit:
+            return self.magnitude
+        if self.unit not in _UNITS or unit not in _UNITS:
+            LOGGER.warning(
+                f"Unknown unit, {str(self)!r} not converted to {unit!r}"
+            )
+            return self.magnitude
+        base, factor, divisor = _UNITS[self.unit]
+        target, target_factor, target_divisor = _UNITS[unit]
+        if target != base:
+            raise ValueError(f"Cannot convert {str(self)!r} to {unit!r}")
+        value = self.magnitude * factor / divisor
+        if (target_factor, target_divisor) != (1, 1):
+            value = value / target_factor * target_divisor
+        return value
+
+
+# Parsed protocol strings (see `_quantity`), cleared when full
+_QUANTITIES = {}
+_MAX_QUANTITIES = 1 << 16
+
+
+def _quantity(value):
+    """
+    Parse a protocol string into a `Quantity` if it is a number,
+    optionally followed by a unit, else return it as is
+    """
+    quantity = _QUANTITIES.get(value)
+    if quantity is None:
+        match = _QUANTITY.fullmatch(value)
+        if match is None:
+            quantity = value
+        else:
+            magnitude = float(match.group(1))
+            unit = match.group(2) or match.group(3) or ""
+            quantity = Quantity(value, magnitude, unit)
+        if len(_QUANTITIES) >= _MAX_QUANTITIES:
+            _QUANTITIES.clear()
+        _QUANTITIES[value] = quantity
+    return quantity
+
+
+def _index_protocol(prot, prefix="", index=None):
     """
-    Get element from nested dictionary, with "//" separating levels
+    Index a parsed protocol into a flat mapping, with "//" separating
+    levels (ex: {"Routine//Slab group 1//Orientation": "T > C-1.2"}).
+    Every level of nesting has an entry. Numbers with units are
+    parsed into quantities (see `Quantity`).
     """
-    try:
-        key = list(key.split("//"))
-        while key:
-            mapping = mapping[key.pop(0)]
-    except Exception:
-        if default:
-            return default[0]
+    if index is None:
+        index = {}
+    for key, value in prot.items():
+        path = prefix + key
+        if isinstance(value, str):
+            index[path] = _QUANTITIES.get(value) or _quantity(value)
         else:
-            raise
-    return mapping
+            index[path] = value
+            if isinstance(value, dict):
+                _index_protocol(value, path + "//", index)
+    return index
+
+
+def _resolve_aliases(index):
+    """
+    Add the canonical paths (`ALIASES`) to an indexed protocol
+    """
+    for path, aliases in ALIASES.items():
+        for alias in aliases:
+            value = index.get(alias, _MISSING)
+            if value is not _MISSING:
+                index[path] = value
+                break
+    return index
+
+
+# Transversal direction of the printout -> anatomical direction
+_TRANSVERSAL = {"FH": "IS", "HF": "SI"}
+
+
+def _axis(x, s, c, t):
+    """
+    Anatomical direction (ex: "LR") along the Sagittal, Coronal or
+    Transversal (`x[0]`) axis, given the printout's system directions.
+    """
+    axes = (s[0] + s[-1], c[0] + c[-1], _TRANSVERSAL[t[0] + t[-1]])
+    return axes["SCT".index(x[0])]
 
 
 def _guess_fe_direction(pe, se, s, c, t):
-    se = {
-        "S": s[0] + s[-1],
-        "T": {"FH": "IS", "HF": "SI"}[t[0] + t[-1]],
-        "C": c[0] + c[-1],
-    }[se[0]]
+    se = _axis(se, s, c, t)
     pe = pe[0] + pe[-1]
     if pe in ("LR", "RL"):
         if se in ("PA", "AP"):
@@ -50,38 +187,328 @@ def _guess_fe_direction(pe, se, s, c, t):
         else:
             assert se in ("AP", "PA")
             fe = "S"
-    fe = {
-        "S": s[0] + s[-1],
-        "T": {"FH": "IS", "HF": "SI"}[t[0] + t[-1]],
-        "C": c[0] + c[-1],
-    }[fe]
-    return fe
-
-
-VARIANTS = {
-    "Orientation": (
-        "Routine//Orientation",
-        "Routine//Slab group 1//Orientation",
-        "Routine//Slice group 1//Orientation",
+    return _axis(fe, s, c, t)
+
+
+# Canonical protocol paths, and the paths under which each of them
+# is found in the printouts of the different software versions (by
+# order of preference). Protocols are rewritten to canonical paths
+# when they are indexed, so that the keymaps only use canonical paths.
+# Versions are noted when known.
+ALIASES = {
+    # ------------------------------------------------------------------
+    #   Routine
+    # ------------------------------------------------------------------
+    "Routine//Orientation": (
+        "Routine//Orientation",                       # VA,VD
+        "Routine//Slab group 1//Orientation",         # VB
+        "Routine//Slice group 1//Orientation",        # VB
     ),
-    "Phase enc. dir.": (
+    "Routine//Phase enc. dir.": (
         "Routine//Slab group 1//Phase enc. dir.",     # VB,VE
         "Routine//Slice group 1//Phase enc. dir.",    # VB,VE
-        "Routine//Phase enc. dir.",                   # VD
+        "Routine//Phase enc. dir.",                   # VA,VD
         "Geometry//Phase enc. dir.",                  # VD
     ),
+    # ------------------------------------------------------------------
+    #   Contrast
+    # ------------------------------------------------------------------
+    "Contrast//TI": (
+        "Contrast//TI",                               # VA,VB,VD
+        "Contrast - Common//TI",                      # VE
+    ),
+    "Contrast//Flip angle": (
+        "Contrast//Flip angle",                       # VA,VB,VD
+        "Contrast - Common//Flip angle",              # VE
+    ),
+    "Contrast//Fat suppr.": (
+        "Contrast//Fat suppr.",                       # VA,VB,VD
+        "Contrast - Common//Fat suppr.",              # VE
+    ),
+    # ------------------------------------------------------------------
+    #   Resolution
+    # ------------------------------------------------------------------
+    "Resolution//Base resolution": (
+        "Resolution//Base resolution",                # VA,VB,VD
+        "Resolution - Common//Base resolution",       # VE
+    ),
+    "Resolution//Phase resolution": (
+        "Resolution//Phase resolution",               # VA,VB,VD
+        "Resolution - Common//Phase resolution",      # VE
+    ),
+    "Resolution//Interpolation": (
+        "Resolution//Interpolation",                  # VA,VB,VD
+        "Resolution - Common//Interpolation",         # VE
+    ),
+    "Resolution//Phase partial Fourier": (
+        "Resolution//Phase partial Fourier",          # VA,VB,VD
+        "Resolution - Acceleration//Phase partial Fourier",
+    ),
+    "Resolution//PAT mode": (
+        "Resolution//PAT mode",                       # VA,VB,VD
+        "Resolution - iPAT//PAT mode",                # VE
+        "Resolution - Acceleration//Acceleration mode",
+    ),
+    "Resolution//Accel. factor PE": (
+        "Resolution//Accel. factor PE",               # VB,VD
+        "Resolution - iPAT//Accel. factor PE",        # VE
+        "Resolution - Acceleration//Acceleration factor PE",
+    ),
+    "Resolution//Accel. factor 3D": (
+        "Resolution//Accel. factor 3D",               # VB,VD
+        "Resolution - iPAT//Accel. factor 3D",        # VE
+        "Resolution - Acceleration//Acceleration factor 3D",
+    ),
+    # ------------------------------------------------------------------
+    #   Geometry
+    # ------------------------------------------------------------------
+    "Geometry//Slabs": (
+        "Geometry//Slabs",                            # VD
+        "Geometry - Common//Slabs",                   # VE
+    ),
+    "Geometry//Slab group 1//Slabs": (
+        "Geometry//Slab group 1//Slabs",
+        "Geometry - Common//Slabs",                   # VE
+    ),
+    "Geometry//Slices per slab": (
+        "Geometry//Slices per slab",                  # VD
+        "Geometry - Common//Slices per slab",         # VE
+    ),
+    "Geometry//Slice oversampling": (
+        "Geometry//Slice oversampling",               # VD
+        "Geometry - Common//Slice oversampling",      # VE
+    ),
+    "Geometry//Slice group 1//Slices": (
+        "Geometry//Slice group 1//Slices",
+        "Geometry - Common//Slice group 1//Slices",   # VE
+    ),
+    # ------------------------------------------------------------------
+    #   System
+    # ------------------------------------------------------------------
     "System//Sagittal": (
-        "System//Sagittal",                           # VD,VB
+        "System//Sagittal",                           # VA,VB,VD
         "System - Miscellaneous//Sagittal",           # VE
     ),
     "System//Coronal": (
-        "System//Coronal",                            # VD,VB
+        "System//Coronal",                            # VA,VB,VD
         "System - Miscellaneous//Coronal",            # VE
     ),
     "System//Transversal": (
-        "System//Transversal",                        # VD,VB
+        "System//Transversal",                        # VA,VB,VD
         "System - Miscellaneous//Transversal",        # VE
     ),
+    "System//Coil Combine Mode": (
+        "System//Coil Combine Mode",                  # VB,VD
+        "System - Miscellaneous//Coil Combine Mode",  # VE
+        "System - Miscellaneous//Coil Combination",
+    ),
+    "System//Frequency 1H": (
+        "System//Frequency 1H",                       # VD
+        "System - Tx/Rx//Frequency 1H",               # VE
+    ),
+    # ------------------------------------------------------------------
+    #   Sequence
+    # ------------------------------------------------------------------
+    "Header//SequenceName": (
+        "Header//SequenceName",                       # VA,VB,VD
+        "Sequence - Part 1//Sequence Name",           # VE
+    ),
+    "Sequence//Dimension": (
+        "Sequence//Dimension",                        # VA,VB,VD
+        "Sequence - Part 1//Dimension",               # VE
+    ),
+    "Sequence//Bandwidth": (
+        "Sequence//Bandwidth",                        # VA,VB,VD
+        "Sequence - Part 1//Bandwidth",               # VE
+    ),
+    "Sequence//Echo spacing": (
+        "Sequence//Echo spacing",                     # VA,VB,VD
+        "Sequence - Part 1//Echo spacing",            # VE
+    ),
+    "Sequence//Asymmetric echo": (
+        "Sequence//Asymmetric echo",                  # VA,VB,VD
+        "Sequence - Part 1//Asymmetric echo",         # VE
+    ),
+    "Sequence//Flow comp.": (
+        "Sequence//Flow comp.",                       # VA,VB,VD
+        "Sequence//Flow comp. 1",                     # VD
+        "Sequence - Part 1//Flow compensation",       # VE
+    ),
+    "Sequence//EPI factor": (
+        "Sequence//EPI factor",                       # VA,VB,VD
+        "Sequence//EPI Factor",
+        "Sequence - Part 1//EPI factor",              # VE
+        "Sequence - Part 1//EPI Factor",              # VE
+    ),
+    "Sequence//Turbo Factor": (
+        "Sequence//Turbo Factor",
+        "Sequence - Part 1//Turbo Factor",            # VE
+    ),
+    "Sequence//RF Spoiling": (
+        "Sequence//RF Spoiling",
+        "Sequence - Part 2//RF Spoiling",             # VE
+    ),
+    "Sequence//Reordering": (
+        "Sequence//Reordering",                       # VD
+        "Sequence - Part 1//Reordering",              # VE
+        "Contrast - Dynamic//Reordering",             # VE
+    ),
+    # ------------------------------------------------------------------
+    #   Angio
+    # ------------------------------------------------------------------
+    "Angio//TONE ramp": (
+        "Angio//TONE ramp",
+        "Angio - Common//TONE ramp",
+    ),
+    "Inline - Common//3D centric reordering": (
+        "Inline - Common//3D centric reordering",     # VE
+        "Angio//3D centric reordering",
+        "Angio - Common//3D centric reordering",
+    ),
+}
+
+
+# ----------------------------------------------------------------------
+#   Lookup tables used by the keymaps' formulas
+# ----------------------------------------------------------------------
+
+# Model name -> field strength (T)
+_FIELD_STRENGTH = {
+    "Aera": 1.5,
+    "Altea": 1.5,
+    "Amira": 1.5,
+    "Avanto": 1.5,
+    "Avanto_fit": 1.5,
+    "Cima X": 3.0,
+    "EspreeTim": 1.5,
+    "EssenzaTim": 1.5,
+    "Flow": 1.5,
+    "Harmony": 1.0,
+    "Lumina": 3.0,
+    "Mica": 1.5,
+    "Prisma": 3.0,
+    "Prisma_fit": 3.0,
+    "Seara": 3.0,
+    "Sempra": 1.5,
+    "Skyra": 3.0,
+    "Skyra_fit": 3.0,
+    "Sola": 1.5,
+    "Sola_fit": 1.5,
+    "Sonata": 1.5,
+    "Spectra": 3.0,
+    "Symphony": 1.5,
+    "Terra": 7.0,
+    "Terra X": 7.0,
+    "TrioTim": 3.0,
+    "VerioTim": 3.0,
+    "Vida": 3.0,
+    "Vida_fit": 3.0,
+}
+
+# Coil combine mode -> BIDS CoilCombinationMethod
+_COIL_COMBINATION = {
+    "Sum of Squares": "rSOS",
+    "Adaptive Combine": "adaptive",
+}
+
+# Sequence name -> PulseSequenceType (multiband EPI)
+_EPI_SEQUENCE_TYPE = {
+    "ep2d_fid": "Gradient Echo EPI",
+    "ep2d_bold": "Gradient Echo EPI",
+    "ep2d_pace": "Gradient Echo EPI",
+    "ep2d_pasl": "Gradient Echo EPI",
+    "ep2d_diff": "Spin Echo EPI",
+    "epfid": "Gradient Echo EPI",
+    "epse": "Spin Echo EPI",
+}
+
+# Sequence name -> PulseSequenceType (magnetization prepared)
+_MP_SEQUENCE_TYPE = {
+    "tfl": "MPRAGE",
+}
+
+# Sequence name -> PulseSequenceType (spoiled gradient echo)
+_GRE_SEQUENCE_TYPE = {
+    "gre": "Gradient Echo",
+    "gre_field_mapping": "Gradient Echo",
+    "fm_r": "Gradient Echo",
+    "fl": "Gradient Echo",
+    "fl_r": "Gradient Echo",
+    "fl_rr": "Gradient Echo",
+    "fl_tof": "Gradient Echo",
+    "tfl": "Gradient Echo",
+    "epfid": "Gradient Echo EPI",
+    "ep2d_fid":  "Gradient Echo EPI",
+    "ep2d_bold":  "Gradient Echo EPI",
+    "ep2d_pace":  "Gradient Echo EPI",
+}
+
+# Sequence name -> PulseSequenceType (everything else)
+_SEQUENCE_TYPE = {
+    "gre": "Gradient Echo",
+    "gre_field_mapping": "Gradient Echo",
+    "fm_r": "Gradient Echo",
+    "fl": "Gradient Echo",
+    "fl_r": "Gradient Echo",
+    "fl_rr": "Gradient Echo",
+    "fl_tof": "Gradient Echo",
+    "tfl": "Gradient Echo",
+    "epfid": "Gradient Echo EPI",
+    "ep2d_fid":  "Gradient Echo EPI",
+    "ep2d_bold":  "Gradient Echo EPI",
+    "ep2d_pace":  "Gradient Echo EPI",
+    "ep2d_pasl":  "PASL - Gradient Echo EPI",
+    "spc": "T2-SPACE",
+    "spcir": "FLAIR",
+    "spcR": "Driven Equilibrium T2-SPACE",
+    "epse": "Spin Echo EPI",
+    "ep_seg_se": "Segmented Spin Echo EPI",
+    "ep2d_diff": "Spin Echo EPI",
+    "tse": "Fast Spin Echo",
+    "tse_vfl": "Fast Spin Echo + Variable Flip",
+    "tfi": "bSSFP",
+    "swi_r": "Susceptibility Weighted Gradient Echo",
+    "tgse": "Gradient And Spin Echo",
+}
+
+# Sequence name -> ScanningSequence
+_SCANNING_SEQUENCE = {
+    "gre": ["GR"],                  # Gradient Echo
+    "gre_field_mapping": ["GR"],    # Gradient Echo Field Mapping
+    "fm_r": ["GR"],                 # Field Mapping
+    "fl": ["GR"],                   # FLASH
+    "fl_r": ["GR"],                 # FLASH
+    "fl_rr": ["GR"],                # FLASH
+    "fl_tof": ["GR"],               # FLASH Time of Flight
+    "tfl": ["GR"],                  # TurboFLASH
+    "epfid": ["GR", "EP"],          # Echo-planar GRE
+    "ep2d_fid": ["GR", "EP"],       # Echo-planar GRE
+    "ep2d_bold": ["GR", "EP"],      # Echo-planar GRE (+ BOLD card)
+    "ep2d_pace": ["GR", "EP"],      # Echo-planar GRE (+ MoCO)
+    "ep2d_pasl": ["GR", "EP"],      # Echo-planar GRE (+ PASL)
+    "spc": ["SE"],                  # SPACE
+    "spcir": ["SE", "IR"],          # SPACE Inversion Recovery
+    "spcR": ["SE"],                 # SPACE + RESTORE
+    "epse": ["SE", "EP"],           # Echo-planar Spin Echo
+    "ep2d_diff": ["SE", "EP"],      # Echo-planar Diffusion
+    "ep_seg_se": ["SE", "EP", "SK"],  # Segmented EPI Spin Echo
+    "tse": ["SE"],                  # Turbo Spin Echo
+    "tse_vfl": ["SE"],              # Turbo Spin Echo Variable Flip
+    "tfi": ["GR"],                  # TRUFI
+    "swi_r": ["GR"],                # Susceptibility Weighted
+    "tgse": ["GR", "SE"],           # Turbo Gradient Spin Echo
+
+}
+
+# Sequence name -> SequenceVariant (steady state)
+_STEADY_STATE = {
+    "tfi": ["SS"],
+}
+
+# Reordering -> RectilinearPhaseEncodeReordering
+_REORDERING = {
+    "Linear": "LINEAR",
+    "Centric": "CENTRIC",
 }
 
 
@@ -101,28 +528,24 @@ KEYMAP_BASIC = {
     #   reorganisations of the voxel layout.
     "DirectionSE": {
         "args": [
-            VARIANTS["Orientation"],
-            VARIANTS["System//Sagittal"],
-            VARIANTS["System//Coronal"],
-            VARIANTS["System//Transversal"],
+            "Routine//Orientation",
+            "System//Sagittal",
+            "System//Coronal",
+            "System//Transversal",
         ],
-        "formula": lambda x, s, c, t: {
-            "S": s[0] + s[-1],
-            "T": {"FH": "IS", "HF": "SI"}[t[0] + t[-1]],
-            "C": c[0] + c[-1],
-        }[x[0]]
+        "formula": _axis,
     },
     "DirectionPE":  {
-        "args": [VARIANTS["Phase enc. dir."]],
+        "args": ["Routine//Phase enc. dir."],
         "formula": lambda x: x[0] + x[-1],
     },
     "DirectionFE": {
         "args": [
-            VARIANTS["Phase enc. dir."],
-            VARIANTS["Orientation"],
-            VARIANTS["System//Sagittal"],
-            VARIANTS["System//Coronal"],
-            VARIANTS["System//Transversal"],
+            "Routine//Phase enc. dir.",
+            "Routine//Orientation",
+            "System//Sagittal",
+            "System//Coronal",
+            "System//Transversal",
         ],
         "formula": _guess_fe_direction
     },
@@ -142,56 +565,17 @@ KEYMAP_CLASSIC = {
     "SoftwareVersions": "Header//SoftwareVersions",
     "MagneticFieldStrength": {
         "args": ["Header//ModelName"],
-        "formula": lambda x: {
-            "Aera": 1.5,
-            "Altea": 1.5,
-            "Amira": 1.5,
-            "Avanto": 1.5,
-            "Avanto_fit": 1.5,
-            "Cima X": 3.0,
-            "EspreeTim": 1.5,
-            "EssenzaTim": 1.5,
-            "Flow": 1.5,
-            "Harmony": 1.0,
-            "Lumina": 3.0,
-            "Mica": 1.5,
-            "Prisma": 3.0,
-            "Prisma_fit": 3.0,
-            "Seara": 3.0,
-            "Sempra": 1.5,
-            "Skyra": 3.0,
-            "Skyra_fit": 3.0,
-            "Sola": 1.5,
-            "Sola_fit": 1.5,
-            "Sonata": 1.5,
-            "Spectra": 3.0,
-            "Symphony": 1.5,
-            "Terra": 7.0,
-            "Terra X": 7.0,
-            "TrioTim": 3.0,
-            "VerioTim": 3.0,
-            "Vida": 3.0,
-            "Vida_fit": 3.0,
-        }[x]
+        "formula": lambda x: _FIELD_STRENGTH[x]
     },
     # "ReceiveCoilName": None,
     "ReceiveCoilActiveElements": "Routine//Coil elements",
     # "GradientSetType": None,
     # "MRTransmitCoilSequence": None,
-    "MatrixCoilMode": (
-        # only present in VB
-        "Resolution//Matrix Coil Mode",
-    ),
+    # only present in VB
+    "MatrixCoilMode": "Resolution//Matrix Coil Mode",
     "CoilCombinationMethod": {
-        "args": [(
-            "System//Coil Combine Mode",
-            "System - Miscellaneous/Coil Combine Mode",
-            "System - Miscellaneous/Coil Combination",
-        )],
-        "formula": lambda x: {
-            "Sum of Squares": "rSOS",
-            "Adaptive Combine": "adaptive",
-        }.get(x, x)
+        "args": ["System//Coil Combine Mode"],
+        "formula": lambda x: _COIL_COMBINATION.get(x, x)
     },
 
     # ------------------------------------------------------------------
@@ -208,140 +592,45 @@ KEYMAP_CLASSIC = {
         # Multiband EPI
         {
             "args": [
-                (
-                    "Header//SequenceName",
-                    "Sequence - Part 1//Sequence Name",
-                ),
+                "Header//SequenceName",
                 "Routine//Multi-band accel. factor"
             ],
-            "formula": lambda x, mb: ("Multiband " if int(mb) > 1 else "") + {
-                "ep2d_fid": "Gradient Echo EPI",
-                "ep2d_bold": "Gradient Echo EPI",
-                "ep2d_pace": "Gradient Echo EPI",
-                "ep2d_pasl": "Gradient Echo EPI",
-                "ep2d_diff": "Spin Echo EPI",
-                "epfid": "Gradient Echo EPI",
-                "epse": "Spin Echo EPI",
-            }[x]
+            "formula": lambda x, mb:
+                ("Multiband " if int(mb) > 1 else "") + _EPI_SEQUENCE_TYPE[x]
         },
         # MPRAGE
         {
             "args": [
-                (
-                    "Header//SequenceName",
-                    "Sequence - Part 1//Sequence Name",
-                ),
-                (
-                    "Contrast//TI",
-                    "Contrast - Common//TI"
-                )
+                "Header//SequenceName",
+                "Contrast//TI"
             ],
-            "formula": lambda x, _: {
-                "tfl": "MPRAGE",
-            }[x]
+            "formula": lambda x, _: _MP_SEQUENCE_TYPE[x]
         },
         # Spoiled Gradient Echo
         {
             "args": [
-                (
-                    "Header//SequenceName",
-                    "Sequence - Part 1//Sequence Name",
-                ),
-                (
-                    "Sequence//RF Spoiling",
-                    "Sequence - Part 2//RF Spoiling"
-                )
+                "Header//SequenceName",
+                "Sequence//RF Spoiling"
             ],
-            "formula": lambda x, sp: ("Spoiled " if sp == "On" else "") + {
-                "gre": "Gradient Echo",
-                "gre_field_mapping": "Gradient Echo",
-                "fm_r": "Gradient Echo",
-                "fl": "Gradient Echo",
-                "fl_r": "Gradient Echo",
-                "fl_rr": "Gradient Echo",
-                "fl_tof": "Gradient Echo",
-                "tfl": "Gradient Echo",
-                "epfid": "Gradient Echo EPI",
-                "ep2d_fid":  "Gradient Echo EPI",
-                "ep2d_bold":  "Gradient Echo EPI",
-                "ep2d_pace":  "Gradient Echo EPI",
-            }[x]
+            "formula": lambda x, sp:
+                ("Spoiled " if sp == "On" else "") + _GRE_SEQUENCE_TYPE[x]
         },
         # Everything else
         {
-            "args": [(
-                "Header//SequenceName",
-                "Sequence - Part 1//Sequence Name",
-            )],
-            "formula": lambda x: {
-                "gre": "Gradient Echo",
-                "gre_field_mapping": "Gradient Echo",
-                "fm_r": "Gradient Echo",
-                "fl": "Gradient Echo",
-                "fl_r": "Gradient Echo",
-                "fl_rr": "Gradient Echo",
-                "fl_tof": "Gradient Echo",
-                "tfl": "Gradient Echo",
-                "epfid": "Gradient Echo EPI",
-                "ep2d_fid":  "Gradient Echo EPI",
-                "ep2d_bold":  "Gradient Echo EPI",
-                "ep2d_pace":  "Gradient Echo EPI",
-                "ep2d_pasl":  "PASL - Gradient Echo EPI",
-                "spc": "T2-SPACE",
-                "spcir": "FLAIR",
-                "spcR": "Driven Equilibrium T2-SPACE",
-                "epse": "Spin Echo EPI",
-                "ep_seg_se": "Segmented Spin Echo EPI",
-                "ep2d_diff": "Spin Echo EPI",
-                "tse": "Fast Spin Echo",
-                "tse_vfl": "Fast Spin Echo + Variable Flip",
-                "tfi": "bSSFP",
-                "swi_r": "Susceptibility Weighted Gradient Echo",
-                "tgse": "Gradient And Spin Echo",
-            }[x]
+            "args": ["Header//SequenceName"],
+            "formula": lambda x: _SEQUENCE_TYPE[x]
         },
     ],
     "ScanningSequence": [
         # Gradient Echo // Spin Echo
         {
-            "args": [(
-                "Header//SequenceName",
-                "Sequence - Part 1//Sequence Name",
-            )],
-            "formula": lambda x: {
-                "gre": ["GR"],                  # Gradient Echo
-                "gre_field_mapping": ["GR"],    # Gradient Echo Field Mapping
-                "fm_r": ["GR"],                 # Field Mapping
-                "fl": ["GR"],                   # FLASH
-                "fl_r": ["GR"],                 # FLASH
-                "fl_rr": ["GR"],                # FLASH
-                "fl_tof": ["GR"],               # FLASH Time of Flight
-                "tfl": ["GR"],                  # TurboFLASH
-                "epfid": ["GR", "EP"],          # Echo-planar GRE
-                "ep2d_fid": ["GR", "EP"],       # Echo-planar GRE
-                "ep2d_bold": ["GR", "EP"],      # Echo-planar GRE (+ BOLD card)
-                "ep2d_pace": ["GR", "EP"],      # Echo-planar GRE (+ MoCO)
-                "ep2d_pasl": ["GR", "EP"],      # Echo-planar GRE (+ PASL)
-                "spc": ["SE"],                  # SPACE
-                "spcir": ["SE", "IR"],          # SPACE Inversion Recovery
-                "spcR": ["SE"],                 # SPACE + RESTORE
-                "epse": ["SE", "EP"],           # Echo-planar Spin Echo
-                "ep2d_diff": ["SE", "EP"],      # Echo-planar Diffusion
-                "ep_seg_se": ["SE", "EP", "SK"],  # Segmented EPI Spin Echo
-                "tse": ["SE"],                  # Turbo Spin Echo
-                "tse_vfl": ["SE"],              # Turbo Spin Echo Variable Flip
-                "tfi": ["GR"],                  # TRUFI
-                "swi_r": ["GR"],                # Susceptibility Weighted
-                "tgse": ["GR", "SE"],           # Turbo Gradient Spin Echo
-            }[x],
+            "args": ["Header//SequenceName"],
+            "formula": lambda x: _SCANNING_SEQUENCE[x],
             "iadd": True,
         },
         # Inversion recovery
         {
-            "args": [(
-                "Contrast//TI",
-                "Contrast - Common//TI"
-            )],
+            "args": ["Contrast//TI"],
             "formula": lambda _: ["IR"],
             "iadd": True,
         },
@@ -350,30 +639,24 @@ KEYMAP_CLASSIC = {
         # OverSampling Phase
         {
             "args": ["Routine//Phase oversampling"],
-            "formula": lambda x: ["PO"] if float(x.split()[0]) > 0 else [],
+            "formula": lambda x: ["PO"] if x.to("%") > 0 else [],
             "iadd": True,
         },
         # Steady State
         {
             "args": ["Header//SequenceName"],
-            "formula": lambda x: {"tfi": ["SS"]}[x],
+            "formula": lambda x: _STEADY_STATE[x],
             "iadd": True,
         },
         # Magnetization Prepared
         {
-            "args": [(
-                "Contrast//TI",
-                "Contrast - Common//TI"
-            )],
+            "args": ["Contrast//TI"],
             "formula": lambda _: ["MP"],
             "iadd": True,
         },
         # RF Spoiling
         {
-            "args": [(
-                "Sequence//RF Spoiling",
-                "Sequence - Part 2//RF Spoiling"
-            )],
+            "args": ["Sequence//RF Spoiling"],
             "formula": lambda x: ["SP"] if x == "On" else [],
             "iadd": True,
         },
@@ -381,38 +664,25 @@ KEYMAP_CLASSIC = {
     "ScanOptions": [
         # Fat Saturation
         {
-            "args": [(
-                "Contrast//Fat suppr.",
-                "Contrast - Common//Fat suppr."
-            )],
+            "args": ["Contrast//Fat suppr."],
             "formula": lambda x: [] if x == "None" else ["FS"],
             "iadd": True,
         },
         # Partial Fourier - Frequency
         {
-            "args": [(
-                "Sequence//Asymmetric echo",
-                "Sequence - Part 1//Asymmetric echo",
-            )],
+            "args": ["Sequence//Asymmetric echo"],
             "formula": lambda x: ["PFF"] if x != "Off" else [],
             "iadd": True,
         },
         # Partial Fourier - Phase
         {
-            "args": [(
-                "Resolution//Phase partial Fourier",
-                "Resolution - Acceleration//Phase partial Fourier",
-            )],
+            "args": ["Resolution//Phase partial Fourier"],
             "formula": lambda x: ["PFP"] if x != "Off" else [],
             "iadd": True,
         },
         # Flow Compensation
         {
-            "args": [(
-                "Sequence//Flow comp.",
-                "Sequence//Flow comp. 1",
-                "Sequence - Part 1//Flow compensation",
-            )],
+            "args": ["Sequence//Flow comp."],
             "formula": lambda x: ["FC"] if x != "No" else [],
             "iadd": True,
 
@@ -420,19 +690,13 @@ KEYMAP_CLASSIC = {
     ],
     "SequenceName": [
         {
-            "args": [(
-                "Header//SequenceName",
-                "Sequence - Part 1//Sequence Name"
-            )],
+            "args": ["Header//SequenceName"],
             "formula": lambda x: x,
         },
     ],
     # "PulseSequenceDetails": None,
     # "NonlinearGradientCorrection": None,
-    "MRAcquisitionType": (
-        "Sequence//Dimension",
-        "Sequence - Part 1//Dimension",
-    ),
+    "MRAcquisitionType": "Sequence//Dimension",
     # ------------------------------------------------------------------
     #   MTParameters
     # ------------------------------------------------------------------
@@ -453,27 +717,15 @@ KEYMAP_CLASSIC = {
     # ------------------------------------------------------------------
     # "NumberShots": None,
     "ParallelReductionFactorInPlane": {
-        "args": [(
-            "Resolution//Accel. factor PE",
-            "Resolution - iPAT//Accel. factor PE",
-            "Resolution - Acceleration//Acceleration factor PE",
-        )],
+        "args": ["Resolution//Accel. factor PE"],
         "formula": lambda x: int(x)
     },
     "ParallelReductionFactorOurOfPlane": {
-        "args": [(
-            "Resolution//Accel. factor 3D",
-            "Resolution - iPAT//Accel. factor 3D",
-            "Resolution - Acceleration//Acceleration factor 3D",
-        )],
+        "args": ["Resolution//Accel. factor 3D"],
         "formula": lambda x: int(x)
     },
     "ParallelAcquisitionTechnique": {
-        "args": [(
-            "Resolution//PAT mode",
-            "Resolution - iPAT//PAT mode",
-            "Resolution - Acceleration//Acceleration mode",
-        )],
+        "args": ["Resolution//PAT mode"],
         "formula": lambda x: _error() if x in ("Off", "None") else x
     },
     # "PartialFourier": None,
@@ -488,30 +740,21 @@ KEYMAP_CLASSIC = {
     # ------------------------------------------------------------------
     "EchoTime": {
         "args": ["Routine//TE"],
-        "formula": lambda x: float(x.split()[0]) * 1e-3,
+        "formula": lambda x: x.to("s"),
     },
     "InversionTime": {
-        "args": [(
-            "Contrast//TI",
-            "Contrast - Common//TI",
-        )],
-        "formula": lambda x: float(x.split()[0]) * 1e-3,
+        "args": ["Contrast//TI"],
+        "formula": lambda x: x.to("s"),
     },
     # Siemens' "sequence bandwidth" parameter is always the "effective"
     # frequency-encode bandwidth (as if no oversampling was happening).
     # The dwell time is therefore 1/(bandwidth * matrix_size)
     "DwellTime": {
         "args": [
-            (
-                "Sequence//Bandwidth",
-                "Sequence - Part 1//Bandwidth",
-            ),
-            (
-                "Resolution//Base resolution",
-                "Resolution - Common//Base resolution"
-            ),
+            "Sequence//Bandwidth",
+            "Resolution//Base resolution",
         ],
-        "formula": lambda x, y: 1/(float(x.split()[0])*int(y))
+        "formula": lambda x, y: 1/(x.to("Hz/Px")*int(y))
     },
     # "SliceTiming": None,
     # "SliceEncodingDirection": raise ValueError("Done before"),
@@ -520,11 +763,8 @@ KEYMAP_CLASSIC = {
     #   MRIRFandContrast
     # ------------------------------------------------------------------
     "FlipAngle": {
-        "args": [(
-            "Contrast//Flip angle",
-            "Contrast - Common//Flip angle",
-        )],
-        "formula": lambda x: float(x.split()[0]),
+        "args": ["Contrast//Flip angle"],
+        "formula": lambda x: x.to("deg"),
     },
     # "NegativeContrast": None,
 
@@ -565,29 +805,20 @@ KEYMAP_CLASSIC = {
     # ------------------------------------------------------------------
     "AcquisitionMatrixPE": {
         "args": [
-            (
-                "Resolution//Base resolution",              # VD,VB
-                "Resolution - Common//Base resolution",     # VE
-            ),
-            (
-                "Resolution//Phase resolution",             # VD,VB
-                "Resolution - Common//Phase resolution",    # VE
-            ),
+            "Resolution//Base resolution",
+            "Resolution//Phase resolution",
             "Routine//FoV phase",
         ],
         "formula": lambda base, ph, fov:
             int(round(
                 int(base) *
-                (float(ph.split()[0]) / 100) *
-                (float(fov.split()[0]) / 100)
+                ph.to("") *
+                fov.to("")
             ))
     },
     "VendorReportedEchoSpacing": {
-        "args": [(
-            "Sequence//Echo spacing",
-            "Sequence - Part 1//Echo spacing"
-        )],
-        "formula": lambda x: float(x.split()[0]) * 1e-3
+        "args": ["Sequence//Echo spacing"],
+        "formula": lambda x: x.to("s")
     },
     # "EchoNumber": None,
     # "EstimatedEffectiveEchoSpacing": raise ValueError("Done in special"),
@@ -595,11 +826,8 @@ KEYMAP_CLASSIC = {
     # "VariableFlipAngleFlag": None,
     # "ImageOrientationPatientDICOM": None,
     "ImagingFrequency": {
-        "args": [(
-            "System//Frequency 1H",
-            "System - Tx/Rx//Frequency 1H",
-        )],
-        "formula": lambda x: float(x.split()[0])
+        "args": ["System//Frequency 1H"],
+        "formula": lambda x: x.to("MHz")
     },
     # "InPlanePhaseEncodingDirectionDICOM": None,
     "NumberOfAverages": {
@@ -608,7 +836,7 @@ KEYMAP_CLASSIC = {
     },
     "PercentPhaseFOV": {
         "args": ["Routine//FoV Phase"],
-        "formula": lambda x: float(x.split()[0])
+        "formula": lambda x: x.to("%")
     },
     # "PercentSampling": None,
     "FrequencyEncodingSteps": {
@@ -625,17 +853,14 @@ KEYMAP_CLASSIC = {
     },
     # This is the bandwidth/pixel along the frequency-encoding direction
     "PixelBandwidth": {
-        "args": [(
-            "Sequence//Bandwidth",
-            "Sequence - Part 1//Bandwidth",
-        )],
-        "formula": lambda x: float(x.split()[0])
+        "args": ["Sequence//Bandwidth"],
+        "formula": lambda x: x.to("Hz/Px")
     },
     # "RepetitionTimeInversion": None,
     # "SAR": None,
     "SliceThickness": {
         "args": ["Routine//Slice thickness"],
-        "formula": lambda x: float(x.split()[0]),
+        "formula": lambda x: x.to("mm"),
     },
     "SpacingBetweenSlices": [
         {
@@ -644,11 +869,11 @@ KEYMAP_CLASSIC = {
                 "Routine//Slice group 1//Dist. factor"
             ],
             "formula": lambda x, y:
-                float(x.split()[0]) * (1 + float(y.split()[0]) / 100),
+                x.to("mm") * (1 + y.to("")),
         },
         {
             "args": ["Routine//Slice thickness"],
-            "formula": lambda x: float(x.split()[0]),
+            "formula": lambda x: x.to("mm"),
         },
     ],
 
@@ -688,10 +913,7 @@ KEYMAP_CLASSIC = {
     # "VelocityEncodingDirection": None,
     "TimeOfFlightContrast": [
         {
-            "args": [(
-                "Angio//TONE ramp",
-                "Angio - Common//TONE ramp",
-            )],
+            "args": ["Angio//TONE ramp"],
             "formula": lambda _: True,
         },
         {
@@ -717,9 +939,9 @@ KEYMAP_CLASSIC = {
     "OversamplingPhase": {
         "args": ["Routine//Slice oversampling", "Routine//Phase oversampling"],
         "formula": lambda sl, ph: (
-            "2D_3D" if float(ph.split()[0]) and float(sl.split()[0]) else
-            "2D" if float(ph.split()[0]) else
-            "3D" if float(sl.split()[0]) else
+            "2D_3D" if ph.to("%") and sl.to("%") else
+            "2D" if ph.to("%") else
+            "3D" if sl.to("%") else
             "NONE"
         )
     },
@@ -734,22 +956,11 @@ KEYMAP_CLASSIC = {
     # "SegmentedKSpaceTraversal": None,
     "RectilinearPhaseEncodeReordering": [
         {
-            "args": [(
-                "Sequence//Reordering",
-                "Sequence - Part 1//Reordering",
-                "Contrast - Dynamic//Reordering",
-            )],
-            "formula": lambda x: {
-                "Linear": "LINEAR",
-                "Centric": "CENTRIC"
-            }[x]
+            "args": ["Sequence//Reordering"],
+            "formula": lambda x: _REORDERING[x]
         },
         {
-            "args": [(
-                "Inline - Common//3D centric reordering",
-                "Angio//3D centric reordering",
-                "Angio - Common//3D centric reordering",
-            )],
+            "args": ["Inline - Common//3D centric reordering"],
             "formula": lambda x: "CENTRIC" if x != "Off" else "LINEAR"
         },
     ],
@@ -766,7 +977,7 @@ KEYMAP_CLASSIC = {
                 "Routine//Slice group 1//Dist. factor"
             ],
             "formula": lambda x, y:
-                float(x.split()[0]) * float(y.split()[0]) / 100,
+                x.to("mm") * y.to("%") / 100,
         },
         {
             "args": [],
@@ -778,7 +989,7 @@ KEYMAP_CLASSIC = {
     # ------------------------------------------------------------------
     "VendorReportedRepetitionTime": {
         "args": ["Routine//TR"],
-        "formula": lambda x: float(x.split()[0]) * 1e-3,
+        "formula": lambda x: x.to("s"),
     },
     "SliceOrder": "Geometry//Series",
     # ------------------------------------------------------------------
@@ -880,9 +1091,9 @@ KEYMAP_CLASSIC = {
         "formula": lambda base, ph, fov, po:
             int(round(
                 int(base) *
-                (float(ph.split()[0]) / 100) *
-                (float(fov.split()[0]) / 100) *
-                (1 + (float(po.split()[0]) / 100))
+                ph.to("") *
+                fov.to("") *
+                (1 + po.to(""))
             ))
     },
     "OversampledAcquisitionMatrixSE": [
@@ -898,7 +1109,7 @@ KEYMAP_CLASSIC = {
                 "Routine//Slice oversampling",
             ],
             "formula": lambda slabs, slices, os: int(round(
-                int(slabs) * int(slices) * (1 + float(os.split()[0]) / 100)
+                int(slabs) * int(slices) * (1 + os.to(""))
             ))
         },
         {
@@ -908,45 +1119,27 @@ KEYMAP_CLASSIC = {
                 "Routine//Slice oversampling",
             ],
             "formula": lambda slabs, slices, os: int(round(
-                int(slabs) * int(slices) * (1 + float(os.split()[0]) / 100)
+                int(slabs) * int(slices) * (1 + os.to(""))
             ))
         },
         {
             "args": [
-                (
-                    "Geometry//Slabs",
-                    "Geometry - Common//Slabs"
-                ),
-                (
-                    "Geometry//Slices per slab",
-                    "Geometry - Common//Slices per slab"
-                ),
-                (
-                    "Geometry//Slice oversampling",
-                    "Geometry - Common//Slice oversampling"
-                ),
+                "Geometry//Slabs",
+                "Geometry//Slices per slab",
+                "Geometry//Slice oversampling",
             ],
             "formula": lambda slabs, slices, os: int(round(
-                int(slabs) * int(slices) * (1 + float(os.split()[0]) / 100)
+                int(slabs) * int(slices) * (1 + os.to(""))
             ))
         },
         {
             "args": [
-                (
-                    "Geometry//Slab group 1//Slabs",
-                    "Geometry - Common//Slabs"
-                ),
-                (
-                    "Geometry//Slices per slab",
-                    "Geometry - Common//Slices per slab"
-                ),
-                (
-                    "Geometry//Slice oversampling",
-                    "Geometry - Common//Slice oversampling"
-                ),
+                "Geometry//Slab group 1//Slabs",
+                "Geometry//Slices per slab",
+                "Geometry//Slice oversampling",
             ],
             "formula": lambda slabs, slices, os: int(round(
-                int(slabs) * int(slices) * (1 + float(os.split()[0]) / 100)
+                int(slabs) * int(slices) * (1 + os.to(""))
             ))
         },
         # --------------------------------------------------------------
@@ -957,10 +1150,7 @@ KEYMAP_CLASSIC = {
             "formula": int,
         },
         {
-            "args": [(
-                "Geometry//Slice group 1//Slices",
-                "Geometry - Common//Slice group 1//Slices",
-            )],
+            "args": ["Geometry//Slice group 1//Slices"],
             "formula": int,
         },
         {
@@ -977,11 +1167,11 @@ KEYMAP_CLASSIC = {
     # ------------------------------------------------------------------
     "FieldOfViewFE": {
         "args": ["Routine//FoV read"],
-        "formula": lambda x: float(x.split()[0])
+        "formula": lambda x: x.to("mm")
     },
     "FieldOfViewPE": {
         "args": ["Routine//FoV read", "Routine//FoV phase"],
-        "formula": lambda x, y: float(x.split()[0]) * float(y.split()[0]) / 100
+        "formula": lambda x, y: x.to("mm") * y.to("%") / 100
     },
     "FieldOfViewSE": {
         "args": ["AcquisitionMatrixSE", "SpacingBetweenSlices"],
@@ -1026,7 +1216,7 @@ KEYMAP_SPECIAL["*ep*"] = {
             "formula": lambda es, np, ap, op:
                 1/(
                     es * (np/ap) *
-                    (1 + float(op.split()[0])/100)
+                    (1 + op.to(""))
                 )
         },
         # If parallel imaging unused, ParallelReductionFactorInPlane can
@@ -1040,7 +1230,7 @@ KEYMAP_SPECIAL["*ep*"] = {
             "formula": lambda es, np, op:
                 1/(
                     es * np *
-                    (1 + float(op.split()[0])/100)
+                    (1 + op.to(""))
                 )
         },
     ],
@@ -1066,12 +1256,7 @@ KEYMAP_SPECIAL["*ep*"] = {
     # "cannot be freely set, depends on base and phase resolution",
     # which seems to confirm that it ignores acceleration.
     "EchoTrainLength": {
-        "args": [(
-            "Sequence//EPI factor",
-            "Sequence//EPI Factor",
-            "Sequence - Part 1//EPI factor",
-            "Sequence - Part 1//EPI Factor",
-        )],
+        "args": ["Sequence//EPI factor"],
         "formula": int,
     },
     # See comment on ETL above. Only acquisition matrix is needed to
@@ -1079,12 +1264,7 @@ KEYMAP_SPECIAL["*ep*"] = {
     "NumberShots": {
         "args": [
             "AcquisitionMatrixPE",
-            (
-                "Sequence//EPI factor",
-                "Sequence//EPI Factor",
-                "Sequence - Part 1//EPI factor",
-                "Sequence - Part 1//EPI Factor",
-            ),
+            "Sequence//EPI factor",
         ],
         "formula": lambda x, y: ceil(x / int(y))
     },
@@ -1095,66 +1275,100 @@ for key in ("tse*", "spc*"):
         "RepetitionTimePreparation": "VendorReportedRepetitionTime",
         "RepetitionTimeInversion": "VendorReportedRepetitionTime",
         "EchoTrainLength": {
-            "args": [(
-                "Sequence//Turbo Factor",
-                "Sequence - Part 1//Turbo Factor",
-            )]
+            "args": ["Sequence//Turbo Factor"]
         },
     }
 
 
+def _identity(x):
+    # raw strings, rather than quantities, go into the sidecars
+    return str(x) if isinstance(x, Quantity) else x
+
+
+def _is_sidecar_key(item):
+    # Protocol paths always have several levels ("Card//Key"), whereas
+    # mappers refer to sidecar keys computed earlier by their name.
+    return "//" not in item
+
+
+def _compile_variants(items):
+    """
+    Resolve the variants of a mapper argument into `(key, is_sidecar_key)`
+    pairs.
+    """
+    if not isinstance(items, tuple):
+        items = (items,)
+    return tuple((item, _is_sidecar_key(item)) for item in items)
+
+
+def _fetch(bids, index, variants):
+    """
+    Value of the first variant found in the sidecar or in the (indexed)
+    protocol, or `_MISSING`.
+    """
+    # There can be multiple variants for each protocol key.
+    # We try each variant sequentially until one works.
+    for item, is_sidecar_key in variants:
+        value = (bids if is_sidecar_key else index).get(item, _MISSING)
+        if value is not _MISSING:
+            return value
+    return _MISSING
+
+
 def _make_mapper(mapper):
+    """
+    Compile a mapper.
+
+    Returns
+    -------
+    requires : tuple[tuple[str]]
+        Sidecar keys that must be set for the mapper to apply
+        (at least one key of each tuple).
+    func : callable(bids, key, index) -> bool
+        Function that sets the key, and returns whether it is
+        incremental (`iadd`), or `_MISSING` if an input was not found.
+        None if the mapper can never apply.
+    """
     if callable(mapper):
-        # must be callable(bids, key, prot) -> bool
-        return mapper
+        # must be callable(bids, key, index) -> bool
+        # (`index` is the protocol indexed by `_index_protocol`)
+        return (), mapper
 
     if not isinstance(mapper, dict):
         # Direct mapping from protocol key to bids key
-        mapper = {"args": [mapper], "formula": lambda x: x}
-
-    def func(bids, key, prot):
-        inp_args = mapper.get("args", [])
-        inp_kwargs = mapper.get("kwargs", {})
-        iadd = mapper.get('iadd', False)
-        formula = mapper["formula"]
-        # collect positional arguments
-        args = []
+        mapper = {"args": [mapper], "formula": _identity}
+
+    if "formula" not in mapper:
+        # Incomplete mapper, that can never be applied
+        return (), None
+
+    inp_args = tuple(map(_compile_variants, mapper.get("args", [])))
+    inp_kwargs = tuple(
+        (key, _compile_variants(items))
+        for key, items in mapper.get("kwargs", {}).items()
+    )
+    iadd = mapper.get("iadd", False)
+    formula = mapper["formula"]
+
+    requires = tuple(
+        tuple(item for item, _ in items)
+        for items in inp_args + tuple(items for _, items in inp_kwargs)
+        if all(is_sidecar_key for _, is_sidecar_key in items)
+    )
+
+    def func(bids, key, index):
+        # collect arguments, and give up as soon as one is missing
+        args, kwargs = [], {}
         for items in inp_args:
-            if not isinstance(items, tuple):
-                items = (items,)
-            # There can be multiple variants for each protocol key.
-            # We try each variant sequentially until one works.
-            exceptions = []
-            for item in items:
-                try:
-                    if item in bids:
-                        args.append(bids[item])
-                    else:
-                        args.append(_get(prot, item))
-                    break
-                except Exception as e:
-                    exceptions.append(e)
-            if len(exceptions) == len(items):
-                raise exceptions
-        # collect keyword arguments
-        kwargs = {}
-        for key, item in inp_kwargs.items():
-            if not isinstance(items, tuple):
-                items = (items,)
-            # There can be multiple variants for each protocol key.
-            # We try each variant sequentially until one works.
-            exceptions = []
-            for item in items:
-                try:
-                    if item in bids:
-                        kwargs[key] = bids[item]
-                    else:
-                        kwargs[key] = _get(prot, item)
-                    break
-                except Exception as e:
-                    exceptions.append(e)
-            if len(exceptions) == len(items):
-                raise exceptions
+            value = _fetch(bids, index, items)
+            if value is _MISSING:
+                return _MISSING
+            args.append(value)
+        for name, items in inp_kwargs:
+            value = _fetch(bids, index, items)
+            if value is _MISSING:
+                return _MISSING
+            kwargs[name] = value
         # call formula
         if iadd:
             bids.setdefault(key, [])
@@ -1163,26 +1377,132 @@ def _make_mapper(mapper):
             bids[key] = formula(*args, **kwargs)
         return iadd
 
-    return func
+    return requires, func
+
 
+def _sort_keys(dependencies):
+    """
+    Sort the keys of a keymap so that each key comes after the keys it
+    depends on. Keys are otherwise kept in their original order: a key
+    is only moved when it depends on a key listed after it, and then
+    comes right after its last dependency.
+
+    Parameters
+    ----------
+    dependencies : dict[str, set[str]]
+        Keys of the same keymap that each key depends on
+
+    Returns
+    -------
+    keys : list[str]
+
+    Raises
+    ------
+    ValueError
+        If keys depend on each other
+    """
+    order, done, pending = [], set(), list(dependencies)
+    while pending:
+        # first key (in keymap order) whose dependencies are all done
+        for i, key in enumerate(pending):
+            if dependencies[key] <= done:
+                break
+        else:
+            # all remaining keys wait on another one: follow them
+            cycle = [pending[0]]
+            while True:
+                key = min(dependencies[cycle[-1]] - done, key=pending.index)
+                if key in cycle:
+                    cycle = cycle[cycle.index(key):] + [key]
+                    raise ValueError(
+                        "Cycle in keymap: " + " -> ".join(cycle)
+                    )
+                cycle.append(key)
+        del pending[i]
+        done.add(key)
+        order.append(key)
+    return order
 
-def _siemens_to_bids(bids, prot, keymap):
+
+def _compile_keymap(keymap):
+    """
+    Compile a keymap into a plan: a tuple of `(key, mappers)` pairs,
+    where each mapper is a `(requires, func)` pair (see `_make_mapper`).
+
+    Keys are sorted so that keys computed from other keys of the
+    keymap come after them. Keys from other keymaps (or set from the
+    NIfTI header) must have been set before the plan is run.
+    """
+    compiled, dependencies = {}, {}
     for key, mappers in keymap.items():
+        if not isinstance(mappers, list):
+            mappers = [mappers]
+        mappers = [_make_mapper(mapper) for mapper in mappers]
+        compiled[key] = tuple(
+            (requires, func) for requires, func in mappers if func
+        )
+        dependencies[key] = {
+            dep for requires, _ in mappers for items in requires
+            for dep in items if dep in keymap and dep != key
+        }
+    return tuple(
+        (key, compiled[key]) for key in _sort_keys(dependencies)
+        if compiled[key]
+    )
+
+
+# The keymaps are compiled once, when this module is imported.
+# Changes made to KEYMAP_* afterwards are not taken into account.
+_PLAN_BASIC = _compile_keymap(KEYMAP_BASIC)
+_PLAN_CLASSIC = _compile_keymap(KEYMAP_CLASSIC)
+_PLAN_SPECIAL = tuple(
+    (re.compile(fnmatch.translate(pattern)).match, _compile_keymap(keymap))
+    for pattern, keymap in KEYMAP_SPECIAL.items()
+)
+
+# Fields compared with the NIfTI headers, to find the file of each
+# protocol (see `_match_nii`)
+_PLAN_MATCH = _compile_keymap({
+    key: KEYMAP_CLASSIC[key]
+    for key in (
+        "AcquisitionMatrixFE", "AcquisitionMatrixPE", "AcquisitionMatrixSE"
+    )
+})
+
+
+@lru_cache(maxsize=1024)
+def _special_plan(seqname):
+    """
+    Plans of all the KEYMAP_SPECIAL patterns that match a sequence name,
+    merged in order. Each sequence name is only matched once.
+    """
+    return tuple(
+        step
+        for match, plan in _PLAN_SPECIAL if match(seqname)
+        for step in plan
+    )
+
+
+def _siemens_to_bids(bids, index, plan):
+    for key, mappers in plan:
         # There can be multiple mappers for a given keys
         # - if mappers implement `iadd=True`, the key contains a list
         #   that gets sequentially populated by each mapper;
         # - else, mappers are tried sequentially until one works.
-        if not isinstance(mappers, list):
-            mappers = [mappers]
-        for mapper in mappers:
+        for requires, mapper in mappers:
+            # Skip mappers whose input keys could not be computed
+            if requires and not all(
+                any(k in bids for k in ks) for ks in requires
+            ):
+                continue
             try:
-                if not callable(mapper):
-                    mapper = _make_mapper(mapper)
-                iadd = mapper(bids, key, prot)
-                if not iadd:
-                    break
+                iadd = mapper(bids, key, index)
             except Exception:
                 continue
+            if iadd is _MISSING:
+                continue
+            if not iadd:
+                break
     return bids
 
 
@@ -1191,10 +1511,11 @@ def siemens_to_bids(prot, **kwargs):
     Convert a parsed SIEMENS protocol into a BIDS sidecar
     """
     bids = {}
+    index = _resolve_aliases(_index_protocol(prot))
     vox2anat, anat2vox, shape = nii2axes(**kwargs)
 
     # Basic fields
-    _siemens_to_bids(bids, prot, KEYMAP_BASIC)
+    _siemens_to_bids(bids, index, _PLAN_BASIC)
     # Set fields based on nifti header
     if anat2vox is not None:
         if "DirectionFE" in bids:
@@ -1220,13 +1541,11 @@ def siemens_to_bids(prot, **kwargs):
             }[bids["SliceEncodingDirection"][0]]
 
     # Common fields
-    _siemens_to_bids(bids, prot, KEYMAP_CLASSIC)
+    _siemens_to_bids(bids, index, _PLAN_CLASSIC)
 
     # Guess recon matrix if file not available
     if anat2vox is None:
-        itrp = _get(prot, "Resolution//Interpolation", None)
-        if itrp is None:
-            itrp = _get(prot, "Resolution - Common//Interpolation", None)
+        itrp = index.get("Resolution//Interpolation")
         try:
             bids["ReconMatrixFE"] = bids["AcqusitionMatrixFE"]
             if itrp == "On":
@@ -1247,7 +1566,76 @@ def siemens_to_bids(prot, **kwargs):
     # Known sequences
     seqname = bids.get("SequenceName", None)
     if seqname:
-        for seqpattern, keymap in KEYMAP_SPECIAL.items():
-            if fnmatch.filter([seqname], seqpattern):
-                _siemens_to_bids(bids, prot, keymap)
+        _siemens_to_bids(bids, index, _special_plan(seqname))
     return bids
+
+
+def _match_nii(prots, nii):
+    """
+    Reorder a pool of NIfTI files (`nii2axes` keywords) so that they
+    are paired with the protocols that they best match (`{}` for
+    protocols without a file)
+    """
+    voxel_sizes, matrices = [], []
+    for prot in prots:
+        bids = {}
+        index = _resolve_aliases(_index_protocol(prot))
+        _siemens_to_bids(bids, index, _PLAN_MATCH)
+        voxel_size = prot["Header"].get("Voxel size", [np.nan] * 3)
+        voxel_sizes.append(voxel_size)
+        matrices.append([
+            bids.get(key, np.nan) for key in (
+                "AcquisitionMatrixFE",
+                "AcquisitionMatrixPE",
+                "AcquisitionMatrixSE",
+            )
+        ])
+    match = match_nii(voxel_sizes, matrices, nii)
+    return [nii[i] if i >= 0 else {} for i in match.tolist()]
+
+
+def iter_siemens_sidecars(prots, nii=None, base=None):
+    """
+    Convert a stream of parsed SIEMENS protocols into BIDS sidecars
+
+    Parameters
+    ----------
+    prots : iterable[dict]
+        Parsed protocols
+    nii : [list of] str | dict, optional
+        Nifti file (or `nii2axes` keywords) of each protocol.
+        If a `NiiPool`, the file of each protocol is found by comparing
+        the protocols with the NIfTI headers (all protocols are then
+        parsed before the first sidecar is returned).
+    base : dict, optional
+        Fields shared by all sidecars.
+        By default, built from the header of the first protocol.
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    if isinstance(nii, str):
+        nii = [nii]
+    match = isinstance(nii, NiiPool)
+    nii = [dict(file=x) if isinstance(x, str) else x for x in (nii or [])]
+    if match and nii:
+        prots = list(prots)
+        nii = _match_nii(prots, nii)
+
+    prot = None
+    for i, prot in enumerate(prots):
+        if base is None:
+            base = {
+                "Manufacturer": "Siemens",
+                "ManufacturersModelName": prot["Header"]["ModelName"],
+                "SoftwareVersions": prot["Header"]["SoftwareVersions"],
+            }
+        info = nii[i] if i < len(nii) else {}
+        yield prot["Header"]["path"], {**base, **siemens_to_bids(prot, **info)}
+
+    if prot is None:
+        raise ValueError("No protocol found in printout")
@@ -1,25 +1,1079 @@
-import itertools
+import fnmatch
+import re
+import numpy as np
+import pymupdf
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from typing import Callable, Iterable, Iterator
+
+LOGGER = getLogger(__name__)
 
 
 class peekable:
-    """A wrapper around iterators to make the peekable"""
+    """
+    A wrapper around iterators to make them peekable.
+
+    Peeked and prepended values are kept in a lookahead buffer, so that
+    `peek`, `next` and `prepend` run in constant time no matter how
+    many times they have been called.
+    """
 
     def __init__(self, iterator):
-        self._iterator = iterator
+        self._iterator = iter(iterator)
+        self._head = deque()    # values peeked at or prepended
+        self._tail = deque()    # values appended
 
-    def peek(self):
-        value = next(self._iterator)
-        self._iterator = itertools.chain([value], self._iterator)
-        return value
+    def _pull(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            if not self._tail:
+                raise
+            return self._tail.popleft()
+
+    def peek(self, n: int = 0):
+        """
+        Return the `n`-th upcoming value (0 = next) without consuming it.
+        Raises `StopIteration` if fewer than `n+1` values remain.
+        """
+        while len(self._head) <= n:
+            self._head.append(self._pull())
+        return self._head[n]
 
     def next(self):
-        return next(self._iterator)
+        if self._head:
+            return self._head.popleft()
+        return self._pull()
 
     def prepend(self, value):
-        self._iterator = itertools.chain([value], self._iterator)
+        self._head.appendleft(value)
 
     def append(self, value):
-        self._iterator = itertools.chain(self._iterator, [value])
+        self._tail.append(value)
+
+    def __next__(self):
+        return self.next()
 
     def __iter__(self):
-        yield from self._iterator
+        return self
+
+
+def _is_page_furniture(text: str) -> bool:
+    """
+    Whether a line of text is a page header/footer
+    """
+    return (
+        not text or
+        text.startswith(('SIEMENS MAGNETOM', 'Page ')) or
+        re.fullmatch(r'- \d+ -|\d+/-', text) is not None
+    )
+
+
+def _block_text(block: dict) -> str:
+    """
+    Text of a block of a page dictionary, one line per line of text
+    (same as the blocks returned by `page.get_text('blocks')`)
+    """
+    if block['type'] != 0:
+        # Image block
+        return '<image>'
+    return ''.join(
+        ''.join(span['text'] for span in line['spans']) + '\n'
+        for line in block['lines']
+    )
+
+
+def _index_from_links(
+    doc: pymupdf.Document
+) -> tuple[list[tuple[str, int]], list[int]]:
+    """
+    Read the start page of each protocol from the links of the
+    table of contents (VE/XA printouts).
+
+    Each entry in the table of contents is a line of text whose
+    indentation encodes its depth in the protocol tree. Entries that
+    are protocols link to the page where the protocol starts.
+
+    Returns
+    -------
+    starts : list[(str, int)]
+        Path and start page of each protocol
+    toc_pages : list[int]
+        Pages that belong to a table of contents
+    """
+    toc_pages = set()
+    for page in doc:
+        links = page.get_links()
+        if any(link['kind'] == pymupdf.LINK_GOTO for link in links):
+            toc_pages.add(page.number)
+
+    starts = []
+    stack: list[tuple[float, str]] = []     # (indent, name) of parents
+    for number in sorted(toc_pages):
+        page = doc[number]
+        links = [
+            link for link in page.get_links()
+            if link['kind'] == pymupdf.LINK_GOTO
+            and link['page'] not in toc_pages
+        ]
+
+        # Group words into entries (one entry per row)
+        rows: list[list[tuple[float, str, pymupdf.Rect]]] = []
+        y = None
+        for *bbox, word, _, _, _ in sorted(
+            page.get_text('words'), key=lambda x: (x[3], x[0])
+        ):
+            bbox = pymupdf.Rect(bbox)
+            if y is None or abs(bbox.y1 - y) > 2:
+                rows.append([])
+            rows[-1].append((bbox.x0, word, bbox))
+            y = bbox.y1
+
+        for words in rows:
+            words = sorted(words, key=lambda x: x[0])
+            text = ' '.join(word for _, word, _ in words)
+            if text == 'Table of contents':
+                stack = []
+                continue
+            if _is_page_furniture(text):
+                continue
+            if words[-1][1] == '*':
+                # XA marks some entries with a trailing star
+                words = words[:-1]
+                text = ' '.join(word for _, word, _ in words)
+            indent = words[0][0]
+            while stack and stack[-1][0] >= indent - 1:
+                stack.pop()
+            stack.append((indent, text))
+            # Find the link that sits on this entry
+            box = words[0][2]
+            center = (box.y0 + box.y1) / 2
+            targets = [
+                (abs((link['from'].y0 + link['from'].y1) / 2 - center), link)
+                for link in links
+                if link['from'].x0 < box.x1 and link['from'].x1 > box.x0
+            ]
+            if targets:
+                dist, link = min(targets, key=lambda x: x[0])
+                if dist < box.height / 2:
+                    path = '\\'.join(name for _, name in stack)
+                    starts.append((path, link['page']))
+    return starts, sorted(toc_pages)
+
+
+def _index_from_scan(
+    doc: pymupdf.Document
+) -> tuple[list[tuple[str, int, bool]], list[int]]:
+    """
+    Find the start page of each protocol by looking for path lines
+    (VA/VB/VD printouts, whose table of contents has no page numbers).
+
+    Returns
+    -------
+    starts : list[(str, int, bool)]
+        Path, start page, and whether the protocol starts below other
+        content on its start page.
+    toc_pages : list[int]
+        Pages that belong to a table of contents
+    """
+    starts = []
+    toc_pages = []
+    for page in doc:
+        blocks = [
+            (block['bbox'][1], _block_text(block))
+            for block in page_dict(page)['blocks']
+        ]
+        text = ''.join(block[1] for block in blocks)
+        if 'Table of contents' in text or (
+            # The table of contents continues until the next protocol
+            toc_pages and toc_pages[-1] == page.number - 1 and
+            'TA:' not in text and 'Scan Time' not in text
+        ):
+            toc_pages.append(page.number)
+            continue
+        for block in blocks:
+            if not block[1].startswith('\\\\'):
+                continue
+            path = []
+            for line in block[1].splitlines():
+                if line.startswith(('TA:', 'Scan Time', '+ Scan Time')):
+                    break
+                path.append(line.strip())
+            midpage = any(
+                not _is_page_furniture(other[1].strip())
+                for other in blocks if other[0] < block[0] - 1
+            )
+            starts.append((' '.join(path), page.number, midpage))
+    return starts, toc_pages
+
+
+def protocol_index(doc: pymupdf.Document) -> list[tuple[str, range]]:
+    """
+    Build an index that maps each protocol to the pages it spans.
+
+    If the table of contents links to the protocols (VE/XA printouts),
+    only the table of contents is read. Otherwise, the start of each
+    protocol is found by a light scan of the text blocks of each page.
+
+    Parameters
+    ----------
+    doc : pymupdf.Document
+        Protocol printout
+
+    Returns
+    -------
+    index : list[(str, range)]
+        Path and page range of each protocol, in the order of the
+        table of contents. A path can appear several times.
+    """
+    starts, toc_pages = _index_from_links(doc)
+    if starts:
+        # Protocols always start on a new page
+        starts = [(path, start, False) for path, start in starts]
+    else:
+        starts, toc_pages = _index_from_scan(doc)
+
+    # Protocols end where the next protocol (or table of contents) starts
+    bounds = sorted(
+        {(start, midpage) for _, start, midpage in starts} |
+        {(page, False) for page in toc_pages} |
+        {(len(doc), False)}
+    )
+    index = []
+    for path, start, midpage in starts:
+        for stop, stop_midpage in bounds:
+            if (stop, stop_midpage) > (start, midpage):
+                break
+        if stop_midpage:
+            # The next protocol starts halfway through that page
+            stop += 1
+        index.append((path, range(start, max(stop, start + 1))))
+    return index
+
+
+def match_protocol(
+    path: str,
+    protocols: str | Iterable[str] | None = None,
+) -> bool:
+    """
+    Whether a protocol path matches any of the glob patterns
+    (always true if no pattern is provided)
+    """
+    if protocols is None:
+        return True
+    if isinstance(protocols, str):
+        protocols = [protocols]
+    return any(fnmatch.fnmatch(path, pattern) for pattern in protocols)
+
+
+def select_pages(
+    doc: Iterable[pymupdf.Page],
+    skip_pages: int | Iterable[int] | None = None,
+    protocols: str | Iterable[str] | None = None,
+) -> list[pymupdf.Page] | Iterable[pymupdf.Page]:
+    """
+    Select the pages of a document that must be parsed.
+
+    Parameters
+    ----------
+    doc : iterable[pymupdf.Page]
+        Pages (or document)
+    skip_pages : int | iterable[int], optional
+        Indices of pages to skip
+    protocols : str | iterable[str], optional
+        Glob patterns of protocol paths to keep.
+        Only the pages that contain these protocols are kept.
+
+    Returns
+    -------
+    pages : list[pymupdf.Page] | iterable[pymupdf.Page]
+        Remaining pages (`doc` itself if nothing is skipped)
+    """
+    if skip_pages is None and protocols is None:
+        return doc
+    if isinstance(skip_pages, int):
+        skip_pages = [skip_pages]
+    skip_pages = set(skip_pages or [])
+    pages = [page for i, page in enumerate(doc) if i not in skip_pages]
+    if protocols is not None:
+        keep = set()
+        for path, span in protocol_index(doc):
+            if match_protocol(path, protocols):
+                keep.update(span)
+        pages = [page for page in pages if page.number in keep]
+    return pages
+
+
+# Text dictionaries of the pages that a sniffer or a pre-pass extracted,
+# and that the main pass of a parse has not read yet: for each document
+# (by id), the document and its pages, indexed by `_cache_key`. The main
+# pass drops each page but the first once it has read it (see `_pop`).
+# Pages are never dropped to make room for other pages, so a pre-pass
+# over a whole document does not extract it twice; the oldest documents
+# are dropped instead, beyond `_MAX_DOCUMENTS`. Each entry holds its
+# document, so that the id of the document is not reused while the
+# entry lives.
+_PAGE_DICTS: dict[int, tuple[pymupdf.Document, dict[tuple, dict]]] = {}
+_MAX_DOCUMENTS = 2
+
+
+def _doc_pages(doc: pymupdf.Document) -> dict[tuple, dict]:
+    """
+    Cached pages of a document, and drop the oldest documents
+    """
+    entry = _PAGE_DICTS.get(id(doc))
+    if entry is None:
+        entry = _PAGE_DICTS[id(doc)] = (doc, {})
+        while len(_PAGE_DICTS) > _MAX_DOCUMENTS:
+            del _PAGE_DICTS[next(iter(_PAGE_DICTS))]
+    return entry[1]
+
+
+def _sort_blocks(pagedict: dict) -> dict:
+    """
+    Sort blocks in reading order, as `TextPage.extractDICT(sort=True)`
+    does, without modifying the cached dictionary.
+    """
+    blocks = sorted(
+        pagedict['blocks'], key=lambda b: (b['bbox'][3], b['bbox'][0])
+    )
+    return {**pagedict, 'blocks': blocks}
+
+
+# Text extraction flags: text only (images and vector graphics are not
+# collected)
+TEXT_FLAGS = 0
+
+
+def _cache_key(
+    pages: dict[tuple, dict],
+    page: pymupdf.Page,
+    clip: tuple | None,
+) -> tuple:
+    """
+    Key of the text dictionary of a page in the cached pages of its
+    document: its number if it is (or must be) extracted in full, else
+    its number and clip rectangle
+    """
+    key = (page.number,)
+    if clip is None or key in pages:
+        return key
+    return key + (tuple(clip),)
+
+
+def _pop(page: pymupdf.Page, clip: tuple | None) -> dict | None:
+    """
+    Take the text dictionary of a page out of the cache (None if it is
+    not cached), and drop its document once it has no pages left.
+
+    The first page is left in the cache: every sniffer and pre-pass
+    reads it, so parsers tried after one that failed do not extract
+    it again.
+    """
+    entry = _PAGE_DICTS.get(id(page.parent))
+    if entry is None:
+        return None
+    pages = entry[1]
+    key = _cache_key(pages, page, clip)
+    if page.number == 0:
+        return pages.get(key)
+    pagedict = pages.pop(key, None)
+    if not pages:
+        del _PAGE_DICTS[id(page.parent)]
+    return pagedict
+
+
+def _take(page: pymupdf.Page, clip: tuple | None) -> dict:
+    """
+    Text dictionary of a page for the main pass of a parse: read from
+    (and dropped from) the cache, or extracted without being cached
+    """
+    pagedict = _pop(page, clip)
+    return pagedict if pagedict is not None else _extract(page, clip)
+
+
+def _extract(page: pymupdf.Page, clip: tuple | None = None) -> dict:
+    """
+    Extract the text dictionary of a page, within a clip rectangle
+    """
+    return page.get_textpage(clip=clip, flags=TEXT_FLAGS).extractDICT()
+
+
+def page_dict(
+    page: pymupdf.Page,
+    sort: bool = False,
+    clip: tuple | None = None,
+) -> dict:
+    """
+    Text dictionary of a page (`TextPage.extractDICT()`).
+
+    The page is cached until the main pass of the parse reads it (see
+    `iter_page_dicts`), so that sniffers and pre-passes that share the
+    document extract it once. The returned dictionary is shared and
+    must not be modified.
+
+    Parameters
+    ----------
+    page : pymupdf.Page
+        Page to extract
+    sort : bool
+        Sort blocks in reading order
+    clip : tuple[float, float, float, float], optional
+        Only extract the text within this rectangle (see `body_clip`).
+        If the whole page was already extracted, it is not extracted
+        again, and the text outside of the rectangle is returned too.
+
+    Returns
+    -------
+    pagedict : dict
+        Output of `TextPage.extractDICT()`
+    """
+    pages = _doc_pages(page.parent)
+    key = _cache_key(pages, page, clip)
+    pagedict = pages.get(key)
+    if pagedict is None:
+        pagedict = pages[key] = _extract(page, clip)
+    return _sort_blocks(pagedict) if sort else pagedict
+
+
+def page_text(pagedict: dict) -> str:
+    """
+    Plain text of a page dictionary, one line per line of text
+    (close to what `page.get_text()` returns, without extracting again)
+    """
+    return '\n'.join(
+        ''.join(span['text'] for span in line['spans'])
+        for block in pagedict['blocks']
+        for line in block['lines']
+    )
+
+
+def iter_page_spans(page: pymupdf.Page) -> Iterator[tuple[str, tuple]]:
+    """
+    Iterate over the text spans of a page, in content order.
+
+    This uses the same (cached) text dictionary as the main parsers,
+    rather than one text search per glyph trace.
+
+    Yields
+    ------
+    text : str
+        Text of the span
+    bbox : tuple[float, float, float, float]
+        Bounding box of the span
+    """
+    for block in page_dict(page)['blocks']:
+        for line in block['lines']:
+            for span in line['spans']:
+                yield span['text'], span['bbox']
+
+
+# Geometry of the lines of text of a page, in content order
+LINE_DTYPE = np.dtype([
+    ('x0', 'f8'), ('y0', 'f8'), ('x1', 'f8'), ('y1', 'f8'),
+    ('page', 'i4'), ('block', 'i4'),
+])
+
+# Fields of the bounding box of a line
+BBOX_FIELDS = ('x0', 'y0', 'x1', 'y1')
+
+
+def page_lines(
+    pagedict: dict,
+    number: int = 0,
+    sep: str = '',
+) -> tuple[list[str], np.ndarray]:
+    """
+    Text and geometry of the lines of a page dictionary.
+
+    Parameters
+    ----------
+    pagedict : dict
+        Output of `TextPage.extractDICT()`
+    number : int
+        Page number (stored in the `page` field)
+    sep : str
+        Separator between the spans of a line
+
+    Returns
+    -------
+    texts : list[str]
+        Text of each line
+    lines : np.ndarray[LINE_DTYPE]
+        Bounding box of each line, and index of its page and block
+    """
+    texts, boxes, blocks = [], [], []
+    for index, block in enumerate(pagedict['blocks']):
+        for line in block.get('lines', ()):
+            texts.append(sep.join([span['text'] for span in line['spans']]))
+            boxes += line['bbox']
+            blocks.append(index)
+    # fields are filled at once, rather than line by line
+    lines = np.empty(len(texts), dtype=LINE_DTYPE)
+    boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+    for field, values in zip(BBOX_FIELDS, boxes.T):
+        lines[field] = values
+    lines['page'] = number
+    lines['block'] = blocks
+    return texts, lines
+
+
+def line_rows(lines: np.ndarray) -> np.ndarray:
+    """
+    Group lines into rows: consecutive lines of a block are on the
+    same row if their tops are less than 1 pt apart.
+
+    Parameters
+    ----------
+    lines : np.ndarray[LINE_DTYPE]
+
+    Returns
+    -------
+    starts : (R,) array[int]
+        Index of the first line of each row (rows do not span blocks)
+    """
+    new = np.ones(len(lines), dtype=bool)
+    new[1:] = (
+        (np.abs(np.diff(lines['y0'])) >= 1) |
+        (np.diff(lines['block']) != 0)
+    )
+    return np.flatnonzero(new)
+
+
+def page_alignment(
+    texts: list[str],
+    lines: np.ndarray,
+    pagewidth: float,
+    title: tuple[str, ...],
+    skip: Callable[[str], object],
+) -> tuple[dict[str, float], bool]:
+    """
+    Find the left-most position of content within each column of a
+    page.
+
+    The title of a protocol (and anything above it), and the lines
+    for which `skip(text)` is true (page furniture), are ignored.
+
+    Parameters
+    ----------
+    texts : list[str]
+        Text of each line
+    lines : np.ndarray[LINE_DTYPE]
+        Geometry of each line
+    pagewidth : float
+        Width of the page
+    title : tuple[str]
+        Start of the lines of a protocol title
+    skip : callable(str) -> bool
+        Whether a line is not part of the body of the page
+
+    Returns
+    -------
+    colx : dict[{'L', 'R'}, float]
+        Left edge of each column
+    has_title : bool
+        Whether a protocol starts on this page
+    """
+    x0 = lines['x0']
+    titles = [i for i, text in enumerate(texts) if text.startswith(title)]
+    if titles:
+        below = lines['y0'] >= lines['y1'][titles].max()
+        order = np.flatnonzero(below)
+        order = order[np.argsort(x0[order], kind='stable')]
+    else:
+        order = np.argsort(x0, kind='stable')
+    split = np.searchsorted(x0[order], pagewidth / 2)
+    x0 = x0.tolist()
+    colx = {}
+    for column, index in (('L', order[:split]), ('R', order[split:])):
+        # lines from left to right, until one is part of the body
+        # (so that the text of most lines is never looked at)
+        colx[column] = next((
+            x0[i] for i in index.tolist() if not skip(texts[i])
+        ), float('inf'))
+    return colx, bool(titles)
+
+
+def page_margins(
+    texts: list[str],
+    lines: np.ndarray,
+    margins: Callable[[str], object],
+    skip: Callable[[str], object],
+) -> np.ndarray:
+    """
+    Find the lines of the running header and footer of a page.
+
+    These are recognized from their text and from their position:
+    page numbers ("2/4") can look like values ("7/8"), but they are
+    above or below all the body of the page.
+
+    Parameters
+    ----------
+    texts : list[str]
+        Text of each line
+    lines : np.ndarray[LINE_DTYPE]
+        Geometry of each line
+    margins : callable(str) -> bool
+        Whether a line may be part of the running header or footer
+    skip : callable(str) -> bool
+        Whether a line is not part of the body of the page
+        (see `page_alignment`)
+
+    Returns
+    -------
+    is_margin : (N,) array[bool]
+        Whether each line is part of the running header or footer
+    """
+    is_margin = np.zeros(len(texts), dtype=bool)
+    # the body spans from the top of its highest line to the bottom of
+    # its lowest one: lines are visited from the top (bottom) of the
+    # page until one is part of the body, so that the text of most
+    # lines is never looked at
+    top = next((
+        lines['y0'][i] for i in np.argsort(lines['y0']).tolist()
+        if not skip(texts[i])
+    ), None)
+    if top is None:
+        return is_margin
+    bottom = next(
+        lines['y1'][i] for i in np.argsort(-lines['y1']).tolist()
+        if not skip(texts[i])
+    )
+    outside = (lines['y1'] <= top) | (lines['y0'] >= bottom)
+    for i in np.flatnonzero(outside).tolist():
+        is_margin[i] = bool(margins(texts[i]))
+    return is_margin
+
+
+def iter_page_layouts(
+    pagedicts: Iterable[dict],
+    pagewidth: float,
+    title: tuple[str, ...],
+    skip: Callable[[str], object],
+    sep: str = '',
+    margins: Callable[[str], object] | None = None,
+) -> Iterator[tuple[list[str], np.ndarray, dict[str, float]]]:
+    """
+    Iterate over the lines of a sequence of pages, with the column
+    edges of each page.
+
+    Edges are computed on each page (see `page_alignment`). A page
+    where a protocol starts sets the edges of the columns that it
+    uses; the following pages only move them to the left, since a
+    page may not contain any section header (whose position is the
+    edge of the column).
+
+    Parameters
+    ----------
+    pagedicts : iterable[dict]
+        Text dictionaries of the pages
+    pagewidth : float
+        Width of the pages
+    title, skip
+        See `page_alignment`
+    sep : str
+        Separator between the spans of a line
+    margins : callable(str) -> bool, optional
+        Whether a line may be part of the running header or footer.
+        These lines are dropped (see `page_margins`).
+
+    Yields
+    ------
+    texts : list[str]
+        Text of each line
+    lines : np.ndarray[LINE_DTYPE]
+        Geometry of each line
+    colx : dict[{'L', 'R'}, float]
+        Left edge of each column
+    """
+    colx = None
+    for number, pagedict in enumerate(pagedicts):
+        texts, lines = page_lines(pagedict, number, sep)
+        if margins is not None:
+            keep = ~page_margins(texts, lines, margins, skip)
+            if not keep.all():
+                texts = [text for text, k in zip(texts, keep) if k]
+                lines = lines[keep]
+        edges, has_title = page_alignment(
+            texts, lines, pagewidth, title, skip
+        )
+        if colx is None:
+            colx = edges
+        elif has_title:
+            colx = {
+                column: edges[column] if edges[column] < np.inf else x
+                for column, x in colx.items()
+            }
+        else:
+            colx = {
+                column: min(x, edges[column]) for column, x in colx.items()
+            }
+        yield texts, lines, colx
+
+
+def body_clip(
+    page: pymupdf.Page,
+    margins: Callable[[str], object],
+    skip: Callable[[str], object],
+) -> tuple[float, float, float, float] | None:
+    """
+    Find the rectangle that holds the body of a page, between its
+    running header and footer.
+
+    The rectangle is learned from one (fully extracted) page, and used
+    to extract the following pages without their header and footer.
+
+    Parameters
+    ----------
+    page : pymupdf.Page
+        Page to learn from (usually the first one)
+    margins : callable(str) -> bool
+        Whether a line is part of the running header or footer
+    skip : callable(str) -> bool
+        Whether a line is not part of the body of the page
+        (see `page_alignment`)
+
+    Returns
+    -------
+    clip : tuple[float, float, float, float] | None
+        Body rectangle (None if the page has no header or footer)
+    """
+    texts, lines = page_lines(page_dict(page))
+    is_margin = page_margins(texts, lines, margins, skip)
+    if not is_margin.any():
+        return None
+    x0, y0, x1, y1 = page.rect
+    # the header (footer) lines are above (below) all the body
+    center = (lines['y0'] + lines['y1']) / 2
+    is_header = is_margin & (center < (y0 + y1) / 2)
+    top = lines['y1'][is_header].max(initial=y0)
+    bottom = lines['y0'][is_margin & ~is_header].min(initial=y1)
+    if (top, bottom) == (y0, y1):
+        return None
+    return x0, float(top), x1, float(bottom)
+
+
+# Documents opened by each worker process, indexed by path
+_WORKER_DOCS: dict[str, pymupdf.Document] = {}
+
+
+def _extract_page_dict(
+    path: str,
+    number: int,
+    clip: tuple | None = None,
+) -> dict:
+    """
+    Extract the text dictionary of one page (runs in a worker process)
+    """
+    if path not in _WORKER_DOCS:
+        _WORKER_DOCS[path] = pymupdf.open(path)
+    return _extract(_WORKER_DOCS[path][number], clip)
+
+
+def iter_page_dicts(
+    pages: Iterable[pymupdf.Page],
+    sort: bool = False,
+    jobs: int | None = None,
+    clip: tuple | None = None,
+) -> Iterator[dict]:
+    """
+    Iterate over the text dictionaries of a sequence of pages, in order
+    (the main pass of a parse).
+
+    Pages that were already extracted (by a pre-pass, or by a sniffer)
+    are read from the cache, and dropped from it; the others are
+    extracted, and not cached.
+
+    Parameters
+    ----------
+    pages : iterable[pymupdf.Page]
+        Pages (or document) to extract
+    sort : bool
+        Sort blocks in reading order
+    jobs : int, optional
+        Number of worker processes used to extract pages.
+        By default, pages are extracted serially in the current process.
+        Each worker opens its own copy of the document, so this is only
+        available for documents that were opened from a file.
+    clip : tuple[float, float, float, float], optional
+        Only extract the text within this rectangle (see `page_dict`)
+
+    Yields
+    ------
+    pagedict : dict
+        Output of `TextPage.extractDICT()`, for each page
+    """
+    cached = {}
+    if jobs and jobs > 1:
+        pages = list(pages)
+        # pages that are cached are taken out at once, so that the
+        # extracted ones cannot get out of step with them
+        for page in pages:
+            pagedict = _pop(page, clip)
+            if pagedict is not None:
+                cached[page.number] = pagedict
+        todo = [page for page in pages if page.number not in cached]
+        path = todo[0].parent.name if todo else ''
+        if len(todo) < 2 or not path:
+            jobs = None
+
+    if not jobs or jobs < 2:
+        for page in pages:
+            pagedict = cached.pop(page.number, None) or _take(page, clip)
+            yield _sort_blocks(pagedict) if sort else pagedict
+        return
+
+    numbers = [page.number for page in todo]
+    chunksize = max(1, len(todo) // (4 * jobs))
+    with ProcessPoolExecutor(min(jobs, len(todo))) as pool:
+        extracted = pool.map(
+            _extract_page_dict, [path] * len(numbers), numbers,
+            [clip] * len(numbers), chunksize=chunksize,
+        )
+        for page in pages:
+            pagedict = cached.pop(page.number, None) or next(extracted)
+            yield _sort_blocks(pagedict) if sort else pagedict
+
+
+# Kinds of tokens
+TITLE = 'TITLE'             # start of a protocol title (its path)
+HEADER = 'HEADER'           # section header
+KEY = 'KEY'                 # key within a section
+GROUP_KEY = 'GROUP_KEY'     # key within a group
+VALUE = 'VALUE'             # value (or continuation of a value)
+SEPARATOR = 'SEPARATOR'     # horizontal rule
+PAGE_NO = 'PAGE_NO'         # page number (or date) in a header/footer
+BANNER = 'BANNER'           # "SIEMENS MAGNETOM ..." page header
+TOC = 'TOC'                 # table of contents
+NEWPAGE = 'NEWPAGE'         # start of a page
+
+_CAPITALS = tuple('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+
+class Lexer:
+    """
+    Classify the spans of a printout into tokens.
+
+    Each span is classified exactly once: first from its text, with a
+    single precompiled pattern whose alternatives are the token kinds
+    (page furniture, titles), then from its indentation within its
+    column. The parsers of each version only differ in their patterns
+    and thresholds, and read the tokens with their own (thin) grammar.
+
+    Parameters
+    ----------
+    patterns : dict[str, str]
+        Pattern of each kind of span that is recognized from its text
+        only, in order of priority. Patterns must match the whole text
+        and must not contain capturing groups.
+    indents : list[tuple[float, str]]
+        Kind of the spans whose indentation is below each threshold,
+        in increasing order. Spans that are more indented are values.
+        Keys that start with a space are keys within a group.
+        Indentations are computed from the geometry of a whole page
+        at once (`page_lines`).
+    """
+
+    def __init__(self, patterns: dict[str, str], indents):
+        self._match = re.compile('|'.join(
+            f'(?P<{kind}>{pattern})' for kind, pattern in patterns.items()
+        ), re.DOTALL).fullmatch
+        self._thresholds = np.asarray([x for x, _ in indents], dtype=float)
+        self._kinds = tuple(kind for _, kind in indents) + (VALUE,)
+
+    def lex(
+        self,
+        texts: list[str],
+        lines: np.ndarray,
+        colx: dict[str, float],
+        pagewidth: float,
+    ) -> Iterator[tuple[str, tuple, str]]:
+        """
+        Classify the lines of a page.
+
+        Indentations are computed for all lines at once, and only the
+        text patterns are matched line by line.
+
+        Parameters
+        ----------
+        texts : list[str]
+            Text of each line
+        lines : np.ndarray[LINE_DTYPE]
+            Geometry of each line
+        colx : dict[{'L', 'R'}, float]
+            Left edge of each column of the page
+        pagewidth : float
+            Width of the page
+
+        Yields
+        ------
+        text : str
+            Text of the line
+        box : tuple[float, float, float, float]
+            Bounding box of the line
+        kind : str
+            Kind of the line
+        """
+        x0 = lines['x0']
+        edge = np.where(x0 < pagewidth / 2, colx['L'], colx['R'])
+        levels = np.searchsorted(
+            self._thresholds, np.abs(edge - x0), side='right'
+        )
+        boxes = zip(*(lines[field].tolist() for field in BBOX_FIELDS))
+        match, kinds = self._match, self._kinds
+        for text, box, level in zip(texts, boxes, levels.tolist()):
+            found = match(text)
+            if found:
+                kind = found.lastgroup
+            else:
+                kind = kinds[level]
+                if kind == KEY and text.startswith(' '):
+                    kind = GROUP_KEY
+            yield text, box, kind
+
+
+def iter_lexed_protocols(
+    tokens: peekable,
+    parse_title: Callable[[peekable], dict],
+    **fields,
+) -> Iterator[dict]:
+    """
+    Build the protocols of a stream of tokens (VB and VE grammar).
+
+    Sections are made of keys (and values), and groups of keys. A
+    group is only known to be one once its first (indented) key is
+    found, and a value or a key may span several lines.
+
+    Parameters
+    ----------
+    tokens : peekable[tuple[str, tuple, str]]
+        Output of `Lexer.lex`
+    parse_title : callable(peekable) -> dict
+        Parse the title of a protocol, starting at its `TITLE` token
+    **fields
+        Added to the title of each protocol
+
+    Yields
+    ------
+    protocol : dict
+        A protocol, with its title in its "Header" dictionary
+    """
+    title: dict | None = None       # Current protocol title object
+    prot: dict | None = None        # Current protocol content
+    header: str | None = None       # Current header
+    group: str | None = None        # Current group
+    key: str | None = None          # Last parsed key
+    last_key: str | None = None     # Last parsed key (never erased)
+    orphans: bool = False           # Tokens skipped since last header
+
+    while True:
+        try:
+            text, box, kind = tokens.peek()
+        except StopIteration:
+            if prot is not None:
+                prot['Header'] = title
+                yield prot
+            break
+
+        if kind == TITLE:
+            # Start of a new protocol (paths start with \\)
+            if prot is not None:
+                prot['Header'] = title
+                yield prot
+            title = parse_title(tokens)
+            title.update(fields)
+            prot = dict()
+            header = group = key = last_key = None
+            orphans = False
+            continue
+
+        # move iterator
+        tokens.next()
+
+        if kind in (KEY, GROUP_KEY, VALUE) and header is None:
+            # Keys and values must be within a section. This happens
+            # when the layout of a page could not be recovered (no
+            # section header is found).
+            if not orphans:
+                LOGGER.warning(
+                    "Found a key or value outside of any section... "
+                    "Let's skip it (and the next ones): " + text
+                )
+                orphans = True
+            continue
+
+        if kind == HEADER:
+            header = text
+            prot.setdefault(header, {})
+            group = key = None
+            orphans = False
+
+        elif kind == KEY:
+            # A key inside a section
+            # May happen to be opening a group but we'll only know later.
+            _group = prot[header].get(group, prot[header])
+            if (
+                not text.startswith(_CAPITALS) and
+                _group.get(last_key, '') is None
+            ):
+                # Sometimes keys span two lines, which we must reconcile
+                del _group[last_key]
+                key = last_key = last_key + ' ' + text
+                _group[last_key] = None
+            else:
+                key = last_key = text
+                prot[header].setdefault(key, None)
+            # If a group was opened, close it
+            group = None
+
+        elif kind == GROUP_KEY:
+            text = text.strip()
+            # A key inside a group
+            # - If group is None, this is the first element in the group
+            #   and we know now that the previous key was a group.
+            #   If group is None _and_ key is None, it's a bit weird...
+            if group is None:
+                if last_key is None:
+                    LOGGER.warning(
+                        "Found an element that should be within a group, "
+                        "but no opened group. Let's assume it's just a "
+                        "normal key: " + text
+                    )
+                else:
+                    group = last_key
+                    prot[header].setdefault(group, {})
+                    # In VE, group-opening keys can have values
+                    # (it was not the case in VD/VB). If it's key case
+                    # we edit the group name so that it's "{name} {value}".
+                    if not isinstance(prot[header][group], dict):
+                        if prot[header][group] is not None:
+                            old_group = group
+                            group = group + ' ' + prot[header][group]
+                            del prot[header][old_group]
+                        prot[header][group] = {}
+            key = last_key = text
+            prot[header][group].setdefault(key, None)
+
+        elif kind == VALUE:
+            # A value.
+            # Note that sometime a value is split across multiple lines.
+            if last_key is None:
+                LOGGER.warning(
+                    "Found a value without key... Let's skip it: " + text
+                )
+                continue
+            _group = prot[header].get(group, prot[header])
+            if key is None:
+                _group[last_key] += ' ' + text
+            else:
+                if _group[key] is not None:
+                    LOGGER.warning(
+                        f"Key \"{key}\" was already filled with value "
+                        f"\"{_group[key]}\". Ignoring new value \"{text}\"."
+                    )
+                else:
+                    _group[key] = text
+            key = None
+
+        # Other tokens (separators, page headers and numbers) are skipped
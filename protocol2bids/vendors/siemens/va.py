@@ -1,11 +1,18 @@
+import numpy as np
 import pymupdf
 import re
 from os import PathLike
-from typing import Literal, Iterator, Iterable
+from typing import Iterator, Iterable
 from logging import getLogger
 
-from .utils import peekable
-from .common import siemens_to_bids
+from .utils import (
+    peekable, iter_page_dicts, body_clip, iter_page_spans, select_pages,
+    match_protocol, iter_page_layouts, Lexer,
+    TITLE, HEADER, KEY, GROUP_KEY, VALUE, SEPARATOR, BANNER, PAGE_NO,
+    NEWPAGE,
+)
+from protocol2bids.utils.pdf import open_pdf
+from .common import iter_siemens_sidecars
 
 LOGGER = getLogger(__name__)
 
@@ -39,37 +46,30 @@ def _merge_dicts(prots):
     return out
 
 
-def _find_alignment(page: pymupdf.Page) -> dict[Literal['L', 'R'], float]:
-    """
-    Find the left-most position of content within each column
-    """
-    traces = page.get_texttrace()
-    # Skip the first element (Scanner and Software versions)
-    traces = traces[1:]
-    # Skip title elements:
-    # [0] Protocol path
-    # [1..5] General stuff (PAT, voxel size, etc)
-    traces = traces[6:]
-    # Find column alignment
-    colx = {'L': float('inf'), 'R': float('inf')}
-    for trace in traces[:-1]:
-        box = trace['bbox']
-        text = page.get_textbox(box)
-        if text.startswith('-') and text.endswith('-'):
-            continue
-        if box[0] < page.bound()[2] / 2:
-            colx['L'] = min(colx['L'], box[0])
-        else:
-            colx['R'] = min(colx['R'], box[0])
-    return colx
+# Start of the lines of a protocol title
+# (Protocol path, then general stuff: PAT, voxel size, etc)
+_TITLE = ('\\\\', 'Scan Time', '+ Scan Time')
+
+# Lines that are not part of the body of a page: empty lines, header
+# (Scanner and Software versions), page number ("1/3", "1/-", "1/+")
+# and separators
+_FURNITURE = re.compile(
+    r'\s*(?:SIEMENS MAGNETOM.*|\d+/[\d+-]+|-(?:.*-)?)?\s*', re.DOTALL
+).fullmatch
+
+# Running header (Scanner and Software versions) and footer (page
+# number) of each page, which are not extracted
+_MARGINS = re.compile(
+    r'\s*(?:SIEMENS MAGNETOM.*|\d+/[\d+-]+)\s*', re.DOTALL
+).fullmatch
 
 
 def _parse_model(page: pymupdf.Page) -> tuple[str, str]:
     """
     Parse scanner model and software version
     """
-    for element in page.get_texttrace():
-        text = page.get_textbox(element['bbox']).strip()
+    for text, _ in iter_page_spans(page):
+        text = text.strip()
         if text.startswith('SIEMENS MAGNETOM'):
             break
     pattern = r'SIEMENS MAGNETOM (?P<model>\w+) (?P<version>.+)'
@@ -116,149 +116,113 @@ def _parse_title(traces: peekable) -> dict:
     return title
 
 
-NEWPAGE = object()
-
-
-def _iter_blocks(doc: pymupdf.Document) -> Iterator[tuple[str, dict]]:
-    for page in doc:
-        yield NEWPAGE
-        blocks = page.get_textpage().extractDICT(sort=False)['blocks']
-        for block in blocks:
-            lines = [[]]
-            boxes = [[]]
-            x = None
-            for line in block['lines']:
-                if x is None:
-                    x = line['bbox'][1]
-                text = ''.join([span['text'] for span in line['spans']])
-                text = text.strip()
-                if abs(line['bbox'][1] - x) < 1:
-                    lines[-1].append(text)
-                    boxes[-1].append(line['bbox'])
-                else:
-                    lines.append([text])
-                    boxes.append([line['bbox']])
-                x = line['bbox'][1]
-            for line, cellboxes in zip(lines, boxes):
-                for cell, bbox in zip(line, cellboxes):
-                    yield cell, bbox
-
-
-def _parse_printout_content(
-    path: str | PathLike,
-    skip_pages: int | Iterable[int] | None = None
-):
+def _iter_layouts(
+    doc: pymupdf.Document,
+    jobs: int | None = None,
+) -> Iterator[tuple[list[str], np.ndarray, dict[str, float]]]:
     """
-    Parse the content in a protocol printout
-
-    Returns
-    -------
-    model_name : str
-        Name of the scanner
-    software_version : str
-        Version of the software
-    protocols : list[(dict, dict)]
-        A list of protocol, where each protocol contains
-        a "title" dictionary, with keys "path" and a few others,
-        and a "key-value" dictionary that contains all parameters
-        in the protocol.
+    Iterator over the (stripped) lines of each page, with its
+    column edges
+    """
+    # headers and footers are only extracted on the first page
+    clip = body_clip(doc[0], _MARGINS, _FURNITURE)
+    layouts = iter_page_layouts(
+        iter_page_dicts(doc, jobs=jobs, clip=clip), doc[0].bound()[2],
+        _TITLE, _FURNITURE, margins=_MARGINS,
+    )
+    for texts, lines, colx in layouts:
+        yield [text.strip() for text in texts], lines, colx
+
+
+# Lines recognized from their text, and kind of the other lines from
+# their indentation
+_LEXER = Lexer(
+    patterns={
+        BANNER: r'SIEMENS MAGNETOM.*',
+        SEPARATOR: r'[- ]*-[- ]*',
+        PAGE_NO: r'.*/[-+]',
+        TITLE: r'\\\\.*',
+    },
+    indents=[(1, HEADER), (50, KEY)],
+)
+
+
+def _iter_protocols(
+    doc: list[pymupdf.Page],
+    jobs: int | None = None,
+) -> Iterator[dict]:
+    """
+    Iterate over the protocols contained in a list of pages
     """
-    doc = pymupdf.open(str(path))
-
-    prots: list = []                          # All protocols in the doc
     title: dict | None = None                 # Current protocol title object
     prot: dict | None = None                  # Current protocol content
-    column: Literal['L', 'R'] | None = None   # Current column
     header: str | None = None                 # Current header
     group: str | None = None                  # Current group
     key: str | None = None                    # Last parsed key
 
-    if skip_pages is not None:
-        if isinstance(skip_pages, int):
-            skip_pages = [skip_pages]
-        skip_pages = list(skip_pages)
-        doc = [page for i, page in enumerate(doc) if i not in skip_pages]
-
-    colx = _find_alignment(doc[0])
     pagewidth = doc[0].bound()[2]
 
     model_name, software_version = _parse_model(doc[0])
 
-    iter_traces = peekable(_iter_blocks(doc))
+    def iter_tokens():
+        for texts, lines, colx in _iter_layouts(doc, jobs=jobs):
+            yield None, None, NEWPAGE
+            yield from _LEXER.lex(texts, lines, colx, pagewidth)
+
+    tokens = peekable(iter_tokens())
     prots_buffer = []
     while True:
         try:
-            elem = iter_traces.peek()
-            if elem is NEWPAGE:
-                iter_traces.next()
-                if prot is not None:
-                    prots_buffer.append(prot)
-                prot = dict()
-                continue
-            else:
-                text, box = elem
+            text, box, kind = tokens.peek()
         except StopIteration:
             if prot is not None:
                 prots_buffer.append(prot)
             if prots_buffer:
-                prots.append(_merge_dicts(prots_buffer))
+                yield _merge_dicts(prots_buffer)
             prots_buffer = []
             break
 
-        if text.startswith('SIEMENS MAGNETOM'):
-            # skip header
-            iter_traces.next()
-            continue
-
-        if set(text) in ({'-'}, {'-', ' '}):
-            # skip line separator
-            iter_traces.next()
-            continue
-
-        if text.endswith(('/-', '/+')):
-            # skip page number
-            iter_traces.next()
+        if kind == NEWPAGE:
+            tokens.next()
+            if prot is not None:
+                prots_buffer.append(prot)
+            prot = dict()
             continue
 
-        if text.startswith('\\\\'):
+        if kind == TITLE:
             # a new protocol was started on this page (paths start with \\)
             # 1. combine all protocols from previous pages and append them
             if prots_buffer:
-                prots.append(_merge_dicts(prots_buffer))
+                yield _merge_dicts(prots_buffer)
             prots_buffer = []
             # 2. parse header and insert in last protocol (current page)
-            title = _parse_title(iter_traces)
+            title = _parse_title(tokens)
             title['ModelName'] = model_name
             title['SoftwareVersions'] = software_version
             prot['Header'] = title
             continue
 
-        iter_traces.next()
-
-        # Find which column we're on and compute indentation size
-        column = 'L' if box[0] < pagewidth / 2 else 'R'
-        indent = abs(colx[column] - box[0])
+        tokens.next()
 
-        if indent < 1:
+        if kind == HEADER:
             header = text
             prot.setdefault(header, {})
             group = key = None
-        elif indent < 50:
-            if not text.startswith(' '):
-                if key is not None:
-                    if group is not None:
-                        prot[header][group][key] = None
-                    else:
-                        prot[header][key] = None
-                key = text
-                group = None
-            else:
-                text = text.strip()
-                if group is None and key is not None:
-                    group = key
-                    prot[header].setdefault(group, {})
-                key = text
-        else:
+        elif kind == KEY:
+            if key is not None:
+                if group is not None:
+                    prot[header][group][key] = None
+                else:
+                    prot[header][key] = None
+            key = text
+            group = None
+        elif kind == GROUP_KEY:
+            text = text.strip()
+            if group is None and key is not None:
+                group = key
+                prot[header].setdefault(group, {})
+            key = text
+        elif kind == VALUE:
             assert key is not None, key
             prot.setdefault(header, {})
             if group is not None:
@@ -267,12 +231,76 @@ def _parse_printout_content(
             else:
                 prot[header][key] = text
             key = None
+        # Other tokens (separators, page headers and numbers) are skipped
+
+
+def iter_protocols(
+    path: str | PathLike | pymupdf.Document,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+) -> Iterator[dict]:
+    """
+    Iterate over the protocols in a printout.
+
+    Each protocol is yielded as soon as its last block has been consumed,
+    so that only one protocol is held in memory at a time.
+
+    Parameters
+    ----------
+    path : str | PathLike | pymupdf.Document
+        Protocol printout
+    skip_pages : int | iterable[int], optional
+        Pages to ignore
+    jobs : int, optional
+        Number of processes used to extract text from the pages
+    protocols : str | iterable[str], optional
+        Glob patterns of the protocol paths to parse (default: all).
+        Only the pages that contain matching protocols are extracted.
+
+    Yields
+    ------
+    protocol : dict
+        A protocol, which contains a "Header" dictionary, with keys
+        "path" and a few others, and nested "key-value" dictionaries
+        that contain all parameters in the protocol.
+    """
+    doc = select_pages(open_pdf(path), skip_pages, protocols)
+    if not doc:
+        return
+    for prot in _iter_protocols(doc, jobs=jobs):
+        if match_protocol(prot['Header']['path'], protocols):
+            yield prot
+
+
+def _parse_printout_content(
+    path: str | PathLike | pymupdf.Document,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+):
+    """
+    Parse the content in a protocol printout
 
-    return prots
+    Returns
+    -------
+    model_name : str
+        Name of the scanner
+    software_version : str
+        Version of the software
+    protocols : list[(dict, dict)]
+        A list of protocol, where each protocol contains
+        a "title" dictionary, with keys "path" and a few others,
+        and a "key-value" dictionary that contains all parameters
+        in the protocol.
+    """
+    return list(iter_protocols(
+        path, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    ))
 
 
-def sniff(path: str):
-    doc = pymupdf.open(str(path))
+def sniff(path: str | PathLike | pymupdf.Document):
+    doc = open_pdf(path)
     try:
         model, version = _parse_model(doc[0])
         if version.startswith('syngo MR 20'):
@@ -282,27 +310,60 @@ def sniff(path: str):
     return False
 
 
+def iter_sidecars(
+    path: str | PathLike | pymupdf.Document,
+    nii: Iterable[str | dict] | None = None,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+):
+    """
+    Iterate over the BIDS sidecars of all protocols in a printout.
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    prots = iter_protocols(
+        path, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    )
+    yield from iter_siemens_sidecars(prots, nii)
+
+
+def iter_content_sidecars(
+    content: list[dict],
+    nii: Iterable[str | dict] | None = None,
+):
+    """
+    Iterate over the BIDS sidecars of an already parsed printout.
+
+    Parameters
+    ----------
+    content : list[dict]
+        Output of `_parse_printout_content`
+    nii : iterable[str | dict], optional
+        Nifti file (or `nii2axes` keywords) of each protocol
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    yield from iter_siemens_sidecars(content, nii)
+
+
 def parse(
-    path: str | PathLike,
+    path: str | PathLike | pymupdf.Document,
     nii: Iterable[str | dict] | None = None,
     skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
 ):
-    prots = _parse_printout_content(path, skip_pages=skip_pages)
-    base = {
-        'Manufacturer': 'Siemens',
-        'ManufacturersModelName': prots[0]['Header']['ModelName'],
-        'SoftwareVersions': prots[0]['Header']['SoftwareVersions'],
-    }
-
-    if isinstance(nii, str):
-        nii = [nii]
-    nii = list(nii or [])
-    nii += max(0, len(prots)-len(nii)) * [{}]
-    nii = [dict(file=x) if isinstance(x, str) else x for x in nii]
-    sidecars = {}
-    for prot, info in zip(prots, nii):
-        # Convert to BIDS
-        sidecar = {**base, **siemens_to_bids(prot, **info)}
-        # Save BIDS sidecar
-        sidecars[prot['Header']['path']] = sidecar
-    return sidecars
+    return dict(iter_sidecars(
+        path, nii, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    ))
@@ -1,52 +1,47 @@
+import numpy as np
 import pymupdf
 import re
 from os import PathLike
 from typing import Iterator, Iterable
 from logging import getLogger
 
-from .utils import peekable
-from .common import siemens_to_bids
+from .utils import (
+    peekable, iter_page_dicts, body_clip, iter_page_spans, select_pages,
+    match_protocol, line_rows, iter_page_layouts, Lexer,
+    TITLE, HEADER, BANNER, PAGE_NO, TOC,
+)
+from protocol2bids.utils.pdf import open_pdf
+from .common import iter_siemens_sidecars
 
 
 LOGGER = getLogger(__name__)
 
 
-def _find_alignment(page: pymupdf.Page) -> float:
-    """
-    Find the left-most position of content within the page
-    """
-    traces = page.get_texttrace()
-    # Skip page number and date
-    traces = traces[1:-1]
-    # Skip title elements:
-    # [0] Protocol path
-    # [1..5] General stuff (PAT, voxel size, etc)
-    traces = traces[6:]
-    # Find column alignment
-    colx = float('inf')
-    for trace in traces[:-1]:
-        box = trace['bbox']
-        text = page.get_textbox(box).strip()
-        # skip non header/key components
-        if not text:
-            continue
-        if '\n' in text:
-            continue
-        if text.startswith('\\\\'):
-            continue
-        # update left alignment
-        colx = min(colx, box[0])
-    return colx
+# Start of the lines of a protocol title
+# (Protocol path, then general stuff: PAT, voxel size, etc)
+_TITLE = ('\\\\', 'TA')
+
+# Lines that are not part of the body of a page: empty lines, header
+# (Scanner and Software versions), page number and date
+_FURNITURE = re.compile(
+    r'\s*(?:(?:SIEMENS MAGNETOM|Page).*|\d+[/.]\d+[/.]\d\d+)?\s*',
+    re.DOTALL,
+).fullmatch
+
+# Running header (page number) and footer (date) of each page, which
+# are not extracted
+_MARGINS = re.compile(
+    r'\s*(?:Page.*|\d+[/.]\d+[/.]\d\d+)\s*', re.DOTALL
+).fullmatch
 
 
 def _parse_model(page: pymupdf.Page) -> tuple[str, str]:
     """
     Parse scanner model and software version
     """
-    first_element = page.get_texttrace()[0]
-    text = page.get_textbox(first_element['bbox'])
+    text, _ = next(iter_page_spans(page), ('', None))
     pattern = r'SIEMENS MAGNETOM (?P<model>\w+) (?P<version>.+)'
-    match = re.fullmatch(pattern, text)
+    match = re.fullmatch(pattern, text.strip())
     if match:
         return match.group('model'), match.group('version')
     else:
@@ -89,87 +84,92 @@ def _parse_title(blocks: peekable) -> dict:
     return title
 
 
-def _iter_blocks(doc: pymupdf.Document) -> Iterator[tuple[list, dict]]:
+def _iter_blocks(
+    doc: pymupdf.Document,
+    jobs: int | None = None,
+) -> Iterator[tuple[list, str]]:
     """
     Iterator over all blocks in the document.
-    Returns the corresponding text and block object.
-    The returnted text is a list of list
+    Returns the text and kind of each block.
+    The returned text is a list of list
     - outer loop: rows
     - inner loop: cells
+    The kind is that of the first cell (see `_LEXER`).
     """
-    for page in doc:
-        blocks = page.get_textpage().extractDICT(sort=True)['blocks']
-        for block in blocks:
-            lines = [[]]
-            x = None
-            for line in block['lines']:
-                if x is None:
-                    x = line['bbox'][1]
-                text = '.'.join([span['text'] for span in line['spans']])
-                if abs(line['bbox'][1] - x) < 1:
-                    lines[-1].append(text)
-                else:
-                    lines.append([text])
-                x = line['bbox'][1]
-            yield lines, block
-
-
-def _parse_printout_content(
-    path: str | PathLike,
-    skip_pages: int | Iterable[int] | None = None
-):
+    # headers and footers are only extracted on the first page
+    clip = body_clip(doc[0], _MARGINS, _FURNITURE)
+    layouts = iter_page_layouts(
+        iter_page_dicts(doc, sort=True, jobs=jobs, clip=clip),
+        float('inf'), _TITLE, _FURNITURE, sep='.', margins=_MARGINS,
+    )
+    for texts, lines, colx in layouts:
+        if not len(lines):
+            continue
+        # split lines into rows, and rows into blocks
+        starts = line_rows(lines)
+        firsts = np.flatnonzero(np.diff(lines['block'], prepend=-1))
+        block_rows = np.searchsorted(starts, firsts).tolist()
+        starts = starts.tolist()
+        rows = [
+            texts[start:stop]
+            for start, stop in zip(starts, starts[1:] + [len(texts)])
+        ]
+        # blocks are indented as their left-most line
+        blocks = lines[firsts]
+        blocks['x0'] = np.minimum.reduceat(lines['x0'], firsts)
+        kinds = _LEXER.lex(
+            [texts[i] for i in firsts.tolist()], blocks, colx, float('inf')
+        )
+        for start, stop, (_, _, kind) in zip(
+            block_rows, block_rows[1:] + [len(rows)], kinds
+        ):
+            yield rows[start:stop], kind
+
+
+# Blocks recognized from their first line, and kind of the other blocks
+# from their indentation (blocks that are not headers hold key-values)
+_LEXER = Lexer(
+    patterns={
+        TITLE: r'\\\\.*',
+        BANNER: r'SIEMENS MAGNETOM.*',
+        PAGE_NO: r'Page.*|\d+[/.]\d+[/.]\d\d+',
+        TOC: r'Table of contents',
+    },
+    indents=[(10, HEADER)],
+)
+
+
+def _iter_protocols(
+    doc: list[pymupdf.Page],
+    jobs: int | None = None,
+) -> Iterator[dict]:
     """
-    Parse the content in a protocol printout
-
-    Returns
-    -------
-    model_name : str
-        Name of the scanner
-    software_version : str
-        Version of the software
-    protocols : list[(dict, dict)]
-        A list of protocol, where each protocol contains
-        a "title" dictionary, with keys "path" and a few others,
-        and a "key-value" dictionary that contains all parameters
-        in the protocol.
+    Iterate over the protocols contained in a list of pages
     """
-    doc = pymupdf.open(str(path))
-
-    prots: list = []                    # All protocols in the doc
     title: dict | None = None           # Current protocol title object
     prot: dict | None = None            # Current protocol content
     header: str | None = None           # Current header
 
-    if skip_pages is not None:
-        if isinstance(skip_pages, int):
-            skip_pages = [skip_pages]
-        skip_pages = list(skip_pages)
-        doc = [page for i, page in enumerate(doc) if i not in skip_pages]
-
-    colx = _find_alignment(doc[0])
-
-    model_name, software_version = _parse_model(doc[0])
-
-    iter_blocks = peekable(_iter_blocks(doc))
+    iter_blocks = peekable(_iter_blocks(doc, jobs=jobs))
     while True:
         try:
-            lines, block = iter_blocks.peek()
+            lines, kind = iter_blocks.peek()
         except StopIteration:
             if prot is not None:
-                prots.append(prot)
+                yield prot
             break
 
         first_line = lines[0]
         first_span = first_line[0]
 
-        if first_span.startswith('\\\\'):
+        if kind == TITLE:
             if first_span.strip() == '\\\\USER':
                 # we're in the table of contents somehow...
                 break
 
             # Start of a new protocol (paths start with \\)
             if prot is not None:
-                prots.append(prot)
+                yield prot
             title = _parse_title(iter_blocks)
             prot = dict(Header=title)
             continue
@@ -178,27 +178,22 @@ def _parse_printout_content(
 
         if not ''.join(first_line).strip():
             continue
-        if first_span.startswith('SIEMENS MAGNETOM'):
-            # Separation between protocols
-            continue
-        if first_span.startswith('Page'):
-            # Page number (header)
+        if kind in (BANNER, PAGE_NO):
+            # Separation between protocols, page number (header)
+            # or date (footer)
             continue
-        if re.fullmatch(r'\d+(/|\.)\d+(/|\.)\d\d+', first_span):
-            # Date (footer)
-            continue
-        if first_span == 'Table of contents':
+        if kind == TOC:
             # Table of contents is always at the end, we can stop here
             if prot is not None:
-                prots.append([title, prot])
+                yield prot
             break
 
-        # Compute indentation size
-        box = block['bbox']
-        indent = abs(colx - box[0])
+        if prot is None:
+            # End of a protocol that started before the first page
+            continue
 
         for line in lines:
-            if len(line) == 1 and indent < 10:
+            if len(line) == 1 and kind == HEADER:
                 header = line[0]
                 prot.setdefault(header, {})
             elif len(line) > 1:
@@ -206,11 +201,79 @@ def _parse_printout_content(
             else:
                 prot[header][line[0]] = None
 
+
+def iter_protocols(
+    path: str | PathLike | pymupdf.Document,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+) -> Iterator[dict]:
+    """
+    Iterate over the protocols in a printout.
+
+    Each protocol is yielded as soon as its last block has been consumed,
+    so that only one protocol is held in memory at a time.
+
+    Parameters
+    ----------
+    path : str | PathLike | pymupdf.Document
+        Protocol printout
+    skip_pages : int | iterable[int], optional
+        Pages to ignore
+    jobs : int, optional
+        Number of processes used to extract text from the pages
+    protocols : str | iterable[str], optional
+        Glob patterns of the protocol paths to parse (default: all).
+        Only the pages that contain matching protocols are extracted.
+
+    Yields
+    ------
+    protocol : dict
+        A protocol, which contains a "Header" dictionary, with keys
+        "path" and a few others, and nested "key-value" dictionaries
+        that contain all parameters in the protocol.
+    """
+    doc = select_pages(open_pdf(path), skip_pages, protocols)
+    if not doc:
+        return
+    for prot in _iter_protocols(doc, jobs=jobs):
+        if match_protocol(prot['Header']['path'], protocols):
+            yield prot
+
+
+def _parse_printout_content(
+    path: str | PathLike | pymupdf.Document,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+):
+    """
+    Parse the content in a protocol printout
+
+    Returns
+    -------
+    model_name : str
+        Name of the scanner
+    software_version : str
+        Version of the software
+    protocols : list[(dict, dict)]
+        A list of protocol, where each protocol contains
+        a "title" dictionary, with keys "path" and a few others,
+        and a "key-value" dictionary that contains all parameters
+        in the protocol.
+    """
+    doc = open_pdf(path)
+    model_name, software_version = _parse_model(
+        select_pages(doc, skip_pages)[0]
+    )
+    prots = list(iter_protocols(
+        doc, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    ))
     return model_name, software_version, prots
 
 
-def sniff(path: str):
-    doc = pymupdf.open(str(path))
+def sniff(path: str | PathLike | pymupdf.Document):
+    doc = open_pdf(path)
     try:
         model, version = _parse_model(doc[0])
         if version.startswith('syngo MR D'):
@@ -220,29 +283,73 @@ def sniff(path: str):
     return False
 
 
-def parse(
-    path: str | PathLike,
+def iter_sidecars(
+    path: str | PathLike | pymupdf.Document,
     nii: Iterable[str | dict] | None = None,
     skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
 ):
-    model, software, prots = _parse_printout_content(path,
-                                                     skip_pages=skip_pages)
+    """
+    Iterate over the BIDS sidecars of all protocols in a printout.
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    doc = open_pdf(path)
+    model, software = _parse_model(select_pages(doc, skip_pages)[0])
     base = {
         'Manufacturer': 'Siemens',
         'ManufacturersModelName': model,
         'SoftwareVersions': software,
     }
+    prots = iter_protocols(
+        doc, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    )
+    yield from iter_siemens_sidecars(prots, nii, base)
 
-    if isinstance(nii, str):
-        nii = [nii]
-    nii = list(nii or [])
-    nii += max(0, len(prots)-len(nii)) * [{}]
-    nii = [dict(file=x) if isinstance(x, str) else x for x in nii]
-
-    sidecars = {}
-    for prot, info in zip(prots, nii):
-        # Convert to BIDS
-        sidecar = {**base, **siemens_to_bids(prot, **info)}
-        # Save BIDS sidecar
-        sidecars[prot['Header']['path']] = sidecar
-    return sidecars
+
+def iter_content_sidecars(
+    content: tuple[str, str, list[dict]],
+    nii: Iterable[str | dict] | None = None,
+):
+    """
+    Iterate over the BIDS sidecars of an already parsed printout.
+
+    Parameters
+    ----------
+    content : tuple[str, str, list[dict]]
+        Output of `_parse_printout_content`
+    nii : iterable[str | dict], optional
+        Nifti file (or `nii2axes` keywords) of each protocol
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    model, software, prots = content
+    base = {
+        'Manufacturer': 'Siemens',
+        'ManufacturersModelName': model,
+        'SoftwareVersions': software,
+    }
+    yield from iter_siemens_sidecars(prots, nii, base)
+
+
+def parse(
+    path: str | PathLike | pymupdf.Document,
+    nii: Iterable[str | dict] | None = None,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+):
+    return dict(iter_sidecars(
+        path, nii, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    ))
@@ -1,36 +1,47 @@
+import numpy as np
 import pymupdf
 import re
 from os import PathLike
-from typing import Literal, Iterator, Iterable
+from typing import Iterator, Iterable
 from logging import getLogger
 
-from .utils import peekable
-from .common import siemens_to_bids
+from .utils import (
+    peekable, iter_page_dicts, page_dict, body_clip, page_text,
+    select_pages, match_protocol, iter_page_layouts, Lexer,
+    iter_lexed_protocols,
+    TITLE, HEADER, KEY, GROUP_KEY, SEPARATOR, BANNER, PAGE_NO,
+)
+from protocol2bids.utils.pdf import open_pdf
+from .common import iter_siemens_sidecars
 
 
 LOGGER = getLogger(__name__)
 
 
-def _find_alignment(doc: pymupdf.Document) -> dict[Literal['L', 'R'], float]:
-    """
-    Find the left-most position of content within each column
-    """
-    colx = {'L': float('inf'), 'R': float('inf')}
-    for text, box in _iter_blocks(doc):
-        if text.startswith('-') and text.endswith('-'):
-            continue
-        if box[0] < doc[0].bound()[2] / 2:
-            colx['L'] = min(colx['L'], box[0])
-        else:
-            colx['R'] = min(colx['R'], box[0])
-    return colx
+# Start of the lines of a protocol title
+# (Protocol path, then general stuff: PAT, voxel size, etc)
+_TITLE = ('\\\\', 'TA:')
+
+# Lines that are not part of the body of a page: empty lines, header
+# (Scanner), page numbers ("- 1 -") and separators
+_FURNITURE = re.compile(
+    r'\s*(?:SIEMENS MAGNETOM.*|-(?:.*-)?)?\s*', re.DOTALL
+).fullmatch
+
+# Running header (Scanner) and footer (page number) of each page,
+# which are not extracted
+_MARGINS = re.compile(
+    r'\s*(?:SIEMENS MAGNETOM.*|- \d+ -)\s*', re.DOTALL
+).fullmatch
 
 
 def _parse_model(doc: pymupdf.Document) -> tuple[str, str]:
     """
     Parse scanner model and software version
     """
-    for text, _ in _iter_blocks(doc):
+    # the header is only extracted on the first page (see `body_clip`)
+    for text in page_text(page_dict(doc[0])).split('\n'):
+        text = text.strip()
         if text.startswith('SIEMENS MAGNETOM'):
             break
     pattern = r'SIEMENS MAGNETOM (?P<model>\w+)'
@@ -81,11 +92,20 @@ def _parse_title(traces: peekable) -> dict:
     return title
 
 
-def _iter_blocks(doc: pymupdf.Document) -> Iterator[tuple[str, dict]]:
+def _iter_pages(
+    doc: pymupdf.Document,
+    jobs: int | None = None,
+) -> Iterator[dict]:
+    """
+    Iterator over the text dictionaries of all pages in the document,
+    except the table of contents
+    """
+    # headers and footers are only extracted on the first page
+    clip = body_clip(doc[0], _MARGINS, _FURNITURE)
     has_toc = False
-    for page in doc:
+    for pagedict in iter_page_dicts(doc, jobs=jobs, clip=clip):
 
-        text = page.get_text()
+        text = page_text(pagedict)
         if 'Table of contents' in text:
             has_toc = True
             continue
@@ -96,31 +116,104 @@ def _iter_blocks(doc: pymupdf.Document) -> Iterator[tuple[str, dict]]:
             else:
                 continue
 
-        blocks = page.get_textpage().extractDICT(sort=False)['blocks']
-        for block in blocks:
-            lines = [[]]
-            boxes = [[]]
-            x = None
-            for line in block['lines']:
-                if x is None:
-                    x = line['bbox'][1]
-                text = ''.join([span['text'] for span in line['spans']])
-                text = text.strip()
-                if abs(line['bbox'][1] - x) < 1:
-                    lines[-1].append(text)
-                    boxes[-1].append(line['bbox'])
-                else:
-                    lines.append([text])
-                    boxes.append([line['bbox']])
-                x = line['bbox'][1]
-            for line, cellboxes in zip(lines, boxes):
-                for cell, bbox in zip(line, cellboxes):
-                    yield cell, bbox
+        yield pagedict
+
+
+def _iter_layouts(
+    doc: pymupdf.Document,
+    jobs: int | None = None,
+) -> Iterator[tuple[list[str], np.ndarray, dict[str, float]]]:
+    """
+    Iterator over the (stripped) lines of each page, with its
+    column edges
+    """
+    layouts = iter_page_layouts(
+        _iter_pages(doc, jobs=jobs), doc[0].bound()[2],
+        _TITLE, _FURNITURE, margins=_MARGINS,
+    )
+    for texts, lines, colx in layouts:
+        yield [text.strip() for text in texts], lines, colx
+
+
+# Lines recognized from their text, and kind of the other lines from
+# their indentation
+_LEXER = Lexer(
+    patterns={
+        SEPARATOR: r'[- ]*-[- ]*',
+        BANNER: r'SIEMENS MAGNETOM.*',
+        PAGE_NO: r'- \d+ -',
+        TITLE: r'\\\\.*',
+    },
+    indents=[(1, HEADER), (10, KEY), (50, GROUP_KEY)],
+)
+
+
+def _iter_protocols(
+    doc: list[pymupdf.Page],
+    jobs: int | None = None,
+) -> Iterator[dict]:
+    """
+    Iterate over the protocols contained in a list of pages
+    """
+    pagewidth = doc[0].bound()[2]
+
+    model_name, software_version = _parse_model(doc)
+
+    tokens = (
+        token
+        for texts, lines, colx in _iter_layouts(doc, jobs=jobs)
+        for token in _LEXER.lex(texts, lines, colx, pagewidth)
+    )
+    yield from iter_lexed_protocols(
+        peekable(tokens), _parse_title,
+        ModelName=model_name, SoftwareVersions=software_version,
+    )
+
+
+def iter_protocols(
+    path: str | PathLike | pymupdf.Document,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+) -> Iterator[dict]:
+    """
+    Iterate over the protocols in a printout.
+
+    Each protocol is yielded as soon as its last block has been consumed,
+    so that only one protocol is held in memory at a time.
+
+    Parameters
+    ----------
+    path : str | PathLike | pymupdf.Document
+        Protocol printout
+    skip_pages : int | iterable[int], optional
+        Pages to ignore
+    jobs : int, optional
+        Number of processes used to extract text from the pages
+    protocols : str | iterable[str], optional
+        Glob patterns of the protocol paths to parse (default: all).
+        Only the pages that contain matching protocols are extracted.
+
+    Yields
+    ------
+    protocol : dict
+        A protocol, which contains a "Header" dictionary, with keys
+        "path" and a few others, and nested "key-value" dictionaries
+        that contain all parameters in the protocol.
+    """
+    doc = select_pages(open_pdf(path), skip_pages, protocols)
+    if not doc:
+        return
+    for prot in _iter_protocols(doc, jobs=jobs):
+        if match_protocol(prot['Header']['path'], protocols):
+            yield prot
 
 
 def _parse_printout_content(
-    path: str | PathLike,
-    skip_pages: int | Iterable[int] | None = None
+    path: str | PathLike | pymupdf.Document,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
 ):
     """
     Parse the content in a protocol printout
@@ -137,145 +230,13 @@ def _parse_printout_content(
         and a "key-value" dictionary that contains all parameters
         in the protocol.
     """
-    doc = pymupdf.open(str(path))
-
-    prots: list = []                          # All protocols in the doc
-    title: dict | None = None                 # Current protocol title object
-    prot: dict | None = None                  # Current protocol content
-    column: Literal['L', 'R'] | None = None   # Current column
-    header: str | None = None                 # Current header
-    group: str | None = None                  # Current group
-    key: str | None = None                    # Last parsed key
-    last_key: str | None = None               # Last parsed key (never erased)
-
-    if skip_pages is not None:
-        if isinstance(skip_pages, int):
-            skip_pages = [skip_pages]
-        skip_pages = list(skip_pages)
-        doc = [page for i, page in enumerate(doc) if i not in skip_pages]
-
-    colx = _find_alignment(doc)
-    pagewidth = doc[0].bound()[2]
-
-    model_name, software_version = _parse_model(doc)
-
-    iter_bocks = peekable(_iter_blocks(doc))
-    while True:
-        try:
-            text, box = iter_bocks.peek()
-        except StopIteration:
-            if prot is not None:
-                prot['Header'] = title
-                prots.append(prot)
-            break
-
-        if set(text) in ({'-'}, {'-', ' '}):
-            # skip line separator
-            iter_bocks.next()
-            continue
-
-        if text.startswith('SIEMENS MAGNETOM'):
-            # skip line header
-            iter_bocks.next()
-            continue
-
-        if re.fullmatch(r'- \d+ -', text):
-            # skip page number
-            iter_bocks.next()
-            continue
-
-        if text.startswith('\\\\'):
-            # Start of a new protocol (paths start with \\)
-            if prot is not None:
-                prot['Header'] = title
-                prots.append(prot)
-            title = _parse_title(iter_bocks)
-            title['ModelName'] = model_name
-            title['SoftwareVersions'] = software_version
-            prot = dict()
-            continue
-
-        iter_bocks.next()
-
-        # Find which column we're on and compute indentation size
-        column = 'L' if box[0] < pagewidth / 2 else 'R'
-        indent = abs(colx[column] - box[0])
-
-        if indent < 1:
-            # Section header
-            header = text
-            prot.setdefault(header, {})
-            group = key = None
-        elif indent < 10:
-            # A key inside a section
-            # May happen to be opening a group but we'll only know later.
-            CAPITAL = tuple('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
-            if (
-                not text.startswith(CAPITAL) and
-                prot[header].get(group, prot[header]).get(last_key, '') is None
-            ):
-                # Sometimes keys span two lines, which we must reconcile
-                del prot[header].get(group, prot[header])[last_key]
-                key = last_key = last_key + ' ' + text
-                prot[header].get(group, prot[header])[last_key] = None
-            else:
-                key = last_key = text
-                prot[header].setdefault(key, None)
-            # If a group was opened, close it
-            group = None
-        elif indent < 50:
-            # A key inside a group
-            # - If group is None, this is the first element in the group
-            #   and we know now that the previous key was a group.
-            #   If group is None _and_ key is None, it's a bit weird...
-            if group is None:
-                if last_key is None:
-                    LOGGER.warning(
-                        "Found an element that should be within a group, "
-                        "but no opened group. Let's assume it's just a "
-                        "normal key: " + text
-                    )
-                else:
-                    group = last_key
-                    prot[header].setdefault(group, {})
-                    # In VE, group-opening keys can have values
-                    # (it was not the case in VD/VB). If it's key case
-                    # we edit the group name so that it's "{name} {value}".
-                    if not isinstance(prot[header][group], dict):
-                        if prot[header][group] is not None:
-                            old_group = group
-                            group = group + ' ' + prot[header][group]
-                            del prot[header][old_group]
-                        prot[header][group] = {}
-            key = last_key = text
-            prot[header][group].setdefault(key, None)
-        else:
-            # A value.
-            # Note that sometime a value is split across multiple lines.
-            if last_key is None:
-                LOGGER.warning(
-                    "Found a value without key... Let's skip it: " + text
-                )
-                continue
-            _group = prot[header].get(group, prot[header])
-            if key is None:
-                _group[last_key] += ' ' + text
-            else:
-                if _group[key] is not None:
-                    LOGGER.warning(
-                        f"Key \"{key}\" was already filled with value "
-                        f"\"{prot[header][group][key]}\". Ignoring new "
-                        f"value \"{text}\"."
-                    )
-                else:
-                    _group[key] = text
-            key = None
+    return list(iter_protocols(
+        path, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    ))
 
-    return prots
 
-
-def sniff(path: str):
-    doc = pymupdf.open(str(path))
+def sniff(path: str | PathLike | pymupdf.Document):
+    doc = open_pdf(path)
     try:
         model, version = _parse_model(doc[0])
         if version.startswith('syngo MR E'):
@@ -285,28 +246,60 @@ def sniff(path: str):
     return False
 
 
+def iter_sidecars(
+    path: str | PathLike | pymupdf.Document,
+    nii: Iterable[str | dict] | None = None,
+    skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
+):
+    """
+    Iterate over the BIDS sidecars of all protocols in a printout.
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    prots = iter_protocols(
+        path, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    )
+    yield from iter_siemens_sidecars(prots, nii)
+
+
+def iter_content_sidecars(
+    content: list[dict],
+    nii: Iterable[str | dict] | None = None,
+):
+    """
+    Iterate over the BIDS sidecars of an already parsed printout.
+
+    Parameters
+    ----------
+    content : list[dict]
+        Output of `_parse_printout_content`
+    nii : iterable[str | dict], optional
+        Nifti file (or `nii2axes` keywords) of each protocol
+
+    Yields
+    ------
+    path : str
+        Protocol path
+    sidecar : dict
+        BIDS sidecar
+    """
+    yield from iter_siemens_sidecars(content, nii)
+
+
 def parse(
-    path: str | PathLike,
+    path: str | PathLike | pymupdf.Document,
     nii: Iterable[str | dict] | None = None,
     skip_pages: int | Iterable[int] | None = None,
+    jobs: int | None = None,
+    protocols: str | Iterable[str] | None = None,
 ):
-    prots = _parse_printout_content(path, skip_pages=skip_pages)
-    base = {
-        'Manufacturer': 'Siemens',
-        'ManufacturersModelName': prots[0]['Header']['ModelName'],
-        'SoftwareVersions': prots[0]['Header']['SoftwareVersions'],
-    }
-
-    if isinstance(nii, str):
-        nii = [nii]
-    nii = list(nii or [])
-    nii += max(0, len(prots)-len(nii)) * [{}]
-    nii = [dict(file=x) if isinstance(x, str) else x for x in nii]
-
-    sidecars = {}
-    for prot, info in zip(prots, nii):
-        # Convert to BIDS
-        sidecar = {**base, **siemens_to_bids(prot, **info)}
-        # Save BIDS sidecar
-        sidecars[prot['Header']['path']] = sidecar
-    return sidecars
+    return dict(iter_sidecars(
+        path, nii, skip_pages=skip_pages, jobs=jobs, protocols=protocols
+    ))